@@ -4,10 +4,13 @@ from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from sqlite3 import Connection
 from Models.user import UserCreate, UserResponse, UserInDB, Token
-from database import get_db, login_user, create_tables
+from database import get_db, login_user, create_tables, async_db_connection
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from repositories.user_repository import UserRepository
+from principal_cache import get_principal_cache
+from password_hasher import PasswordHasherBusy, get_password_hasher
+from image_store import ImageTooLarge, RemoteImageError, get_image_store
 import shutil
 import sqlite3
 import os
@@ -19,7 +22,6 @@ from pathlib import Path
 from pydantic import BaseModel
 import hashlib
 import time
-import httpx
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -41,42 +43,63 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
+def _load_user(db: Connection, email: str) -> UserInDB:
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
+        user = cursor.fetchone()
+        
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+            
+        return UserInDB(
+            id=user["id"],
+            name=user["name"],
+            email=user["email"],
+            password=user["password"],
+            private_password=user["private_password"],
+            profileImage=user["profileImage"] if "profileImage" in user.keys() else None,
+            created_at=user["created_at"] if "created_at" in user.keys() else None
+        )
+    finally:
+        cursor.close()
+
+
+async def _authenticate(token: str, db: Optional[Connection]) -> UserInDB:
+    # Dashboard gọi nhiều API cùng token: chỉ giải mã và đọc bảng users ở lần đầu
+    principal_cache = get_principal_cache()
+    cached = principal_cache.get(token)
+    if cached:
+        return cached[1]
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if not email:
             raise HTTPException(status_code=401, detail="Invalid credentials")
             
-        conn = sqlite3.connect("wallet.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-            user = cursor.fetchone()
-            
-            if not user:
-                raise HTTPException(status_code=401, detail="User not found")
-                
-            return UserInDB(
-                id=user["id"],
-                name=user["name"],
-                email=user["email"],
-                password=user["password"],
-                private_password=user["private_password"],
-                profileImage=user["profileImage"] if "profileImage" in user.keys() else None,
-                created_at=user["created_at"] if "created_at" in user.keys() else None
-            )
-        finally:
-            cursor.close()
-            conn.close()
+        version = principal_cache.version()
+        if db is not None:
+            current_user = _load_user(db, email)
+        else:
+            async with async_db_connection() as conn:
+                current_user = _load_user(conn, email)
+
+        principal_cache.set(token, payload, current_user, version)
+        return current_user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-PROFILE_IMAGES_DIR = "static/profile_images"
-Path(PROFILE_IMAGES_DIR).mkdir(parents=True, exist_ok=True)
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Connection = Depends(get_db)) -> UserInDB:
+    """Dùng lại kết nối của request (FastAPI cache dependency get_db) thay vì mượn thêm slot thứ hai từ pool"""
+    return await _authenticate(token, db)
+
+
+async def get_current_user_no_db(token: str = Depends(oauth2_scheme)) -> UserInDB:
+    """Cho route không giữ kết nối suốt request (deposit chờ receipt, websocket): chỉ mượn kết nối khi cache miss"""
+    return await _authenticate(token, None)
+
 
 @router.post("/register")
 async def register(
@@ -92,22 +115,13 @@ async def register(
        
         profile_image_path = None
         if profile_image and profile_image.filename:
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            file_ext = os.path.splitext(profile_image.filename)[1]
-            filename = f"{email}_{timestamp}{file_ext}"
-            profile_image_path = f"/static/profile_images/{filename}"
-            full_path = os.path.join(PROFILE_IMAGES_DIR, filename)
-           
-            logger.info(f"Saving profile image to relative path: {profile_image_path}")
-            logger.info(f"Full path on disk: {full_path}")
-           
-            file_content = await profile_image.read()
-            with open(full_path, "wb") as buffer:
-                buffer.write(file_content)
+            # Ghi theo chunk, đặt tên theo hash nội dung; thumbnail được tạo ở nền
+            stored = await get_image_store().save_upload(profile_image)
+            profile_image_path = stored.url
            
-            logger.info(f"Profile image saved successfully")
+            logger.info(f"Profile image saved to {profile_image_path}")
        
-        success, result = UserRepository.register_user(name, email, password, private_password, profile_image_path)
+        success, result = await UserRepository.register_user(name, email, password, private_password, profile_image_path)
        
         if not success:
             logger.error(f"Registration failed: {result}")
@@ -117,12 +131,18 @@ async def register(
             }
            
         logger.info(f"Registration successful for user: {email}")
+        result["profileImage"] = get_image_store().url_for(result.get("profileImage"))
         return {
             "status": "success",
             "message": "Registration successful",
             "user": result
         }
        
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except PasswordHasherBusy as e:
+        logger.warning(f"Registration rejected: {str(e)}")
+        raise HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Registration error: {str(e)}")
         return {
@@ -144,6 +164,9 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
             logger.warning(f"Login failed for user: {form_data.username}")
             raise HTTPException(status_code=401, detail=result.get("message", "Invalid credentials"))
 
+    except PasswordHasherBusy as e:
+        logger.warning(f"Login rejected: {str(e)}")
+        raise HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
         raise HTTPException(status_code=500, detail="Login failed")
@@ -168,6 +191,9 @@ async def login_form(
                 "message": result.get("message", "Invalid credentials")
             }
             
+    except PasswordHasherBusy as e:
+        logger.warning(f"Login rejected: {str(e)}")
+        raise HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
         return {
@@ -184,21 +210,19 @@ async def read_users_me(current_user: UserInDB = Depends(get_current_user)):
             "id": current_user.id,
             "name": current_user.name,
             "email": current_user.email,
-            "profileImage": current_user.profileImage
+            "profileImage": get_image_store().url_for(current_user.profileImage)
         }
     }
 
 @router.put("/change-name")
 async def change_name(
     new_name: str = Body(..., embed=True),
+    conn: Connection = Depends(get_db),
     current_user: UserInDB = Depends(get_current_user)
 ):
     try:
-        conn = sqlite3.connect("wallet.db")
-       
         conn.executescript("PRAGMA foreign_keys=OFF;")
         
-        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
       
@@ -210,7 +234,7 @@ async def change_name(
         user = cursor.fetchone()
         
         cursor.close()
-        conn.close()
+        get_principal_cache().invalidate_user(current_user.id)
         
         return {
             "status": "success",
@@ -221,7 +245,7 @@ async def change_name(
                 "email": user['email'],
                 "password": user['password'],
                 "private_password": user['private_password'],
-                "profileImage": user['profileImage'],
+                "profileImage": get_image_store().url_for(user['profileImage']),
                 "created_at": user['created_at']
             }
         }
@@ -233,34 +257,22 @@ async def change_name(
 async def change_image(
     profile_image: UploadFile = File(None),
     image_url: str = Form(None),
+    conn: Connection = Depends(get_db),
     current_user: UserInDB = Depends(get_current_user)
 ):
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    relative_path = None
-    if profile_image:
-        file_ext = os.path.splitext(profile_image.filename)[1]
-        filename = f"{current_user.email}{timestamp}{file_ext}"
-        relative_path = f"/static/profile_images/{filename}"
-        full_path = os.path.join("static", "profile_images", filename)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        with open(full_path, "wb+") as file_object:
-            file_object.write(await profile_image.read())
-    elif image_url:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(image_url)
-            if response.status_code != 200:
-                raise HTTPException(status_code=400, detail="Failed to fetch image from URL")
-            file_ext = os.path.splitext(image_url)[1] or ".jpg"
-            filename = f"{current_user.email}{timestamp}{file_ext}"
-            relative_path = f"/static/profile_images/{filename}"
-            full_path = os.path.join("static", "profile_images", filename)
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            with open(full_path, "wb") as file_object:
-                file_object.write(response.content)
-    else:
-        raise HTTPException(status_code=400, detail="Either profile_image or image_url must be provided")
-    conn = sqlite3.connect("wallet.db")
-    conn.row_factory = sqlite3.Row
+    image_store = get_image_store()
+    try:
+        if profile_image:
+            stored = await image_store.save_upload(profile_image)
+        elif image_url:
+            stored = await image_store.save_remote(image_url)
+        else:
+            raise HTTPException(status_code=400, detail="Either profile_image or image_url must be provided")
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except RemoteImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    relative_path = stored.url
     cursor = conn.cursor()
     cursor.execute(
         "UPDATE users SET profileImage = ? WHERE id = ?",
@@ -268,7 +280,7 @@ async def change_image(
     )
     conn.commit()
     cursor.close()
-    conn.close()
+    get_principal_cache().invalidate_user(current_user.id)
     return {
         "status": "success",
         "message": "Profile image updated successfully",
@@ -276,7 +288,7 @@ async def change_image(
             "id": current_user.id,
             "name": current_user.name,
             "email": current_user.email,
-            "profileImage": relative_path
+            "profileImage": image_store.url_for(relative_path)
         }
     }
     
@@ -290,10 +302,7 @@ async def verify_private_password(
         if not private_password:
             return {"success": False, "message": "Private password is required"}
         
-        from repositories.user_repository import pwd_context
-        
-
-        if pwd_context.verify(private_password, current_user.private_password):
+        if await get_password_hasher().verify(private_password, current_user.private_password):
             return {"success": True}
         else:
             return {"success": False, "message": "Incorrect private password"}
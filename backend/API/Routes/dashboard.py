@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends, BackgroundTasks, Query
+from typing import Dict, Any
+from sqlite3 import Connection
+from database import get_db
+from blockchain_service import BlockchainService, AsyncBlockchainService, get_blockchain_service, get_async_blockchain_service
+from repositories.wallet_repository import WalletRepository, refresh_wallets_in_background
+from repositories.transaction_repository import TransactionRepository
+from image_store import get_image_store
+from Models.user import UserInDB
+from API.Routes.auth import get_current_user
+import logging
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+DASHBOARD_TX_LIMIT = int(os.getenv("DASHBOARD_TX_LIMIT", "20"))
+DASHBOARD_TX_MAX_LIMIT = int(os.getenv("DASHBOARD_TX_MAX_LIMIT", "200"))
+# Trường ví trả cho trang chính; private key chỉ lấy qua /wallets/reveal, stale_after là nội bộ
+DASHBOARD_WALLET_FIELDS = ("id", "user_id", "label", "address", "balance", "created_at")
+
+
+@router.get("", response_model=Dict[str, Any])
+async def get_dashboard(
+    background_tasks: BackgroundTasks,
+    limit: int = Query(DASHBOARD_TX_LIMIT, ge=1, le=DASHBOARD_TX_MAX_LIMIT),
+    fresh: bool = False,
+    db: Connection = Depends(get_db),
+    blockchain: BlockchainService = Depends(get_blockchain_service),
+    async_blockchain: AsyncBlockchainService = Depends(get_async_blockchain_service),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Dữ liệu trang chính trong một request: user, các ví kèm số dư, giao dịch gần nhất của mọi ví.
+
+    Hai truy vấn trên một kết nối thay cho /wallets/user/{id} rồi /transactions/{address} cho từng ví.
+    """
+    try:
+        wallet_repo = WalletRepository(db, blockchain, async_blockchain)
+        wallets = wallet_repo.get_wallets_by_user_id(current_user.id, refresh=False)
+
+        # Cùng chính sách với /wallets/user/{id}: số dư đã lưu trả ngay, ví stale làm mới ở nền
+        stale = wallet_repo.stale_wallets(wallets)
+        if stale and fresh:
+            await wallet_repo.refresh_wallets_async(stale)
+        elif stale:
+            background_tasks.add_task(refresh_wallets_in_background, [dict(wallet) for wallet in stale])
+
+        tx_repo = TransactionRepository(db, blockchain)
+        transactions = tx_repo.get_recent_transactions([wallet["address"] for wallet in wallets], limit=limit)
+
+        return {
+            "status": "success",
+            "user": {
+                "id": current_user.id,
+                "name": current_user.name,
+                "email": current_user.email,
+                "profileImage": get_image_store().url_for(current_user.profileImage)
+            },
+            "wallets": [{field: wallet[field] for field in DASHBOARD_WALLET_FIELDS} for wallet in wallets],
+            "total_balance": sum(wallet["balance"] for wallet in wallets),
+            "transactions": transactions
+        }
+    except Exception as e:
+        logger.error(f"Error building dashboard: {str(e)}")
+        return {"status": "error", "message": "Failed to load dashboard", "wallets": [], "transactions": []}
@@ -1,12 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, WebSocket, WebSocketDisconnect, Query, Response
 from fastapi.security import OAuth2PasswordBearer
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Literal
 from database import get_db
+from blockchain_service import BlockchainService, get_blockchain_service
 from repositories.wallet_repository import WalletRepository
 from repositories.transaction_repository import TransactionRepository
+from receipt_tracker import get_receipt_tracker, get_transaction_status
 from Models.transaction import BlockchainTransactionCreate
 from datetime import datetime
 import logging
+import os
 import sqlite3
 from sqlite3 import Connection
 from Models.user import UserInDB
@@ -19,17 +22,21 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+TX_WS_TIMEOUT = float(os.getenv("TX_WS_TIMEOUT", "300"))
+TX_HISTORY_MAX_LIMIT = int(os.getenv("TX_HISTORY_MAX_LIMIT", "500"))
+
 
 @router.post("/blockchain", response_model=Dict[str, Any])
 async def create_blockchain_transaction(
     transaction: BlockchainTransactionCreate,
-    db: Connection = Depends(get_db)
+    db: Connection = Depends(get_db),
+    blockchain: BlockchainService = Depends(get_blockchain_service)
 ):
     """Tạo giao dịch mới trên blockchain"""
     try:
        
-        tx_repo = TransactionRepository(db)
-        wallet_repo = WalletRepository(db)
+        tx_repo = TransactionRepository(db, blockchain)
+        wallet_repo = WalletRepository(db, blockchain)
         
    
         source_wallet = wallet_repo.get_wallet_by_address(transaction.from_wallet)
@@ -64,27 +71,90 @@ async def create_blockchain_transaction(
         raise HTTPException(status_code=500, detail=f"Error creating blockchain transaction: {str(e)}")
 
 
+@router.get("/status/{tx_hash}", response_model=Dict[str, Any])
+async def get_transaction_status_route(tx_hash: str):
+    """Trạng thái giao dịch (pending/completed/failed) do ReceiptTracker cập nhật"""
+    transaction = await get_transaction_status(tx_hash)
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return {"status": "success", "transaction": transaction}
+
+
+@router.websocket("/ws/{tx_hash}")
+async def transaction_status_ws(websocket: WebSocket, tx_hash: str):
+    """Đẩy trạng thái cuối cùng của giao dịch cho client ngay khi có receipt"""
+    await websocket.accept()
+    try:
+        tx_hash = tx_hash[2:] if tx_hash.startswith("0x") else tx_hash
+        transaction = await get_transaction_status(tx_hash)
+        if not transaction:
+            await websocket.send_json({"status": "error", "message": "Transaction not found"})
+            return
+        if transaction["status"] == "pending":
+            await websocket.send_json({"status": "success", "transaction": transaction})
+            transaction = await get_receipt_tracker().wait_for(tx_hash, timeout=TX_WS_TIMEOUT) or transaction
+        await websocket.send_json({"status": "success", "transaction": transaction})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        try:
+            await websocket.close()
+        except RuntimeError:
+            pass
+
+
 @router.get("/{wallet_address}", response_model=List[Dict[str, Any]])
 async def get_transactions(
     wallet_address: str,
-    db: Connection = Depends(get_db)
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=TX_HISTORY_MAX_LIMIT),
+    direction: Literal["all", "in", "out"] = "all",
+    status: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Connection = Depends(get_db),
+    blockchain: BlockchainService = Depends(get_blockchain_service)
 ):
+    """Lịch sử giao dịch phân trang theo cursor; cursor trang sau nằm ở header X-Next-Cursor"""
     try:
      
-        wallet_repo = WalletRepository(db)
-        tx_repo = TransactionRepository(db)
+        wallet_repo = WalletRepository(db, blockchain)
+        tx_repo = TransactionRepository(db, blockchain)
         
     
         wallet = wallet_repo.get_wallet_by_address(wallet_address)
         if not wallet:
             raise HTTPException(status_code=404, detail="Wallet not found")
         
-    
-        transactions = tx_repo.get_transactions_by_address(wallet_address)
-        
+        try:
+            transactions, next_cursor = tx_repo.get_transaction_page(
+                wallet_address,
+                limit=limit,
+                cursor=cursor,
+                direction=direction,
+                status=status,
+                min_amount=min_amount,
+                max_amount=max_amount,
+                since=_epoch(since),
+                until=_epoch(until)
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
         return transactions
     except HTTPException as he:
         raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting transactions: {str(e)}")
-  
\ No newline at end of file
+
+
+def _epoch(value: Optional[datetime]) -> Optional[int]:
+    # Không có múi giờ thì hiểu là giờ địa phương, như timestamp các writer ghi vào DB
+    if value is None:
+        return None
+    return int(value.timestamp())
@@ -1,16 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body, File, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, status, Body, File, UploadFile, BackgroundTasks, WebSocket, WebSocketDisconnect, Query
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.responses import StreamingResponse
 from typing import List, Optional, Dict, Any
 import json
 import os
-from datetime import datetime
+from datetime import datetime, date
 from sqlite3 import Connection
 from Models.wallet import Wallet, WalletCreate, WalletResponse, BlockchainTransfer
-from database import get_db
-from repositories.wallet_repository import WalletRepository
+from database import get_db, async_db_connection
+from blockchain_service import BlockchainService, AsyncBlockchainService, get_blockchain_service, get_async_blockchain_service
+from repositories.wallet_repository import WalletRepository, refresh_wallets_in_background
+from repositories.wallet_stats_repository import WalletStatsRepository
+from receipt_tracker import get_receipt_tracker
+from balance_feed import get_balance_feed
+from wallet_export import export_wallet, available_formats
 from Models.user import UserInDB
-from API.Routes.auth import get_current_user
+from API.Routes.auth import get_current_user, get_current_user_no_db
 import logging
+import asyncio
 import time
 
 
@@ -21,11 +28,17 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+TRANSFER_CONFIRM_TIMEOUT = float(os.getenv("TRANSFER_CONFIRM_TIMEOUT", "30"))
+DEPOSIT_CONFIRM_TIMEOUT = float(os.getenv("DEPOSIT_CONFIRM_TIMEOUT", "30"))
+# Số giao dịch tối đa trong một lô chi trả
+TRANSFER_BATCH_MAX = int(os.getenv("TRANSFER_BATCH_MAX", "100"))
+
 
 @router.post("/create", response_model=Dict[str, Any])
 async def create_wallet(
     wallet_data: WalletCreate = Body(...),
     db: Connection = Depends(get_db),
+    blockchain: BlockchainService = Depends(get_blockchain_service),
     current_user: UserInDB = Depends(get_current_user)
 ):
     try:
@@ -36,7 +49,7 @@ async def create_wallet(
         if wallet_data.user_id != current_user.id:
             return {"status": "error", "message": "Unauthorized: user_id does not match current user"}
             
-        wallet_repo = WalletRepository(db)
+        wallet_repo = WalletRepository(db, blockchain)
         
         
         wallet_id = wallet_repo.create_wallet({
@@ -62,15 +75,26 @@ async def create_wallet(
 @router.get("/user/{user_id}", response_model=Dict[str, Any])
 async def get_user_wallets(
     user_id: int,
+    background_tasks: BackgroundTasks,
+    fresh: bool = False,
     db: Connection = Depends(get_db),
+    blockchain: BlockchainService = Depends(get_blockchain_service),
+    async_blockchain: AsyncBlockchainService = Depends(get_async_blockchain_service),
     current_user: UserInDB = Depends(get_current_user)
 ):
     try:
         if user_id != current_user.id:
             return {"status": "error", "message": "Unauthorized: cannot access other user's wallets"}
         
-        wallet_repo = WalletRepository(db)
-        wallets = wallet_repo.get_wallets_by_user_id(user_id)
+        wallet_repo = WalletRepository(db, blockchain, async_blockchain)
+        wallets = wallet_repo.get_wallets_by_user_id(user_id, refresh=False)
+        
+        # Trả số dư đã lưu ngay; ví quá stale_after được làm mới ở nền (hoặc trước khi trả nếu fresh=true)
+        stale = wallet_repo.stale_wallets(wallets)
+        if stale and fresh:
+            await wallet_repo.refresh_wallets_async(stale)
+        elif stale:
+            background_tasks.add_task(refresh_wallets_in_background, [dict(wallet) for wallet in stale])
         
         return {"status": "success", "wallets": wallets}
     except Exception as e:
@@ -78,14 +102,74 @@ async def get_user_wallets(
         return {"status": "error", "message": "Failed to get wallets", "wallets": []}
 
 
+@router.websocket("/ws")
+async def wallet_updates_ws(websocket: WebSocket, token: str):
+    """Đẩy thay đổi số dư các ví của user mỗi khi block mới chạm tới ví (thay cho việc client tự poll)"""
+    try:
+        current_user = await get_current_user_no_db(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    feed = get_balance_feed()
+    queue = await feed.subscribe(current_user.id)
+    
+    async def push():
+        while True:
+            await websocket.send_json(await queue.get())
+    
+    # Đọc song song để phát hiện client đóng kết nối ngay cả khi không có gì để đẩy
+    pusher = asyncio.create_task(push())
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        pusher.cancel()
+        feed.unsubscribe(current_user.id, queue)
+
+
+@router.get("/export")
+async def export_wallet_data(
+    wallet_address: str,
+    format: str = "csv",
+    db: Connection = Depends(get_db),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Xuất lịch sử giao dịch của ví dạng stream (csv, ndjson, parquet, arrow)"""
+    # Chỉ cần kiểm tra quyền: đọc từ DB, không gọi node lấy số dư
+    wallet = WalletRepository(db).get_wallet_by_address_no_blockchain(wallet_address)
+    if not wallet:
+        raise HTTPException(status_code=404, detail="Wallet not found")
+    if wallet["user_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Unauthorized: you do not own this wallet")
+
+    export = export_wallet(wallet, format.lower())
+    if export is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported export format '{format}'. Available: {', '.join(available_formats())}"
+        )
+    content, media_type, filename = export
+    # Generator đồng bộ: Starlette chạy từng bước trong threadpool, byte đầu tiên gửi ngay sau batch đầu
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 @router.get("/{wallet_id}", response_model=Dict[str, Any])
 async def get_wallet(
     wallet_id: int,
     db: Connection = Depends(get_db),
+    blockchain: BlockchainService = Depends(get_blockchain_service),
     current_user: UserInDB = Depends(get_current_user)
 ):
     try:
-        wallet_repo = WalletRepository(db)
+        wallet_repo = WalletRepository(db, blockchain)
         wallet = wallet_repo.get_wallet_by_id(wallet_id)
         
         if not wallet:
@@ -99,14 +183,76 @@ async def get_wallet(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting wallet: {str(e)}")
     
+def _owned_wallet(stats_repo: WalletStatsRepository, wallet_id: int, current_user: UserInDB) -> Dict[str, Any]:
+    wallet = stats_repo.get_wallet(wallet_id)
+    if not wallet:
+        raise HTTPException(status_code=404, detail="Wallet not found")
+    if wallet["user_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Unauthorized: you do not own this wallet")
+    return wallet
+
+
+@router.get("/{wallet_id}/stats", response_model=Dict[str, Any])
+async def get_wallet_stats(
+    wallet_id: int,
+    days: int = Query(30, ge=1, le=3650),
+    db: Connection = Depends(get_db),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Tổng tiền vào/ra và số giao dịch, đọc từ bảng thống kê theo ngày thay vì toàn bộ lịch sử"""
+    try:
+        stats_repo = WalletStatsRepository(db)
+        wallet = _owned_wallet(stats_repo, wallet_id, current_user)
+        stats = stats_repo.get_stats(wallet["address"], days)
+        return {"status": "success", "wallet_id": wallet_id, "balance": wallet["balance"], "stats": stats}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting wallet stats: {str(e)}")
+
+
+@router.get("/{wallet_id}/balance-history", response_model=Dict[str, Any])
+async def get_wallet_balance_history(
+    wallet_id: int,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    limit: int = Query(365, ge=1, le=3650),
+    db: Connection = Depends(get_db),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Số dư cuối ngày (UTC) theo thời gian cho biểu đồ; mỗi ngày có giao dịch một điểm"""
+    try:
+        stats_repo = WalletStatsRepository(db)
+        wallet = _owned_wallet(stats_repo, wallet_id, current_user)
+        history = stats_repo.get_balance_history(
+            wallet["address"],
+            since_day=_day(since),
+            until_day=_day(until),
+            limit=limit
+        )
+        return {"status": "success", "wallet_id": wallet_id, "history": history}
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting balance history: {str(e)}")
+
+
+def _day(value: Optional[date]) -> Optional[int]:
+    # Số thứ tự ngày UTC, cùng cách chia của wallet_daily_stats.day
+    if value is None:
+        return None
+    return (value - date(1970, 1, 1)).days
+
+
 @router.delete("/{wallet_id}", response_model=Dict[str, Any])
 async def delete_wallet(
    wallet_id: int,
    db: Connection = Depends(get_db),
+   blockchain: BlockchainService = Depends(get_blockchain_service),
    current_user: UserInDB = Depends(get_current_user)
 ):
    try:
-       wallet_repo = WalletRepository(db)
+       wallet_repo = WalletRepository(db, blockchain)
        wallet = wallet_repo.get_wallet_by_id(wallet_id)
        
        if not wallet:
@@ -126,10 +272,11 @@ async def delete_wallet(
 async def get_wallet_by_address(
     address: str,
     db: Connection = Depends(get_db),
+    blockchain: BlockchainService = Depends(get_blockchain_service),
     current_user: UserInDB = Depends(get_current_user)
 ):
     try:
-        wallet_repo = WalletRepository(db)
+        wallet_repo = WalletRepository(db, blockchain)
         wallet = wallet_repo.get_wallet_by_address(address)
         
         if not wallet:
@@ -147,6 +294,7 @@ async def get_wallet_by_address(
 async def reveal_wallet(
     wallet_data: Dict[str, Any] = Body(...),
     db: Connection = Depends(get_db),
+    blockchain: BlockchainService = Depends(get_blockchain_service),
     current_user: UserInDB = Depends(get_current_user)
 ):
     try:
@@ -154,7 +302,7 @@ async def reveal_wallet(
         if not wallet_address:
             raise HTTPException(status_code=400, detail="wallet_address is required")
         
-        wallet_repo = WalletRepository(db)
+        wallet_repo = WalletRepository(db, blockchain)
         wallet = wallet_repo.get_wallet_by_address(wallet_address)
         
         if not wallet:
@@ -189,8 +337,9 @@ async def reveal_wallet(
 @router.post("/deposit", response_model=dict)
 async def deposit_money(
     deposit_data: Dict[str, Any] = Body(...),
-    db: Connection = Depends(get_db),
-    current_user: UserInDB = Depends(get_current_user)
+    blockchain: BlockchainService = Depends(get_blockchain_service),
+    async_blockchain: AsyncBlockchainService = Depends(get_async_blockchain_service),
+    current_user: UserInDB = Depends(get_current_user_no_db)
 ):
     try:
         wallet_address = deposit_data.get("wallet_address")
@@ -208,77 +357,53 @@ async def deposit_money(
             logger.error(f"API: Invalid amount {amount}")
             return {"status": "error", "message": "amount must be greater than 0"}
         
-     
-        wallet_repo = WalletRepository(db)
-        
+        # Kết nối chỉ được giữ tới khi gửi xong giao dịch, không giữ trong lúc chờ receipt
+        async with async_db_connection() as db:
+            wallet_repo = WalletRepository(db, blockchain, async_blockchain)
 
-        logger.info(f"API: Blockchain URL: {wallet_repo.blockchain.blockchain_url}")
-        logger.info(f"API: Web3 provider: {wallet_repo.blockchain.w3.provider}")
-        
+            logger.info(f"API: Blockchain URL: {async_blockchain.blockchain_url}")
+            logger.info(f"API: Web3 provider: {async_blockchain.w3.provider}")
 
-        if not wallet_repo.blockchain.is_valid_eth_address(wallet_address):
-            logger.error(f"API: Invalid Ethereum address format: {wallet_address}")
-            return {"status": "error", "message": "Invalid Ethereum wallet address format"}
-        
-   
-        if not wallet_repo.blockchain.w3.is_connected():
-            logger.error("API: Blockchain connection error - not connected to Ganache")
-            return {"status": "error", "message": "Cannot connect to blockchain node (Ganache). Please verify that Ganache is running."}
-            
-      
-        try:
-            accounts = wallet_repo.blockchain.w3.eth.accounts
-            logger.info(f"API: Found {len(accounts)} accounts in Ganache")
-            
-            if len(accounts) == 0:
-                logger.error("API: No accounts found in Ganache")
-                return {"status": "error", "message": "No accounts found in Ganache. Please check your Ganache configuration."}
-                
-         
-            for idx, account in enumerate(accounts[:3]):
-                balance = wallet_repo.blockchain.w3.eth.get_balance(account)
-                balance_eth = wallet_repo.blockchain.w3.from_wei(balance, "ether")
-                logger.info(f"API: Ganache account #{idx}: {account} - {balance_eth} ETH")
-        except Exception as acc_error:
-            logger.error(f"API: Error accessing Ganache accounts: {str(acc_error)}")
-            return {"status": "error", "message": f"Error accessing Ganache accounts: {str(acc_error)}"}
-        
-      
-        logger.info(f"API: Checking wallet {wallet_address} in database")
-        wallet = wallet_repo.get_wallet_by_address(wallet_address)
-        
-        if not wallet:
-            logger.error(f"API: Wallet {wallet_address} not found in database")
-            return {"status": "error", "message": "Wallet not found in database"}
-            
-        if wallet["user_id"] != current_user.id:
-            logger.error(f"API: Unauthorized wallet access by user {current_user.id}")
-            return {"status": "error", "message": "Unauthorized: you do not own this wallet"}
-        
-      
-        try:
-            previous_balance = wallet_repo.blockchain.get_balance(wallet_address)
-            logger.info(f"API: Current balance for {wallet_address}: {previous_balance} ETH")
-        except Exception as balance_error:
-            logger.error(f"API: Error checking current balance: {str(balance_error)}")
-            previous_balance = float(wallet.get("balance", 0))
-            logger.info(f"API: Using database balance: {previous_balance} ETH")
-        
-        
-        logger.info(f"API: Initiating deposit from Ganache to {wallet_address} for {amount} ETH")
-        success, result = wallet_repo.deposit_from_ganache(wallet_address, amount)
+            if not async_blockchain.is_valid_eth_address(wallet_address):
+                logger.error(f"API: Invalid Ethereum address format: {wallet_address}")
+                return {"status": "error", "message": "Invalid Ethereum wallet address format"}
+
+            logger.info(f"API: Checking wallet {wallet_address} in database")
+            wallet = await wallet_repo.get_wallet_by_address_async(wallet_address)
+
+            if not wallet:
+                logger.error(f"API: Wallet {wallet_address} not found in database")
+                return {"status": "error", "message": "Wallet not found in database"}
+
+            if wallet["user_id"] != current_user.id:
+                logger.error(f"API: Unauthorized wallet access by user {current_user.id}")
+                return {"status": "error", "message": "Unauthorized: you do not own this wallet"}
+
+            try:
+                previous_balance = await async_blockchain.get_balance(wallet_address)
+                logger.info(f"API: Current balance for {wallet_address}: {previous_balance} ETH")
+            except Exception as balance_error:
+                logger.error(f"API: Error checking current balance: {str(balance_error)}")
+                previous_balance = float(wallet.get("balance", 0))
+                logger.info(f"API: Using database balance: {previous_balance} ETH")
+
+            logger.info(f"API: Initiating deposit from Ganache to {wallet_address} for {amount} ETH")
+            success, result = await wallet_repo.deposit_from_ganache_async(wallet_address, amount)
         
         if not success:
             logger.error(f"API: Deposit failed: {result}")
             return {"status": "error", "message": f"Deposit failed: {result}"}
         
-     
-        import time
-        time.sleep(2) 
+        # Chờ receipt qua ReceiptTracker thay vì ngủ một khoảng cố định
+        tx_status = result.get("status")
+        confirmed = await get_receipt_tracker().wait_for(result["hash"], timeout=DEPOSIT_CONFIRM_TIMEOUT)
+        if confirmed:
+            tx_status = confirmed["status"]
+        if tx_status == "failed":
+            return {"status": "error", "message": "Deposit failed: transaction reverted", "transaction_hash": result["hash"]}
         
-      
         try:
-            updated_balance = wallet_repo.blockchain.get_balance(wallet_address)
+            updated_balance = await async_blockchain.get_balance(wallet_address)
             logger.info(f"API: Balance after deposit: {previous_balance} -> {updated_balance}")
         except Exception as balance_error:
             logger.error(f"API: Error updating balance after deposit: {str(balance_error)}")
@@ -289,8 +414,9 @@ async def deposit_money(
        
         response = {
             "status": "success",
-            "message": "Deposit completed successfully",
+            "message": "Deposit submitted, waiting for confirmation" if tx_status == "pending" else "Deposit completed successfully",
             "transaction_hash": result.get("hash", ""),
+            "transaction_status": tx_status,
             "from_account": result.get("from", "Unknown sender"),
             "gas_used": result.get("gas_used", 0),
             "wallet": {
@@ -311,51 +437,21 @@ async def deposit_money(
 async def get_wallet_balance(
     address: str,
     db: Connection = Depends(get_db),
+    blockchain: BlockchainService = Depends(get_blockchain_service),
+    async_blockchain: AsyncBlockchainService = Depends(get_async_blockchain_service),
     current_user: UserInDB = Depends(get_current_user)
 ):
     try:
-        
-        cache_key = f"balance_{address}"
-        current_time = time.time()
-        
-       
-        cursor = db.cursor()
-        cursor.execute("PRAGMA temp.table_info(response_cache)")
-        if cursor.fetchone():
-            cursor.execute("SELECT data, timestamp FROM response_cache WHERE key = ?", (cache_key,))
-            cache_row = cursor.fetchone()
-            
-            if cache_row and (current_time - cache_row[1]) < 10.0:  
-                
-               
-                logger.info(f"Using cached balance for address {address}")
-                return json.loads(cache_row[0])
-        
-       
-        wallet_repo = WalletRepository(db)
-        wallet = wallet_repo.get_wallet_by_address(address)
+        # Số dư đi qua BalanceCache của WalletRepository (TTL, invalidate khi chuyển/nạp tiền)
+        wallet_repo = WalletRepository(db, blockchain, async_blockchain)
+        wallet = await wallet_repo.get_wallet_by_address_async(address)
         
         if not wallet:
             raise HTTPException(status_code=404, detail="Wallet not found")
         if wallet["user_id"] != current_user.id:
             raise HTTPException(status_code=403, detail="Unauthorized: you do not own this wallet")
         
-        balance = wallet_repo.blockchain.get_balance(address)
-        if abs(float(balance) - float(wallet["balance"])) > 0.0001:
-            cursor = wallet_repo.db.cursor()
-            cursor.execute("UPDATE wallets SET balance = ? WHERE address = ?", (balance, address))
-            wallet_repo.db.commit()
-        
-        result = {"status": "success", "address": address, "balance": balance}
-        
-        
-        cursor.execute(
-            "INSERT OR REPLACE INTO response_cache (key, data, timestamp) VALUES (?, ?, ?)",
-            (cache_key, json.dumps(result), current_time)
-        )
-        db.commit()
-        
-        return result
+        return {"status": "success", "address": address, "balance": float(wallet["balance"])}
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -364,8 +460,9 @@ async def get_wallet_balance(
 @router.post("/transfer", response_model=dict)
 async def transfer_money(
     transfer_data: Dict[str, Any] = Body(...),
-    db: Connection = Depends(get_db),
-    current_user: UserInDB = Depends(get_current_user)
+    blockchain: BlockchainService = Depends(get_blockchain_service),
+    async_blockchain: AsyncBlockchainService = Depends(get_async_blockchain_service),
+    current_user: UserInDB = Depends(get_current_user_no_db)
 ):
     try:
         from_wallet = transfer_data.get("from_wallet")
@@ -386,42 +483,121 @@ async def transfer_money(
         if amount <= 0:
             return {"status": "error", "message": "Amount must be greater than 0"}
        
-        wallet_repo = WalletRepository(db)
+        # Như deposit: kết nối chỉ giữ tới khi gửi xong, không giữ trong lúc chờ receipt
+        async with async_db_connection() as db:
+            wallet_repo = WalletRepository(db, blockchain, async_blockchain)
        
-        source_wallet = wallet_repo.get_wallet_by_address(from_wallet)
-        if not source_wallet:
-            return {"status": "error", "message": "Source wallet not found"}
+            source_wallet = await wallet_repo.get_wallet_by_address_async(from_wallet)
+            if not source_wallet:
+                return {"status": "error", "message": "Source wallet not found"}
 
-        if not bypass_auth and source_wallet["user_id"] != current_user.id:
-            return {"status": "error", "message": "Unauthorized: you do not own this wallet"}
+            if not bypass_auth and source_wallet["user_id"] != current_user.id:
+                return {"status": "error", "message": "Unauthorized: you do not own this wallet"}
        
-        private_key = source_wallet["private_key"]
+            private_key = source_wallet["private_key"]
 
-        if not bypass_auth:
-            balance = wallet_repo.blockchain.get_balance(from_wallet)
-            if balance < amount:
-                return {"status": "error", "message": f"Insufficient balance: {balance} < {amount}"}
+            if not bypass_auth:
+                balance = await async_blockchain.get_balance(from_wallet)
+                if balance < amount:
+                    return {"status": "error", "message": f"Insufficient balance: {balance} < {amount}"}
        
-        success, result = wallet_repo.transfer(
-            from_wallet,
-            to_wallet,
-            amount,
-            private_key
-        )
+            success, result = await wallet_repo.transfer_async(
+                from_wallet,
+                to_wallet,
+                amount,
+                private_key
+            )
        
         if not success:
             return {"status": "error", "message": f"Transfer failed: {result}"}
        
-        updated_balance = wallet_repo.blockchain.get_balance(from_wallet)
+        tx_status = result.get("status")
+        if tx_status == "pending" and transfer_data.get("wait_for_confirmation", False):
+            confirmed = await get_receipt_tracker().wait_for(result.get("hash"), timeout=TRANSFER_CONFIRM_TIMEOUT)
+            if confirmed:
+                tx_status = confirmed["status"]
+       
+        updated_balance = await async_blockchain.get_balance(from_wallet)
        
         return {
             "status": "success",
-            "message": "Transfer completed successfully",
+            "message": "Transfer submitted, waiting for confirmation" if tx_status == "pending" else "Transfer completed successfully",
             "transaction_hash": result.get("hash", ""),
+            "transaction_status": tx_status,
             "updated_balance": updated_balance
         }
        
     except Exception as e:
         # A08 Vulnerability: Revealing detailed error messages
         return {"status": "error", "message": str(e)}
-    
+
+
+@router.post("/transfer/batch", response_model=dict)
+async def transfer_batch(
+    batch_data: Dict[str, Any] = Body(...),
+    db: Connection = Depends(get_db),
+    blockchain: BlockchainService = Depends(get_blockchain_service),
+    async_blockchain: AsyncBlockchainService = Depends(get_async_blockchain_service),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Chi trả từ một ví tới nhiều địa chỉ: {"from_wallet", "transfers": [{"to_wallet", "amount"}], "confirm"}"""
+    try:
+        from_wallet = batch_data.get("from_wallet")
+        items = batch_data.get("transfers") or []
+        
+        if not from_wallet or not items:
+            return {"status": "error", "message": "Missing required fields: from_wallet, transfers"}
+        
+        if not batch_data.get("confirm", False):
+            return {"status": "error", "message": "Transaction must be confirmed"}
+        
+        if len(items) > TRANSFER_BATCH_MAX:
+            return {"status": "error", "message": f"At most {TRANSFER_BATCH_MAX} transfers per batch"}
+        
+        transfers = []
+        for index, item in enumerate(items):
+            to_wallet = item.get("to_wallet")
+            amount = float(item.get("amount", 0))
+            if not async_blockchain.is_valid_eth_address(to_wallet):
+                return {"status": "error", "message": f"Invalid to_wallet at index {index}"}
+            if amount <= 0:
+                return {"status": "error", "message": f"Amount must be greater than 0 at index {index}"}
+            transfers.append((to_wallet, amount))
+        
+        wallet_repo = WalletRepository(db, blockchain, async_blockchain)
+        
+        source_wallet = wallet_repo.get_wallet_by_address_no_blockchain(from_wallet)
+        if not source_wallet:
+            return {"status": "error", "message": "Source wallet not found"}
+        
+        if source_wallet["user_id"] != current_user.id:
+            return {"status": "error", "message": "Unauthorized: you do not own this wallet"}
+        
+        # Số dư được kiểm tra một lần cho cả lô trong send_batch (tổng tiền + gas)
+        success, result = await wallet_repo.transfer_batch_async(from_wallet, transfers, source_wallet["private_key"])
+        
+        if not success:
+            return {"status": "error", "message": f"Batch transfer failed: {result}"}
+        
+        response = {
+            "status": "success" if result["status"] == "pending" else "partial",
+            "message": f"Submitted {len(result['transactions'])} of {len(transfers)} transfers, waiting for confirmation",
+            "transactions": [
+                {
+                    "transaction_hash": tx["hash"],
+                    "to_wallet": tx["to_wallet"],
+                    "amount": tx["amount"],
+                    "nonce": tx["nonce"],
+                    "transaction_status": tx["status"]
+                }
+                for tx in result["transactions"]
+            ]
+        }
+        if result["status"] == "partial":
+            response["error"] = result["error"]
+            response["unsent"] = result["unsent"]
+        return response
+        
+    except Exception as e:
+        # A08 Vulnerability: Revealing detailed error messages
+        return {"status": "error", "message": str(e)}
@@ -0,0 +1,128 @@
+from typing import Optional, Dict, List, Tuple, Iterable
+from collections import OrderedDict
+import threading
+import logging
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "10"))
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", "10000"))
+
+
+class BalanceCache:
+    """Cache số dư on-chain theo địa chỉ (LRU + TTL) trong tiến trình.
+
+    Mỗi lần invalidate tăng version; giá trị đọc từ node trước thời điểm invalidate
+    sẽ không được ghi đè lên (tránh đưa số dư cũ trở lại cache sau khi chuyển tiền).
+    """
+
+    def __init__(self, max_entries: int = BALANCE_CACHE_SIZE, ttl: float = BALANCE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()
+        self._version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def version(self) -> int:
+        """Lấy trước khi gọi node, truyền lại cho set()"""
+        with self._lock:
+            return self._version
+
+    def get(self, address: str) -> Optional[float]:
+        with self._lock:
+            return self._get(address)
+
+    def get_many(self, addresses: Iterable[str]) -> Tuple[Dict[str, float], List[str]]:
+        """Trả về (số dư đã có trong cache, các địa chỉ cần hỏi node)"""
+        found, missing = {}, []
+        with self._lock:
+            for address in addresses:
+                balance = self._get(address)
+                if balance is None:
+                    missing.append(address)
+                else:
+                    found[address] = balance
+        return found, missing
+
+    def set(self, address: str, balance: float, version: int = None):
+        with self._lock:
+            self._set(address, balance, version)
+
+    def set_many(self, balances: Dict[str, float], version: int = None):
+        with self._lock:
+            for address, balance in balances.items():
+                self._set(address, balance, version)
+
+    def invalidate(self, *addresses: str):
+        with self._lock:
+            self._version += 1
+            for address in addresses:
+                if not address:
+                    continue
+                self._entries.pop(address, None)
+                self._invalidated[address] = self._version
+                self._invalidated.move_to_end(address)
+                self.invalidations += 1
+            while len(self._invalidated) > self.max_entries:
+                self._invalidated.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _get(self, address: str) -> Optional[float]:
+        entry = self._entries.get(address)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            if entry is not None:
+                del self._entries[address]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(address)
+        self.hits += 1
+        return entry[0]
+
+    def _set(self, address: str, balance: float, version: Optional[int]):
+        if version is not None and self._invalidated.get(address, 0) > version:
+            return
+        self._entries[address] = (float(balance), time.monotonic())
+        self._entries.move_to_end(address)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+_balance_cache: Optional[BalanceCache] = None
+_balance_cache_lock = threading.Lock()
+
+
+def get_balance_cache() -> BalanceCache:
+    """BalanceCache dùng chung cho toàn tiến trình"""
+    global _balance_cache
+    if _balance_cache is None:
+        with _balance_cache_lock:
+            if _balance_cache is None:
+                _balance_cache = BalanceCache()
+    return _balance_cache
@@ -0,0 +1,161 @@
+from typing import Optional, Dict, Any, Set, Iterable
+from blockchain_service import AsyncBlockchainService, get_async_blockchain_service
+from database import async_db_connection
+import asyncio
+import logging
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BALANCE_FEED_QUEUE_SIZE = int(os.getenv("BALANCE_FEED_QUEUE_SIZE", "100"))
+
+
+class BalanceFeed:
+    """Nhận địa chỉ bị ảnh hưởng bởi block mới, cập nhật wallets.balance một lần và đẩy delta qua WebSocket.
+
+    Số lần gọi node tỉ lệ với số block (một batch mỗi lần), không tỉ lệ với số client đang xem.
+    """
+
+    def __init__(self, async_blockchain: AsyncBlockchainService = None):
+        self.async_blockchain = async_blockchain or get_async_blockchain_service()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: Set[str] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._block_number: Optional[int] = None
+        # Số dư đã đẩy lần cuối theo địa chỉ: các đường ghi khác (nạp tiền, đọc số dư) cũng cập nhật
+        # wallets.balance nên không thể dựa vào giá trị trong DB để tính delta
+        self._known: Dict[str, float] = {}
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="balance-feed")
+        logger.info("Balance feed started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info("Balance feed stopped")
+
+    def notify_block(self, addresses: Iterable[str], block_number: int = None):
+        """Gọi từ ChainIndexer (thread khác) sau khi ghi block"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._enqueue, set(addresses), block_number)
+
+    def _enqueue(self, addresses: Set[str], block_number: Optional[int]):
+        self._pending.update(addresses)
+        if block_number is not None:
+            self._block_number = block_number
+        self._wake.set()
+
+    async def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=BALANCE_FEED_QUEUE_SIZE)
+        # Mốc để tính delta là số dư client đang thấy lúc đăng ký
+        async with async_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT address, balance FROM wallets WHERE user_id = ?", (user_id,))
+            for row in cursor.fetchall():
+                self._known.setdefault(row["address"], float(row["balance"] or 0))
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            # Gộp mọi block đến trong lúc đang xử lý vào một lần cập nhật
+            addresses, self._pending = self._pending, set()
+            try:
+                await self.refresh(addresses)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Balance feed error: {str(e)}")
+
+    async def refresh(self, addresses: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Đọc số dư mới cho các ví đang quản lý trong danh sách, ghi DB một lần và đẩy thay đổi"""
+        addresses = [address for address in set(addresses) if address]
+        if not addresses:
+            return {}
+
+        from repositories.wallet_repository import WalletRepository
+        async with async_db_connection() as conn:
+            cursor = conn.cursor()
+            placeholders = ", ".join("?" for _ in addresses)
+            cursor.execute(
+                f"SELECT id, user_id, address FROM wallets WHERE address IN ({placeholders})",
+                tuple(addresses)
+            )
+            wallets = {row["address"]: dict(row) for row in cursor.fetchall()}
+            if not wallets:
+                return {}
+            results = await WalletRepository(conn, async_blockchain=self.async_blockchain).update_wallet_balances_async(list(wallets))
+
+        for address, result in results.items():
+            if not result.get("success"):
+                continue
+            previous = self._known.get(address, result["previous"])
+            balance = float(result["balance"])
+            self._known[address] = balance
+            if abs(balance - previous) <= 0.0001:
+                continue
+            wallet = wallets[address]
+            self._publish(wallet["user_id"], {
+                "type": "balance",
+                "wallet_id": wallet["id"],
+                "address": address,
+                "balance": balance,
+                "delta": balance - previous,
+                "block_number": self._block_number
+            })
+        return results
+
+    def _publish(self, user_id: int, message: Dict[str, Any]):
+        for queue in list(self._subscribers.get(user_id, ())):
+            if queue.full():
+                # Client đọc chậm: bỏ bản cũ nhất, số dư mới nhất mới quan trọng
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+
+_balance_feed: Optional[BalanceFeed] = None
+
+
+def get_balance_feed() -> BalanceFeed:
+    """BalanceFeed dùng chung cho toàn app"""
+    global _balance_feed
+    if _balance_feed is None:
+        _balance_feed = BalanceFeed()
+    return _balance_feed
+
+
+def start_balance_feed() -> BalanceFeed:
+    feed = get_balance_feed()
+    feed.start()
+    return feed
+
+
+async def stop_balance_feed():
+    global _balance_feed
+    if _balance_feed is not None:
+        await _balance_feed.stop()
+        _balance_feed = None
@@ -0,0 +1,345 @@
+"""Benchmark tải cho các endpoint chính.
+
+Mặc định tự chạy uvicorn với BLOCKCHAIN_BACKEND=dev và DB tạm, nên không cần Ganache:
+
+    python benchmark.py --concurrency 16 --requests 200
+    python benchmark.py --url http://localhost:8000      # chạy vào server có sẵn
+    python benchmark.py --update-baseline                 # ghi lại benchmark_baseline.json
+    python benchmark.py --chain-nodes 3 --slow-node-latency 0.3   # RPC router, một node chậm
+
+Thoát với mã 1 nếu có request lỗi hoặc p95/throughput kém hơn baseline quá --tolerance.
+"""
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+from pathlib import Path
+import subprocess
+import tempfile
+import argparse
+import asyncio
+import logging
+import socket
+import shutil
+import httpx
+import json
+import time
+import sys
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+BACKEND_DIR = Path(__file__).resolve().parent
+DEFAULT_BASELINE = BACKEND_DIR / "benchmark_baseline.json"
+
+SCENARIOS = ["login", "wallets_user", "balance", "transfer", "transactions"]
+BENCH_PASSWORD = "bench-password"
+# Bỏ qua chênh lệch p95 nhỏ hơn ngưỡng này (nhiễu đo trên máy nhanh)
+DEFAULT_MIN_DELTA_MS = 5.0
+SERVER_START_TIMEOUT = 30
+
+
+class BenchmarkUser:
+    def __init__(self, email: str, user_id: int, token: str, wallets: List[str]):
+        self.email = email
+        self.user_id = user_id
+        self.token = token
+        self.wallets = wallets
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(workdir: Path, env: Dict[str, str], log_file=None) -> Tuple[subprocess.Popen, str]:
+    """Chạy uvicorn trong thư mục tạm: DB, static/profile_images riêng, node giả lập trong tiến trình"""
+    (workdir / "static" / "profile_images").mkdir(parents=True, exist_ok=True)
+    port = _free_port()
+    server_env = dict(os.environ)
+    server_env.update({
+        "DATABASE_PATH": str(workdir / "wallet.db"),
+        "BLOCKCHAIN_BACKEND": "dev",
+        "INDEXER_POLL_INTERVAL": "0.5",
+        "TRACKER_POLL_INTERVAL": "0.5",
+    })
+    server_env.update(env)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(BACKEND_DIR),
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=server_env,
+        stdout=log_file or subprocess.DEVNULL, stderr=subprocess.STDOUT,
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+async def wait_for_server(client: httpx.AsyncClient, process: Optional[subprocess.Popen]):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            response = await client.get("/health")
+            if response.status_code == 200 and response.json().get("status") == "healthy":
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not become healthy in time")
+
+
+def _check(response: httpx.Response) -> Dict[str, Any]:
+    """Lỗi HTTP hoặc body {"status": "error"} (các route ví trả lỗi với mã 200)"""
+    response.raise_for_status()
+    data = response.json()
+    if isinstance(data, dict) and data.get("status") == "error":
+        raise RuntimeError(data.get("message") or data)
+    return data
+
+
+async def setup_users(client: httpx.AsyncClient, users: int, wallets_per_user: int, deposit: float) -> List[BenchmarkUser]:
+    """Tạo user, ví và nạp tiền để các kịch bản có dữ liệu thật"""
+    run_id = int(time.time() * 1000)
+    result = []
+    for index in range(users):
+        email = f"bench-{run_id}-{index}@example.com"
+        response = await client.post("/api/auth/register", data={
+            "name": f"Bench {index}", "email": email,
+            "password": BENCH_PASSWORD, "private_password": BENCH_PASSWORD,
+        })
+        response.raise_for_status()
+        login = (await client.post("/api/auth/login", data={"username": email, "password": BENCH_PASSWORD})).json()
+        user = BenchmarkUser(email, login["user"]["id"], login["access_token"], [])
+
+        for wallet_index in range(wallets_per_user):
+            created = _check(await client.post("/api/wallets/create", headers=user.headers,
+                                               json={"user_id": user.user_id, "label": f"bench {wallet_index}"}))
+            address = created["wallet"]["address"]
+            if deposit > 0:
+                _check(await client.post("/api/wallets/deposit", headers=user.headers,
+                                         json={"wallet_address": address, "amount": deposit}))
+            user.wallets.append(address)
+        result.append(user)
+    logger.info(f"Prepared {len(result)} users with {wallets_per_user} wallets each")
+    return result
+
+
+def scenario_requests(name: str, users: List[BenchmarkUser], amount: float) -> Callable[[httpx.AsyncClient, int], Awaitable[Any]]:
+    """Trả về hàm gửi request thứ i của kịch bản (xoay vòng qua các user/ví)"""
+    def pick(i: int) -> BenchmarkUser:
+        return users[i % len(users)]
+
+    async def login(client, i):
+        user = pick(i)
+        return _check(await client.post("/api/auth/login", data={"username": user.email, "password": BENCH_PASSWORD}))
+
+    async def wallets_user(client, i):
+        user = pick(i)
+        return _check(await client.get(f"/api/wallets/user/{user.user_id}", headers=user.headers))
+
+    async def balance(client, i):
+        user = pick(i)
+        address = user.wallets[(i // len(users)) % len(user.wallets)]
+        return _check(await client.get(f"/api/wallets/balance/{address}", headers=user.headers))
+
+    async def transfer(client, i):
+        user = pick(i)
+        offset = (i // len(users)) % len(user.wallets)
+        source = user.wallets[offset]
+        target = user.wallets[(offset + 1) % len(user.wallets)]
+        return _check(await client.post("/api/wallets/transfer", headers=user.headers, json={
+            "from_wallet": source, "to_wallet": target, "amount": amount, "confirm": True,
+        }))
+
+    async def transactions(client, i):
+        user = pick(i)
+        address = user.wallets[(i // len(users)) % len(user.wallets)]
+        return _check(await client.get(f"/api/transactions/{address}", headers=user.headers, params={"limit": 50}))
+
+    return {
+        "login": login,
+        "wallets_user": wallets_user,
+        "balance": balance,
+        "transfer": transfer,
+        "transactions": transactions,
+    }[name]
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * percentile / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, send: Callable, total: int, concurrency: int) -> Dict[str, Any]:
+    """Chạy `total` request với `concurrency` worker; đo latency từng request"""
+    latencies: List[float] = []
+    errors: List[str] = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                await send(client, i)
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                errors.append(str(e) or type(e).__name__)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "requests": total,
+        "errors": len(errors),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+    }
+    if errors:
+        logger.warning(f"{name}: {len(errors)} errors, first: {errors[0]}")
+    return result
+
+
+def compare_with_baseline(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any],
+                          tolerance: float, min_delta_ms: float) -> List[str]:
+    """Danh sách regression so với baseline (rỗng nếu đạt)"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        p95_limit = previous["p95_ms"] * (1 + tolerance)
+        if current["p95_ms"] > p95_limit and current["p95_ms"] - previous["p95_ms"] > min_delta_ms:
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms > {previous['p95_ms']}ms (+{tolerance:.0%})")
+        throughput_limit = previous["throughput_rps"] * (1 - tolerance)
+        if current["throughput_rps"] < throughput_limit:
+            regressions.append(f"{name}: throughput {current['throughput_rps']}/s < {previous['throughput_rps']}/s (-{tolerance:.0%})")
+    return regressions
+
+
+def print_report(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]]):
+    header = f"{'scenario':<14}{'reqs':>6}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'base p95':>10}{'base req/s':>12}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        previous = (baseline or {}).get("scenarios", {}).get(name, {})
+        print(f"{name:<14}{r['requests']:>6}{r['errors']:>5}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}"
+              f"{r['throughput_rps']:>10}{previous.get('p95_ms', '-'):>10}{previous.get('throughput_rps', '-'):>12}")
+
+
+async def run_benchmark(args) -> int:
+    workdir = None
+    process = None
+    server_log = None
+    base_url = args.url
+    if not base_url:
+        workdir = Path(tempfile.mkdtemp(prefix="wallet-bench-"))
+        env = {"DEV_CHAIN_LATENCY": str(args.chain_latency), "DEV_CHAIN_NODES": str(args.chain_nodes)}
+        if args.slow_node_latency is not None and args.chain_nodes > 1:
+            # Node cuối chậm hơn các node còn lại
+            latencies = [args.chain_latency] * (args.chain_nodes - 1) + [args.slow_node_latency]
+            env["DEV_CHAIN_NODE_LATENCIES"] = ",".join(str(v) for v in latencies)
+        if args.bcrypt_rounds:
+            env["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+        if args.server_log:
+            server_log = open(args.server_log, "w")
+        process, base_url = start_local_server(workdir, env, server_log)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+            await wait_for_server(client, process)
+            users = await setup_users(client, args.users, args.wallets, args.deposit)
+
+            results = {}
+            for name in args.scenarios:
+                send = scenario_requests(name, users, args.amount)
+                # Làm nóng kết nối và cache trước khi đo
+                await run_scenario(client, name, send, min(args.warmup, args.requests), args.concurrency)
+                results[name] = await run_scenario(client, name, send, args.requests, args.concurrency)
+                logger.info(f"{name}: p95 {results[name]['p95_ms']}ms, {results[name]['throughput_rps']} req/s")
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if server_log is not None:
+            server_log.close()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {"concurrency": args.concurrency, "requests": args.requests, "users": args.users,
+              "wallets": args.wallets, "chain_latency": args.chain_latency, "bcrypt_rounds": args.bcrypt_rounds}
+    report = {"config": config, "scenarios": results}
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else None
+    print_report(results, baseline)
+
+    failures = [f"{name}: {r['errors']} failed requests" for name, r in results.items() if r["errors"]]
+    if args.update_baseline:
+        if failures:
+            logger.error("Not updating baseline: run had failed requests")
+        else:
+            baseline_path.write_text(json.dumps(report, indent=2) + "\n")
+            logger.info(f"Baseline written to {baseline_path}")
+    elif baseline is not None:
+        if baseline.get("config") != config:
+            logger.warning(f"Benchmark config {config} differs from baseline config {baseline.get('config')}")
+        failures += compare_with_baseline(results, baseline, args.tolerance, args.min_delta_ms)
+
+    for failure in failures:
+        logger.error(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the wallet API and compare against a stored baseline")
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent requests in flight")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per scenario")
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=SCENARIOS,
+                        help=f"Comma separated subset of: {','.join(SCENARIOS)}")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--wallets", type=int, default=2, help="Wallets per user")
+    parser.add_argument("--deposit", type=float, default=5.0, help="ETH deposited into each wallet")
+    parser.add_argument("--amount", type=float, default=0.0001, help="ETH per benchmark transfer")
+    parser.add_argument("--chain-latency", type=float, default=0.0, help="Simulated RPC latency (s) of the local dev chain")
+    parser.add_argument("--chain-nodes", type=int, default=1, help="Dev chain nodes behind the RPC router")
+    parser.add_argument("--slow-node-latency", type=float, default=None, help="RPC latency (s) of the last dev chain node")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None, help="BCRYPT_ROUNDS for the local server")
+    parser.add_argument("--server-log", help="Write the local server's output to this file")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression of p95 and throughput")
+    parser.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run_benchmark(parse_args())))
@@ -1,30 +1,249 @@
-from web3 import Web3
+from web3 import Web3, AsyncWeb3, HTTPProvider, AsyncHTTPProvider
 from eth_account import Account
+from requests.adapters import HTTPAdapter
 import os
+import asyncio
+import aiohttp
 import logging
-from typing import Dict, Any, List, Optional
+import threading
+import requests
+from typing import Dict, Any, List, Optional, Callable, Tuple
 from datetime import datetime
+from nonce_manager import NonceManager, get_nonce_manager, is_nonce_error
+from tx_signer import get_transaction_signer
+from metrics import rpc_timer
+from rpc_router import RpcRouter, get_rpc_router, pinned_to
+from web3._utils.batching import sort_batch_response_by_response_ids
 
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "20"))
+RPC_CONNECT_TIMEOUT = float(os.getenv("RPC_CONNECT_TIMEOUT", "3"))
+RPC_READ_TIMEOUT = float(os.getenv("RPC_READ_TIMEOUT", "30"))
+# Mặc định chỉ gửi giao dịch và trả về hash; ReceiptTracker xác nhận sau
+TX_WAIT_FOR_RECEIPT = os.getenv("TX_WAIT_FOR_RECEIPT", "false").lower() == "true"
+# Số lần gửi lại khi node báo lệch nonce (mỗi lần đồng bộ lại với node)
+TX_NONCE_RETRIES = int(os.getenv("TX_NONCE_RETRIES", "2"))
+# "http": node thật tại BLOCKCHAIN_URL (Ganache, ...); "dev": node giả lập trong tiến trình (dev_chain)
+BLOCKCHAIN_BACKEND = os.getenv("BLOCKCHAIN_BACKEND", "http").lower()
+# Nhiều node (phân tách bằng dấu phẩy): RpcRouter chọn node theo latency/lỗi; để trống thì dùng BLOCKCHAIN_URL
+BLOCKCHAIN_URLS = [url.strip() for url in os.getenv("BLOCKCHAIN_URLS", "").split(",") if url.strip()]
+
+
+def default_blockchain_urls() -> List[str]:
+    if BLOCKCHAIN_BACKEND == "dev":
+        from dev_chain import get_dev_chain_servers
+        return [server.url for server in get_dev_chain_servers()]
+    return BLOCKCHAIN_URLS or [os.getenv("BLOCKCHAIN_URL", "http://localhost:7545")]
+
+
+def default_blockchain_url() -> str:
+    return default_blockchain_urls()[0]
+
+
+def _resolve_urls(blockchain_url) -> List[str]:
+    if not blockchain_url:
+        return default_blockchain_urls()
+    if isinstance(blockchain_url, str):
+        return [url.strip() for url in blockchain_url.split(",") if url.strip()]
+    return list(blockchain_url)
+
+def normalize_private_key(private_key: str) -> Tuple[str, Optional[str]]:
+    """Chuẩn hóa private key về dạng 0x + 64 ký tự hex; trả về (key, lỗi)"""
+    private_key = private_key.strip()
+    if not private_key.startswith("0x"):
+        private_key = "0x" + private_key
+    
+    logger.info(f"Using private key format: {private_key[:4]}...{private_key[-4:]} (length: {len(private_key)})")
+    
+    if len(private_key) != 66: 
+        logger.error(f"Invalid private key format: expected 66 chars (with 0x), got {len(private_key)}")
+        return private_key, "Invalid private key format"
+    
+    try:
+        int(private_key[2:], 16)  
+    except ValueError:
+        logger.error("Private key contains invalid hex characters")
+        return private_key, "Private key contains invalid characters"
+    
+    return private_key, None
+
+
+def transaction_result(tx_hash, from_address: str, to_address: str, amount: float, receipt=None) -> Dict[str, Any]:
+    """Kết quả gửi giao dịch; không có receipt nghĩa là giao dịch đang pending"""
+    if receipt is None:
+        status, block_number = "pending", None
+    else:
+        status = "completed" if receipt.status == 1 else "failed"
+        block_number = receipt.blockNumber
+    return {
+        "hash": tx_hash.hex(),
+        "from_wallet": from_address,
+        "to_wallet": to_address,
+        "amount": amount,
+        "timestamp": datetime.now().isoformat(),
+        "type": "transfer",
+        "status": status,
+        "block_number": block_number
+    }
+
+
+def send_error_result(error: Exception) -> Dict[str, Any]:
+    error_msg = str(error)
+    logger.error(f"Error signing/sending transaction: {error_msg}")
+    if "invalid sender" in error_msg.lower():
+        return {"status": "failed", "error": "Invalid private key for this address"}
+    return {"status": "failed", "error": error_msg}
+
+
+def _batch_label(batch_requests: List[Tuple[str, Any]]) -> str:
+    methods = {method for method, _ in batch_requests}
+    return f"batch:{methods.pop()}" if len(methods) == 1 else "batch"
+
+
+class TimedHTTPProvider(HTTPProvider):
+    """HTTPProvider ghi latency từng lệnh RPC (theo method) vào metrics"""
+
+    def make_request(self, method, params):
+        with rpc_timer(method):
+            return super().make_request(method, params)
+
+    def make_batch_request(self, batch_requests):
+        with rpc_timer(_batch_label(batch_requests)):
+            return super().make_batch_request(batch_requests)
+
+
+class TimedAsyncHTTPProvider(AsyncHTTPProvider):
+    async def make_request(self, method, params):
+        with rpc_timer(method):
+            return await super().make_request(method, params)
+
+    async def make_batch_request(self, batch_requests):
+        with rpc_timer(_batch_label(batch_requests)):
+            return await super().make_batch_request(batch_requests)
+
+
+class RoutedHTTPProvider(TimedHTTPProvider):
+    """HTTPProvider gửi từng request tới node do RpcRouter chọn (failover, hedge, ghim theo địa chỉ gửi)"""
+
+    def __init__(self, router: RpcRouter, request_kwargs: Dict[str, Any], session: requests.Session):
+        # Router tự chuyển node khi lỗi, không để provider thử lại trên cùng một node
+        super().__init__(router.urls[0], request_kwargs=request_kwargs, session=session,
+                         exception_retry_configuration=None)
+        self.router = router
+        self.session = session
+
+    def _post(self, url: str, request_data: bytes) -> bytes:
+        response = self.session.post(url, data=request_data, **self.get_request_kwargs())
+        response.raise_for_status()
+        return response.content
+
+    def _make_request(self, method, request_data):
+        return self.router.call([method], lambda url: self._post(url, request_data))
+
+    def make_batch_request(self, batch_requests):
+        with rpc_timer(_batch_label(batch_requests)):
+            request_data = self.encode_batch_rpc_request(batch_requests)
+            raw_response = self.router.call([method for method, _ in batch_requests],
+                                            lambda url: self._post(url, request_data))
+            response = self.decode_rpc_response(raw_response)
+            if not isinstance(response, list):
+                return response
+            return sort_batch_response_by_response_ids(response)
+
+
+class RoutedAsyncHTTPProvider(TimedAsyncHTTPProvider):
+    """Bản asyncio của RoutedHTTPProvider; dùng chung session aiohttp cho mọi node"""
+
+    def __init__(self, router: RpcRouter, request_kwargs: Dict[str, Any]):
+        super().__init__(router.urls[0], request_kwargs=request_kwargs, exception_retry_configuration=None)
+        self.router = router
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def cache_async_session(self, session: aiohttp.ClientSession) -> aiohttp.ClientSession:
+        self.session = session
+        return await super().cache_async_session(session)
+
+    async def _post(self, url: str, request_data: bytes) -> bytes:
+        if self.session is None:
+            return await self._request_session_manager.async_make_post_request(
+                url, request_data, **self.get_request_kwargs()
+            )
+        async with self.session.post(url, data=request_data, **self.get_request_kwargs()) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def _make_request(self, method, request_data):
+        return await self.router.call_async([method], lambda url: self._post(url, request_data))
+
+    async def make_batch_request(self, batch_requests):
+        with rpc_timer(_batch_label(batch_requests)):
+            request_data = self.encode_batch_rpc_request(batch_requests)
+            raw_response = await self.router.call_async([method for method, _ in batch_requests],
+                                                        lambda url: self._post(url, request_data))
+            response = self.decode_rpc_response(raw_response)
+            if not isinstance(response, list):
+                return response
+            return sort_batch_response_by_response_ids(response)
+
+
 class BlockchainService:
     """Service class để tương tác với blockchain"""
     
-    def __init__(self, blockchain_url=None):
+    def __init__(self, blockchain_url=None, pool_size: int = RPC_POOL_SIZE):
    
    
-        self.blockchain_url = blockchain_url or os.getenv("BLOCKCHAIN_URL", "http://localhost:7545")
-        self.w3 = Web3(Web3.HTTPProvider(self.blockchain_url))
+        self.blockchain_urls = _resolve_urls(blockchain_url)
+        self.blockchain_url = ", ".join(self.blockchain_urls)
+        # Một node: provider thường; nhiều node: RpcRouter dùng chung với service async
+        self.router = get_rpc_router(self.blockchain_urls) if len(self.blockchain_urls) > 1 else None
         
-
+        # Session keep-alive dùng chung cho mọi lệnh RPC (kể cả batch)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.blockchain_urls), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        self.w3 = self._make_web3()
+        self._batch_local = threading.local()
+        self._chain_id = None
+        self.nonces: NonceManager = get_nonce_manager()
+    
+    def _make_web3(self) -> Web3:
+        if self.router is not None:
+            return Web3(RoutedHTTPProvider(
+                self.router,
+                request_kwargs={"timeout": (RPC_CONNECT_TIMEOUT, RPC_READ_TIMEOUT)},
+                session=self.session
+            ))
+        return Web3(TimedHTTPProvider(
+            self.blockchain_url,
+            request_kwargs={"timeout": (RPC_CONNECT_TIMEOUT, RPC_READ_TIMEOUT)},
+            session=self.session
+        ))
+    
+    def connect(self) -> bool:
+        """Kiểm tra kết nối một lần khi khởi động ứng dụng"""
         if not self.w3.is_connected():
             logger.warning(f"Failed to connect to blockchain at {self.blockchain_url}")
-        else:
-            logger.info(f"Connected to blockchain at {self.blockchain_url}")
-            logger.info(f"Chain ID: {self.w3.eth.chain_id}")
+            return False
+        logger.info(f"Connected to blockchain at {self.blockchain_url}")
+        logger.info(f"Chain ID: {self.chain_id}")
+        return True
+    
+    def close(self):
+        self.session.close()
+        logger.info(f"Closed blockchain session for {self.blockchain_url}")
+    
+    @property
+    def chain_id(self) -> int:
+        # Chain id không đổi trong suốt vòng đời node nên chỉ hỏi một lần
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        return self._chain_id
     
     def is_valid_eth_address(self, address: str) -> bool:
         """Kiểm tra xem địa chỉ Ethereum có hợp lệ không"""
@@ -56,14 +275,50 @@ class BlockchainService:
             logger.error(f"Error creating wallet: {str(e)}")
             raise
     
+    @property
+    def batch_w3(self) -> Web3:
+        # Cờ batching nằm trên provider, nên mỗi thread dùng một Web3 riêng cho batch
+        # để không "nuốt" các lệnh RPC của thread khác đang dùng self.w3
+        if not hasattr(self._batch_local, "w3"):
+            self._batch_local.w3 = self._make_web3()
+        return self._batch_local.w3
+
+    def rpc_batch(self, calls: List[Callable[[Any], Any]]) -> List[Any]:
+        """Gộp các lệnh RPC độc lập vào một JSON-RPC batch (một round trip)
+
+        Mỗi phần tử của calls nhận module eth, ví dụ: lambda eth: eth.get_balance(address)
+        """
+        if not calls:
+            return []
+        w3 = self.batch_w3
+        try:
+            with w3.batch_requests() as batch:
+                for call in calls:
+                    batch.add(call(w3.eth))
+                return batch.execute()
+        except Exception as e:
+            logger.warning(f"Batch RPC request failed, falling back to sequential calls: {str(e)}")
+            return [call(self.w3.eth) for call in calls]
+
+    def get_balances(self, addresses: List[str]) -> Dict[str, float]:
+        """Lấy số dư của nhiều ví trong một round trip"""
+        balances = {}
+        if not addresses:
+            return balances
+        try:
+            results = self.rpc_batch([lambda eth, a=address: eth.get_balance(a) for address in addresses])
+            for address, balance_wei in zip(addresses, results):
+                balances[address] = float(self.w3.from_wei(balance_wei, "ether"))
+            logger.info(f"Fetched balances for {len(addresses)} wallets in one batch")
+        except Exception as e:
+            logger.error(f"Error getting wallet balances: {str(e)}")
+            for address in addresses:
+                balances[address] = self.get_balance(address)
+        return balances
+
     def get_balance(self, address: str) -> float:
         """Lấy số dư của ví từ blockchain"""
         try:
-           
-            if not self.w3.is_connected():
-                logger.warning("Not connected to blockchain")
-                return 0
-            
             balance_wei = self.w3.eth.get_balance(address)
             balance_eth = self.w3.from_wei(balance_wei, "ether")
             
@@ -82,129 +337,398 @@ class BlockchainService:
             return False
         return self.w3.is_address(address)  
 
-    def send_transaction(self, from_address: str, to_address: str, amount: float, private_key: str) -> Dict[str, Any]:
+    @pinned_to("from_address")
+    def send_transaction(self, from_address: str, to_address: str, amount: float, private_key: str,
+                         wait_for_receipt: bool = TX_WAIT_FOR_RECEIPT) -> Dict[str, Any]:
         """Gửi giao dịch từ ví này sang ví khác"""
         try:
-     
-            if not self.w3.is_connected():
-                logger.warning("Not connected to blockchain")
-                return {"status": "failed", "error": "Not connected to blockchain"}
-            
-
-            private_key = private_key.strip()
-            if not private_key.startswith("0x"):
-                private_key = "0x" + private_key
-            
-            logger.info(f"Using private key format: {private_key[:4]}...{private_key[-4:]} (length: {len(private_key)})")
-            
-            if len(private_key) != 66: 
-                logger.error(f"Invalid private key format: expected 66 chars (with 0x), got {len(private_key)}")
-                return {"status": "failed", "error": "Invalid private key format"}
-            
-     
-            try:
-                int(private_key[2:], 16)  
-            except ValueError:
-                logger.error("Private key contains invalid hex characters")
-                return {"status": "failed", "error": "Private key contains invalid characters"}
+            private_key, key_error = normalize_private_key(private_key)
+            if key_error:
+                return {"status": "failed", "error": key_error}
             
   
             amount_wei = self.w3.to_wei(amount, "ether")
             
-   
-            nonce = self.w3.eth.get_transaction_count(from_address)
-            
-   
-            gas_price = self.w3.eth.gas_price
-            
-     
-            tx = {
-                "from": from_address,
-                "to": to_address,
-                "value": amount_wei,
-                "gas": 21000, 
-                "gasPrice": gas_price,
-                "nonce": nonce,
-                "chainId": self.w3.eth.chain_id
-            }
-            
-            try:
-            
-                signed_tx = self.w3.eth.account.sign_transaction(tx, private_key)
+            for attempt in range(TX_NONCE_RETRIES + 1):
+                # gas price (và nonce pending / chain id khi cần) trong một round trip
+                try:
+                    sync_nonce = self.nonces.needs_sync(from_address)
+                    calls = [lambda eth: eth.gas_price]
+                    if sync_nonce:
+                        calls.append(lambda eth: eth.get_transaction_count(from_address, "pending"))
+                    if self._chain_id is None:
+                        calls.append(lambda eth: eth.chain_id)
+                    results = self.rpc_batch(calls)
+                    gas_price = results[0]
+                    chain_nonce = results[1] if sync_nonce else None
+                    if self._chain_id is None:
+                        self._chain_id = results[-1]
+                    chain_id = self._chain_id
+                except Exception as e:
+                    logger.warning(f"Not connected to blockchain: {str(e)}")
+                    return {"status": "failed", "error": "Not connected to blockchain"}
+                
+                nonce = self.nonces.reserve(from_address, chain_nonce)
+         
+                tx = {
+                    "from": from_address,
+                    "to": to_address,
+                    "value": amount_wei,
+                    "gas": 21000, 
+                    "gasPrice": gas_price,
+                    "nonce": nonce,
+                    "chainId": chain_id
+                }
+                
+                try:
                 
-          
-                tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+                    signed_tx = self.w3.eth.account.sign_transaction(tx, private_key)
+                    
+              
+                    tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+                except Exception as e:
+                    if self.nonces.handle_send_error(from_address, nonce, e) and attempt < TX_NONCE_RETRIES:
+                        logger.warning(f"Nonce {nonce} rejected for {from_address}, resyncing: {str(e)}")
+                        continue
+                    return send_error_result(e)
+                
+                if not wait_for_receipt:
+                    logger.info(f"Transaction submitted: {tx_hash.hex()} (nonce {nonce})")
+                    return transaction_result(tx_hash, from_address, to_address, amount)
        
-                receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+                try:
+                    receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+                except Exception as e:
+                    return send_error_result(e)
                 
                 logger.info(f"Transaction sent: {tx_hash.hex()}")
                 
-          
-                return {
-                    "hash": tx_hash.hex(),
-                    "from_wallet": from_address,
-                    "to_wallet": to_address,
-                    "amount": amount,
-                    "timestamp": datetime.now().isoformat(),
-                    "type": "transfer",
-                    "status": "completed" if receipt.status == 1 else "failed",
-                    "block_number": receipt.blockNumber
-                }
-            except Exception as e:
-                error_msg = str(e)
-                logger.error(f"Error signing/sending transaction: {error_msg}")
-                if "invalid sender" in error_msg.lower():
-                    return {"status": "failed", "error": "Invalid private key for this address"}
-                return {"status": "failed", "error": error_msg}
+                return transaction_result(tx_hash, from_address, to_address, amount, receipt)
         except Exception as e:
             logger.error(f"Error sending transaction: {str(e)}")
             return {
                 "status": "failed",
                 "error": str(e)
             }
+
+    @pinned_to("address")
+    def reserve_nonce(self, address: str) -> int:
+        """Cấp nonce tiếp theo cho address (dùng cho giao dịch ký bởi node, ví dụ nạp tiền từ Ganache)"""
+        chain_nonce = self.w3.eth.get_transaction_count(address, "pending") if self.nonces.needs_sync(address) else None
+        return self.nonces.reserve(address, chain_nonce)
+
+
+class AsyncBlockchainService:
+    """Phiên bản asyncio của BlockchainService (AsyncWeb3) cho các route async"""
+    
+    def __init__(self, blockchain_url=None, pool_size: int = RPC_POOL_SIZE):
+        self.blockchain_urls = _resolve_urls(blockchain_url)
+        self.blockchain_url = ", ".join(self.blockchain_urls)
+        self.router = get_rpc_router(self.blockchain_urls) if len(self.blockchain_urls) > 1 else None
+        self.pool_size = pool_size
+        self.session = None
+        self.w3 = self._make_web3()
+        self._batch_w3 = self._make_web3()
+        self._batch_lock = asyncio.Lock()
+        self._chain_id = None
+        self.nonces: NonceManager = get_nonce_manager()
+    
+    def _make_web3(self) -> AsyncWeb3:
+        if self.router is not None:
+            return AsyncWeb3(RoutedAsyncHTTPProvider(
+                self.router,
+                request_kwargs={"timeout": aiohttp.ClientTimeout(total=RPC_READ_TIMEOUT, connect=RPC_CONNECT_TIMEOUT)}
+            ))
+        return AsyncWeb3(TimedAsyncHTTPProvider(
+            self.blockchain_url,
+            request_kwargs={"timeout": aiohttp.ClientTimeout(total=RPC_READ_TIMEOUT, connect=RPC_CONNECT_TIMEOUT)}
+        ))
+    
+    async def connect(self) -> bool:
+        """Tạo session aiohttp keep-alive dùng chung và kiểm tra kết nối"""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+            await self.w3.provider.cache_async_session(self.session)
+            await self._batch_w3.provider.cache_async_session(self.session)
+        if not await self.w3.is_connected():
+            logger.warning(f"Failed to connect to blockchain at {self.blockchain_url} (async)")
+            return False
+        logger.info(f"Connected to blockchain at {self.blockchain_url} (async)")
+        return True
+    
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+    
+    async def get_chain_id(self) -> int:
+        if self._chain_id is None:
+            self._chain_id = await self.w3.eth.chain_id
+        return self._chain_id
+    
+    def is_valid_eth_address(self, address: str) -> bool:
+        """Kiểm tra xem địa chỉ Ethereum có hợp lệ không"""
+        if not isinstance(address, str):
+            return False
+        return self.w3.is_address(address)
+    
+    async def rpc_batch(self, calls: List[Callable[[Any], Any]]) -> List[Any]:
+        """Gộp các lệnh RPC độc lập vào một JSON-RPC batch (một round trip)"""
+        if not calls:
+            return []
+        try:
+            # Cờ batching nằm trên provider nên các batch đồng thời phải xếp hàng
+            async with self._batch_lock:
+                async with self._batch_w3.batch_requests() as batch:
+                    for call in calls:
+                        batch.add(call(self._batch_w3.eth))
+                    return await batch.async_execute()
+        except Exception as e:
+            logger.warning(f"Batch RPC request failed, falling back to concurrent calls: {str(e)}")
+            return await asyncio.gather(*[call(self.w3.eth) for call in calls])
+    
+    async def get_balance(self, address: str) -> float:
+        """Lấy số dư của ví từ blockchain"""
+        try:
+            balance_wei = await self.w3.eth.get_balance(address)
+            balance_eth = self.w3.from_wei(balance_wei, "ether")
+            logger.info(f"Wallet {address} balance: {balance_eth} ETH")
+            return float(balance_eth)
+        except Exception as e:
+            logger.error(f"Error getting wallet balance: {str(e)}")
+            return 0
     
-    def get_transaction_history(self, address: str, limit: int = 50) -> List[Dict[str, Any]]:
-        """Lấy lịch sử giao dịch của một địa chỉ"""
+    async def get_balances(self, addresses: List[str]) -> Dict[str, float]:
+        """Lấy số dư của nhiều ví trong một round trip"""
+        balances = {}
+        if not addresses:
+            return balances
         try:
+            results = await self.rpc_batch([lambda eth, a=address: eth.get_balance(a) for address in addresses])
+            for address, balance_wei in zip(addresses, results):
+                balances[address] = float(self.w3.from_wei(balance_wei, "ether"))
+        except Exception as e:
+            logger.error(f"Error getting wallet balances: {str(e)}")
+            results = await asyncio.gather(*[self.get_balance(address) for address in addresses])
+            balances = dict(zip(addresses, results))
+        return balances
     
-            if not self.w3.is_connected():
-                logger.warning("Not connected to blockchain")
-                return []
+    @pinned_to("from_address")
+    async def send_transaction(self, from_address: str, to_address: str, amount: float, private_key: str,
+                               wait_for_receipt: bool = TX_WAIT_FOR_RECEIPT) -> Dict[str, Any]:
+        """Gửi giao dịch từ ví này sang ví khác"""
+        try:
+            private_key, key_error = normalize_private_key(private_key)
+            if key_error:
+                return {"status": "failed", "error": key_error}
             
-  
-            latest_block = self.w3.eth.block_number
+            amount_wei = self.w3.to_wei(amount, "ether")
             
-     
-            transactions = []
+            for attempt in range(TX_NONCE_RETRIES + 1):
+                try:
+                    sync_nonce = self.nonces.needs_sync(from_address)
+                    calls = [lambda eth: eth.gas_price]
+                    if sync_nonce:
+                        calls.append(lambda eth: eth.get_transaction_count(from_address, "pending"))
+                    results = await self.rpc_batch(calls)
+                    gas_price = results[0]
+                    chain_nonce = results[1] if sync_nonce else None
+                    chain_id = await self.get_chain_id()
+                except Exception as e:
+                    logger.warning(f"Not connected to blockchain: {str(e)}")
+                    return {"status": "failed", "error": "Not connected to blockchain"}
+                
+                nonce = await self.nonces.reserve_async(from_address, chain_nonce)
+                
+                tx = {
+                    "from": from_address,
+                    "to": to_address,
+                    "value": amount_wei,
+                    "gas": 21000,
+                    "gasPrice": gas_price,
+                    "nonce": nonce,
+                    "chainId": chain_id
+                }
+                
+                try:
+                    signed_tx = self.w3.eth.account.sign_transaction(tx, private_key)
+                    tx_hash = await self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+                except Exception as e:
+                    if await self.nonces.handle_send_error_async(from_address, nonce, e) and attempt < TX_NONCE_RETRIES:
+                        logger.warning(f"Nonce {nonce} rejected for {from_address}, resyncing: {str(e)}")
+                        continue
+                    return send_error_result(e)
+                
+                if not wait_for_receipt:
+                    logger.info(f"Transaction submitted: {tx_hash.hex()} (nonce {nonce})")
+                    return transaction_result(tx_hash, from_address, to_address, amount)
+                
+                try:
+                    receipt = await self.w3.eth.wait_for_transaction_receipt(tx_hash)
+                except Exception as e:
+                    return send_error_result(e)
+                
+                logger.info(f"Transaction sent: {tx_hash.hex()}")
+                
+                return transaction_result(tx_hash, from_address, to_address, amount, receipt)
+        except Exception as e:
+            logger.error(f"Error sending transaction: {str(e)}")
+            return {
+                "status": "failed",
+                "error": str(e)
+            }
+    
+    @pinned_to("from_address")
+    async def send_batch(self, from_address: str, transfers: List[Tuple[str, float]], private_key: str) -> Dict[str, Any]:
+        """Gửi một lô giao dịch từ cùng một ví mà không chờ receipt.
+
+        Một lần đọc số dư + gas price, cấp nonce liên tiếp một lần, ký song song trong process pool
+        rồi gửi liền nhau theo thứ tự nonce. Gửi lỗi giữa chừng thì dừng và trả lại các nonce chưa dùng.
+        """
+        try:
+            private_key, key_error = normalize_private_key(private_key)
+            if key_error:
+                return {"status": "failed", "error": key_error}
             
-     
-            count = 0
-            for block_number in range(latest_block, max(0, latest_block - 1000), -1):
-                if count >= limit:
-                    break
-                    
-                block = self.w3.eth.get_block(block_number, full_transactions=True)
-                
-                for tx in block["transactions"]:
-               
-                    if tx["from"].lower() == address.lower() or (tx["to"] and tx["to"].lower() == address.lower()):
-                        transactions.append({
-                            "hash": tx["hash"].hex(),
-                            "from_wallet": tx["from"],
-                            "to_wallet": tx["to"],
-                            "amount": float(self.w3.from_wei(tx["value"], "ether")),
-                            "timestamp": datetime.fromtimestamp(block["timestamp"]).isoformat(),
-                            "type": "transfer",
-                            "status": "completed",
-                            "block_number": tx["blockNumber"]
-                        })
-                        count += 1
-                        
-                        if count >= limit:
-                            break
+            amounts_wei = [self.w3.to_wei(amount, "ether") for _, amount in transfers]
             
-            logger.info(f"Found {len(transactions)} transactions for address {address}")
-            return transactions
+            for attempt in range(TX_NONCE_RETRIES + 1):
+                try:
+                    sync_nonce = self.nonces.needs_sync(from_address)
+                    calls = [lambda eth: eth.gas_price, lambda eth: eth.get_balance(from_address)]
+                    if sync_nonce:
+                        calls.append(lambda eth: eth.get_transaction_count(from_address, "pending"))
+                    results = await self.rpc_batch(calls)
+                    gas_price, balance_wei = results[0], results[1]
+                    chain_nonce = results[2] if sync_nonce else None
+                    chain_id = await self.get_chain_id()
+                except Exception as e:
+                    logger.warning(f"Not connected to blockchain: {str(e)}")
+                    return {"status": "failed", "error": "Not connected to blockchain"}
+                
+                required_wei = sum(amounts_wei) + gas_price * 21000 * len(transfers)
+                if balance_wei < required_wei:
+                    return {
+                        "status": "failed",
+                        "error": f"Insufficient balance: {float(self.w3.from_wei(balance_wei, 'ether'))} < "
+                                 f"{float(self.w3.from_wei(required_wei, 'ether'))} (amounts + gas)"
+                    }
+                
+                nonces = await self.nonces.reserve_many_async(from_address, len(transfers), chain_nonce)
+                txs = [
+                    {
+                        "from": from_address,
+                        "to": to_address,
+                        "value": amount_wei,
+                        "gas": 21000,
+                        "gasPrice": gas_price,
+                        "nonce": nonce,
+                        "chainId": chain_id
+                    }
+                    for (to_address, _), amount_wei, nonce in zip(transfers, amounts_wei, nonces)
+                ]
+                
+                try:
+                    signed = await get_transaction_signer().sign(private_key, txs)
+                except Exception as e:
+                    await self._release_nonces(from_address, nonces)
+                    return send_error_result(e)
+                
+                submitted = []
+                error = None
+                for index, (raw_transaction, tx_hash) in enumerate(signed):
+                    try:
+                        await self.w3.eth.send_raw_transaction(raw_transaction)
+                    except Exception as e:
+                        error = e
+                        if is_nonce_error(e):
+                            # Lần cấp tới lấy số pending của node làm chuẩn; các nonce chưa gửi tự được cấp lại
+                            self.nonces.mark_stale(from_address)
+                        else:
+                            await self._release_nonces(from_address, nonces[index:])
+                        break
+                    to_address, amount = transfers[index]
+                    result = transaction_result(bytes.fromhex(tx_hash), from_address, to_address, amount)
+                    result["nonce"] = nonces[index]
+                    submitted.append(result)
+                
+                if error is not None and not submitted and is_nonce_error(error) and attempt < TX_NONCE_RETRIES:
+                    logger.warning(f"Nonce {nonces[0]} rejected for {from_address}, resyncing batch: {str(error)}")
+                    continue
+                
+                logger.info(f"Batch from {from_address}: submitted {len(submitted)}/{len(transfers)} transactions")
+                if error is None:
+                    return {"status": "pending", "transactions": submitted}
+                failure = send_error_result(error)
+                return {
+                    "status": "partial" if submitted else "failed",
+                    "transactions": submitted,
+                    "error": failure["error"],
+                    "unsent": [{"to_wallet": to, "amount": amount} for to, amount in transfers[len(submitted):]]
+                }
         except Exception as e:
-            logger.error(f"Error getting transaction history: {str(e)}")
-            return []
\ No newline at end of file
+            logger.error(f"Error sending transaction batch: {str(e)}")
+            return {"status": "failed", "error": str(e)}
+    
+    async def _release_nonces(self, address: str, nonces: List[int]):
+        # Trả từ nonce lớn nhất để bộ đếm lùi lại thay vì để lại khoảng trống
+        for nonce in reversed(nonces):
+            await self.nonces.release_async(address, nonce)
+    
+    @pinned_to("address")
+    async def reserve_nonce(self, address: str) -> int:
+        """Cấp nonce tiếp theo cho address (dùng cho giao dịch ký bởi node, ví dụ nạp tiền từ Ganache)"""
+        chain_nonce = await self.w3.eth.get_transaction_count(address, "pending") if self.nonces.needs_sync(address) else None
+        return await self.nonces.reserve_async(address, chain_nonce)
+
+
+_shared_service: Optional[BlockchainService] = None
+_shared_lock = threading.Lock()
+
+
+def get_blockchain_service() -> BlockchainService:
+    """BlockchainService dùng chung cho toàn tiến trình (dùng với Depends)"""
+    global _shared_service
+    if _shared_service is None:
+        with _shared_lock:
+            if _shared_service is None:
+                _shared_service = BlockchainService()
+    return _shared_service
+
+
+def start_blockchain_service() -> BlockchainService:
+    service = get_blockchain_service()
+    service.connect()
+    return service
+
+
+def stop_blockchain_service():
+    global _shared_service
+    with _shared_lock:
+        if _shared_service is not None:
+            _shared_service.close()
+            _shared_service = None
+
+
+_shared_async_service: Optional[AsyncBlockchainService] = None
+
+
+def get_async_blockchain_service() -> AsyncBlockchainService:
+    """AsyncBlockchainService dùng chung cho toàn tiến trình (dùng với Depends)"""
+    global _shared_async_service
+    if _shared_async_service is None:
+        _shared_async_service = AsyncBlockchainService()
+    return _shared_async_service
+
+
+async def start_async_blockchain_service() -> AsyncBlockchainService:
+    service = get_async_blockchain_service()
+    await service.connect()
+    return service
+
+
+async def stop_async_blockchain_service():
+    global _shared_async_service
+    if _shared_async_service is not None:
+        await _shared_async_service.close()
+        _shared_async_service = None
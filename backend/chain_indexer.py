@@ -0,0 +1,191 @@
+from typing import Optional, Tuple, Dict, Any, Callable, Set
+from datetime import datetime
+from blockchain_service import BlockchainService, get_blockchain_service
+from database import DATABASE_PATH, open_connection
+from balance_cache import get_balance_cache
+import sqlite3
+import threading
+import logging
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+INDEXER_POLL_INTERVAL = float(os.getenv("INDEXER_POLL_INTERVAL", "2"))
+INDEXER_BATCH_SIZE = int(os.getenv("INDEXER_BATCH_SIZE", "100"))
+INDEXER_START_BLOCK = int(os.getenv("INDEXER_START_BLOCK", "0"))
+INDEXER_REORG_DEPTH = int(os.getenv("INDEXER_REORG_DEPTH", "64"))
+
+
+class ChainIndexer:
+    """Theo dõi đầu chuỗi và ghi mọi giao dịch chuyển tiền vào bảng transactions"""
+
+    def __init__(self, blockchain: BlockchainService = None, db_path: str = DATABASE_PATH,
+                 poll_interval: float = INDEXER_POLL_INTERVAL, batch_size: int = INDEXER_BATCH_SIZE,
+                 on_block: Callable[[Set[str], int], None] = None):
+        self.blockchain = blockchain or get_blockchain_service()
+        # Được gọi (từ thread của indexer) với các địa chỉ bị ảnh hưởng và block cuối vừa ghi
+        self.on_block = on_block
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = open_connection(self.db_path)
+        return self._db
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="chain-indexer", daemon=True)
+        self._thread.start()
+        logger.info(f"Chain indexer started (poll interval {self.poll_interval}s)")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval + 5)
+            self._thread = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        logger.info("Chain indexer stopped")
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                ingested = self.run_once()
+            except Exception as e:
+                logger.error(f"Chain indexer error: {str(e)}")
+                ingested = 0
+            # Còn tụt lại phía sau thì chạy tiếp ngay, không chờ
+            if ingested < self.batch_size:
+                self._stop_event.wait(self.poll_interval)
+
+    def checkpoint(self) -> Optional[Tuple[int, str]]:
+        """Block cuối cùng đã ghi nhận (number, hash)"""
+        cursor = self.db.cursor()
+        cursor.execute("SELECT number, hash FROM chain_blocks ORDER BY number DESC LIMIT 1")
+        row = cursor.fetchone()
+        return (row[0], row[1]) if row else None
+
+    def run_once(self) -> int:
+        """Ghi tối đa batch_size block mới; trả về số block đã ghi"""
+        w3 = self.blockchain.w3
+        head = w3.eth.block_number
+
+        checkpoint = self.checkpoint()
+        next_number = checkpoint[0] + 1 if checkpoint else INDEXER_START_BLOCK
+        if next_number > head:
+            return 0
+
+        ingested = 0
+        touched = set()
+        cursor = self.db.cursor()
+        try:
+            for number in range(next_number, min(head, next_number + self.batch_size - 1) + 1):
+                block = w3.eth.get_block(number, full_transactions=True)
+
+                if checkpoint and number == checkpoint[0] + 1 and block["parentHash"].hex() != checkpoint[1]:
+                    # Block cha không khớp: chuỗi đã bị tổ chức lại
+                    self.db.commit()
+                    fork_point = self._handle_reorg(checkpoint[0])
+                    logger.warning(f"Reorg detected at block {number}, rolled back to {fork_point}")
+                    get_balance_cache().clear()
+                    return ingested
+
+                touched.update(self._ingest_block(cursor, block))
+                checkpoint = (number, block["hash"].hex())
+                ingested += 1
+
+            cursor.execute(
+                "DELETE FROM chain_blocks WHERE number < ?",
+                (checkpoint[0] - INDEXER_REORG_DEPTH,)
+            )
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+        # Số dư của các địa chỉ vừa có giao dịch trên chuỗi không còn đúng trong cache
+        if touched:
+            get_balance_cache().invalidate(*touched)
+            if self.on_block:
+                self.on_block(touched, checkpoint[0])
+
+        if ingested:
+            logger.info(f"Indexed blocks {next_number}..{checkpoint[0]} (head {head})")
+        return ingested
+
+    def _ingest_block(self, cursor: sqlite3.Cursor, block: Dict[str, Any]) -> set:
+        """Ghi giao dịch của block; trả về các địa chỉ có tham gia giao dịch"""
+        timestamp = datetime.fromtimestamp(block["timestamp"]).isoformat()
+        touched = set()
+
+        for tx in block["transactions"]:
+            # Giao dịch tạo contract không phải là chuyển tiền giữa hai ví
+            if not tx["to"]:
+                continue
+
+            touched.update((tx["from"], tx["to"]))
+            tx_hash = tx["hash"].hex()
+            # Giao dịch do app gửi đã có dòng (pending): chỉ gắn block_number, ReceiptTracker xác nhận trạng thái.
+            # Dòng failed vì quá hạn chờ (thường là bị reorg rồi mới được đào lại) thì đã lên chuỗi: trả về completed
+            cursor.execute(
+                """INSERT INTO transactions
+                (from_wallet, to_wallet, amount, timestamp, type, status, hash, block_number)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(hash) DO UPDATE SET
+                    block_number = excluded.block_number,
+                    status = CASE WHEN transactions.status = 'failed' THEN excluded.status ELSE transactions.status END
+                WHERE transactions.block_number IS NULL""",
+                (
+                    tx["from"],
+                    tx["to"],
+                    float(self.blockchain.w3.from_wei(tx["value"], "ether")),
+                    timestamp,
+                    "transfer",
+                    "completed",
+                    tx_hash,
+                    block["number"]
+                )
+            )
+
+        cursor.execute(
+            "INSERT OR REPLACE INTO chain_blocks (number, hash, parent_hash, timestamp) VALUES (?, ?, ?, ?)",
+            (block["number"], block["hash"].hex(), block["parentHash"].hex(), block["timestamp"])
+        )
+        return touched
+
+    def _handle_reorg(self, last_number: int) -> int:
+        """Lùi về block chung gần nhất với chuỗi hiện tại; trả về số block đó"""
+        w3 = self.blockchain.w3
+        cursor = self.db.cursor()
+        cursor.execute(
+            "SELECT number, hash FROM chain_blocks WHERE number <= ? ORDER BY number DESC",
+            (last_number,)
+        )
+        fork_point = -1
+        for number, stored_hash in cursor.fetchall():
+            if w3.eth.get_block(number)["hash"].hex() == stored_hash:
+                fork_point = number
+                break
+
+        # Giao dịch trong các block bị bỏ quay về pending: ReceiptTracker xác nhận lại khi được đào lại
+        # (hoặc đánh dấu failed khi quá hạn, tính từ pending_since), thống kê theo ngày bỏ chúng ra cho tới lúc đó
+        cursor.execute(
+            """UPDATE transactions SET block_number = NULL, status = 'pending', pending_since = ?
+            WHERE block_number > ?""",
+            (int(time.time()), fork_point)
+        )
+        cursor.execute("DELETE FROM chain_blocks WHERE number > ?", (fork_point,))
+        self.db.commit()
+        return fork_point
@@ -1,10 +1,17 @@
 import sqlite3
 import threading
 import logging
+import asyncio
+import queue
+import time
 import os
+from contextlib import contextmanager, asynccontextmanager
 from datetime import datetime, timedelta
 from jose import jwt
-import bcrypt
+from migrations import backfill_integer_units, run_migrations
+from metrics import TimedConnection
+from password_hasher import PasswordHasherBusy, get_password_hasher
+from principal_cache import get_principal_cache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -13,18 +20,186 @@ SECRET_KEY = os.getenv("SECRET_KEY", "supersecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 120
 
-local_data = threading.local()
+DATABASE_PATH = os.getenv("DATABASE_PATH", "wallet.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
 
-def get_db() -> sqlite3.Connection:
-    if not hasattr(local_data, 'conn'):
-        local_data.conn = sqlite3.connect('wallet.db', check_same_thread=False)
-        local_data.conn.row_factory = sqlite3.Row
-    return local_data.conn
 
-def close_db():
-    if hasattr(local_data, 'conn'):
-        local_data.conn.close()
-        del local_data.conn
+def open_connection(path: str = None) -> sqlite3.Connection:
+    """Mở một kết nối SQLite đã cấu hình PRAGMA (WAL, synchronous=NORMAL, mmap, cache)"""
+    conn = sqlite3.connect(path or DATABASE_PATH, check_same_thread=False, timeout=DB_POOL_TIMEOUT,
+                           factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+class ConnectionPool:
+    """Pool kết nối SQLite có giới hạn, được làm nóng sẵn khi khởi tạo"""
+
+    def __init__(self, path: str = None, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.path = path or DATABASE_PATH
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._checkouts = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._in_use = 0
+        self._peak_in_use = 0
+        for _ in range(size):
+            self._idle.put(open_connection(self.path))
+        logger.info(f"SQLite connection pool ready: {size} connections to {self.path}")
+
+    def acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise TimeoutError(f"No database connection available after {self.timeout}s")
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+        except sqlite3.Error as e:
+            # Kết nối hỏng: thay bằng kết nối mới để pool không bị hụt
+            logger.error(f"Discarding broken pooled connection: {str(e)}")
+            conn = open_connection(self.path)
+        with self._lock:
+            self._in_use -= 1
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @asynccontextmanager
+    async def async_connection(self):
+        conn = await self.acquire_async()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    async def acquire_async(self) -> sqlite3.Connection:
+        """Như acquire nhưng chờ bằng asyncio.sleep khi pool cạn.
+
+        Không chờ trong asyncio.to_thread: các request đang chờ sẽ chiếm hết thread mặc định,
+        trong khi request đang giữ kết nối lại cần chính các thread đó để chạy xong và trả kết nối.
+        """
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        start = time.perf_counter()
+        delay = 0.001
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+                break
+            except queue.Empty:
+                if time.perf_counter() - start >= self.timeout:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise TimeoutError(f"No database connection available after {self.timeout}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.02)
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+        return conn
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "peak_in_use": self._peak_in_use,
+                "utilisation": self._in_use / self.size if self.size else 0,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "total_wait_seconds": self._total_wait,
+                "avg_wait_seconds": self._total_wait / self._checkouts if self._checkouts else 0,
+                "max_wait_seconds": self._max_wait,
+            }
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def db_connection():
+    """Context manager lấy một kết nối từ pool: with db_connection() as conn"""
+    return get_pool().connection()
+
+
+def async_db_connection():
+    """Như db_connection nhưng dùng trong hàm async: async with async_db_connection() as conn"""
+    return get_pool().async_connection()
+
+
+def get_db():
+    """Dependency FastAPI: mượn một kết nối từ pool trong suốt request"""
+    with db_connection() as conn:
+        yield conn
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -39,156 +214,72 @@ def dict_factory(cursor, row):
     return d
 
 async def async_get_db():
-    conn = sqlite3.connect('wallet.db', check_same_thread=False)
+    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
     conn.row_factory = dict_factory
     return conn
 
 def create_tables():
-    try:
-        conn = sqlite3.connect('wallet.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                private_password TEXT,
-                profileImage TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS wallets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                label TEXT NOT NULL,
-                address TEXT NOT NULL,
-                private_key TEXT NOT NULL,
-                balance REAL DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
-
-        
-        conn.commit()
-        logger.info("Database tables created successfully")
-        
-    except Exception as e:
-        logger.error(f"Error creating tables: {str(e)}")
-        raise
-    finally:
-        cursor.close()
-        conn.close()
+    """Đưa schema lên version mới nhất; gọi một lần khi khởi động app"""
+    with db_connection() as conn:
+        try:
+            version = run_migrations(conn)
+            logger.info(f"Database schema at version {version}")
+            # Dòng cũ chưa được migrate_db.py đổi sang đơn vị số nguyên
+            converted = backfill_integer_units(conn)
+            if converted:
+                logger.info(f"Converted {converted} transaction rows to integer units")
+        except Exception as e:
+            logger.error(f"Error migrating database: {str(e)}")
+            raise
 
 async def login_user(email: str, password: str):
     try:
-        conn = sqlite3.connect('wallet.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
         try:
-            cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-            user = cursor.fetchone()
-            
-            if user:
-                # Kiểm tra xem password trong DB có phải là chuỗi không
-                stored_password = user["password"]
-                
-                # Nếu stored_password là chuỗi, encode thành bytes trước khi so sánh
-                if isinstance(stored_password, str):
-                    # Kiểm tra nếu mật khẩu đã hash
-                    if stored_password.startswith('$2b$') or stored_password.startswith('$2a$'):
-                        stored_password = stored_password.encode('utf-8')
-                    else:
-                        # Nếu mật khẩu chưa hash (do SQL injection), so sánh trực tiếp
-                        if password == stored_password:
-                            access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-                            access_token = create_access_token(
-                                data={"sub": user["email"]}, expires_delta=access_token_expires
-                            )
-                            
-                            profile_image = user["profileImage"] if "profileImage" in user.keys() else None
-                            
-                            return {
-                                "status": "success",
-                                "access_token": access_token,
-                                "token_type": "bearer",
-                                "user": {
-                                    "id": user["id"],
-                                    "name": user["name"],
-                                    "email": user["email"],
-                                    "profileImage": profile_image
-                                }
-                            }
-                        return {
-                            "status": "error",
-                            "message": "Invalid credentials"
-                        }
-                
-                # Thử kiểm tra với bcrypt
+            async with async_db_connection() as conn:
+                cursor = conn.cursor()
                 try:
-                    if bcrypt.checkpw(password.encode('utf-8'), stored_password):
-                        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-                        access_token = create_access_token(
-                            data={"sub": user["email"]}, expires_delta=access_token_expires
-                        )
-                        
-                        profile_image = user["profileImage"] if "profileImage" in user.keys() else None
-                        
-                        return {
-                            "status": "success",
-                            "access_token": access_token,
-                            "token_type": "bearer",
-                            "user": {
-                                "id": user["id"],
-                                "name": user["name"],
-                                "email": user["email"],
-                                "profileImage": profile_image
-                            }
-                        }
-                except Exception as check_error:
-                    logger.error(f"Password check error: {str(check_error)}")
-                    # Thử kiểm tra trực tiếp nếu lỗi với bcrypt
-                    if password == stored_password:
-                        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-                        access_token = create_access_token(
-                            data={"sub": user["email"]}, expires_delta=access_token_expires
-                        )
-                        
-                        profile_image = user["profileImage"] if "profileImage" in user.keys() else None
-                        
-                        return {
-                            "status": "success",
-                            "access_token": access_token,
-                            "token_type": "bearer",
-                            "user": {
-                                "id": user["id"],
-                                "name": user["name"],
-                                "email": user["email"],
-                                "profileImage": profile_image
-                            }
-                        }
-                
-            return {
-                "status": "error",
-                "message": "Invalid credentials"
-            }
-
+                    cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
+                    user = cursor.fetchone()
+                finally:
+                    cursor.close()
         except sqlite3.Error as e:
             logger.error(f"Database error during login: {str(e)}")
             return {
                 "status": "error",
                 "message": f"SQL Error: {str(e)}"  
             }
-        finally:
-            cursor.close()
-            conn.close()
 
+        # Không giữ kết nối pool trong lúc chờ bcrypt
+        if user and await _check_login_password(user, password):
+            access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+            access_token = create_access_token(
+                data={"sub": user["email"]}, expires_delta=access_token_expires
+            )
+            
+            profile_image = user["profileImage"] if "profileImage" in user.keys() else None
+            # Import tại chỗ: image_store dùng async_db_connection của module này
+            from image_store import get_image_store
+            profile_image = get_image_store().url_for(profile_image)
+            
+            return {
+                "status": "success",
+                "access_token": access_token,
+                "token_type": "bearer",
+                "user": {
+                    "id": user["id"],
+                    "name": user["name"],
+                    "email": user["email"],
+                    "profileImage": profile_image
+                }
+            }
+
+        return {
+            "status": "error",
+            "message": "Invalid credentials"
+        }
+
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
         logger.error(f"Unexpected error during login: {str(e)}")
         return {
@@ -196,4 +287,52 @@ async def login_user(email: str, password: str):
             "message": f"Unexpected Error: {str(e)}"
         }
 
-__all__ = ['get_db', 'async_get_db', 'login_user', 'create_tables']
\ No newline at end of file
+async def _check_login_password(user: sqlite3.Row, password: str) -> bool:
+    hasher = get_password_hasher()
+    # Kiểm tra xem password trong DB có phải là chuỗi không
+    stored_password = user["password"]
+    
+    # Nếu stored_password là chuỗi, encode thành bytes trước khi so sánh
+    if isinstance(stored_password, str):
+        # Kiểm tra nếu mật khẩu đã hash
+        if stored_password.startswith('$2b$') or stored_password.startswith('$2a$'):
+            stored_password = stored_password.encode('utf-8')
+        else:
+            # Nếu mật khẩu chưa hash (do SQL injection), so sánh trực tiếp
+            return password == stored_password
+    
+    # Thử kiểm tra với bcrypt
+    try:
+        if not await hasher.verify(password, stored_password):
+            return False
+    except PasswordHasherBusy:
+        raise
+    except Exception as check_error:
+        logger.error(f"Password check error: {str(check_error)}")
+        # Thử kiểm tra trực tiếp nếu lỗi với bcrypt
+        return password == stored_password
+
+    if hasher.needs_rehash(stored_password):
+        await _upgrade_password_hash(user["id"], password, stored_password)
+    return True
+
+async def _upgrade_password_hash(user_id: int, password: str, old_hash: bytes):
+    """Băm lại với BCRYPT_ROUNDS hiện tại sau khi đăng nhập thành công; lỗi không làm hỏng đăng nhập"""
+    hasher = get_password_hasher()
+    try:
+        new_hash = await hasher.hash(password)
+        async with async_db_connection() as conn:
+            # Chỉ ghi nếu mật khẩu chưa bị đổi trong lúc băm
+            cursor = conn.execute(
+                "UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                (new_hash.decode('utf-8'), user_id, old_hash.decode('utf-8'))
+            )
+            conn.commit()
+        if cursor.rowcount:
+            hasher.rehashed += 1
+            get_principal_cache().invalidate_user(user_id)
+            logger.info(f"Upgraded password hash for user {user_id} to cost {hasher.rounds}")
+    except Exception as e:
+        logger.warning(f"Could not upgrade password hash for user {user_id}: {str(e)}")
+
+__all__ = ['get_db', 'db_connection', 'async_db_connection', 'get_pool', 'close_pool', 'open_connection', 'async_get_db', 'login_user', 'create_tables']
\ No newline at end of file
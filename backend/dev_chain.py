@@ -0,0 +1,374 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+from eth_account import Account
+from eth_utils import keccak, to_checksum_address
+import json
+import logging
+import os
+import threading
+import time
+import rlp
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEV_CHAIN_ID = int(os.getenv("DEV_CHAIN_ID", "1337"))
+DEV_CHAIN_ACCOUNTS = int(os.getenv("DEV_CHAIN_ACCOUNTS", "10"))
+DEV_CHAIN_GAS_PRICE = 20 * 10**9
+DEV_CHAIN_INITIAL_BALANCE = 100 * 10**18
+DEV_CHAIN_PORT = int(os.getenv("DEV_CHAIN_PORT", "0"))
+# Độ trễ giả lập cho mỗi request RPC (giây), để benchmark gần với node thật hơn
+DEV_CHAIN_LATENCY = float(os.getenv("DEV_CHAIN_LATENCY", "0"))
+# Số node giả lập dùng chung một chain (thử RPC router); DEV_CHAIN_NODE_LATENCIES đặt độ trễ riêng
+# từng node, ví dụ "0,0,0.3" để làm chậm node thứ ba
+DEV_CHAIN_NODES = int(os.getenv("DEV_CHAIN_NODES", "1"))
+DEV_CHAIN_NODE_LATENCIES = [float(v) for v in os.getenv("DEV_CHAIN_NODE_LATENCIES", "").split(",") if v.strip()]
+
+
+def _hex(value: int) -> str:
+    return hex(value)
+
+
+def _to_int(value) -> int:
+    if isinstance(value, int):
+        return value
+    if not value:
+        return 0
+    return int(value, 16) if isinstance(value, str) else int.from_bytes(value, "big")
+
+
+class RPCError(Exception):
+    def __init__(self, message: str, code: int = -32000):
+        super().__init__(message)
+        self.code = code
+
+
+class DevChain:
+    """Chuỗi giả lập trong tiến trình, tự đào mỗi giao dịch vào một block (giống Ganache)"""
+
+    def __init__(self, chain_id: int = DEV_CHAIN_ID, accounts: int = DEV_CHAIN_ACCOUNTS):
+        self.chain_id = chain_id
+        self.lock = threading.RLock()
+        self.balances: Dict[str, int] = {}
+        self.nonces: Dict[str, int] = {}
+        self.blocks: List[Dict[str, Any]] = []
+        self.transactions: Dict[str, Dict[str, Any]] = {}
+        self.receipts: Dict[str, Dict[str, Any]] = {}
+        self.queued: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._queued_hashes = set()
+
+        # Khóa xác định để các lần chạy cho ra cùng một bộ tài khoản
+        self.accounts = []
+        for idx in range(accounts):
+            account = Account.from_key(keccak(text=f"dev-chain-account-{idx}"))
+            self.accounts.append(account.address)
+            self.balances[account.address] = DEV_CHAIN_INITIAL_BALANCE
+        self._mine_block([])
+
+    # ---- block / giao dịch ----
+
+    def _mine_block(self, txs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        number = len(self.blocks)
+        parent_hash = self.blocks[-1]["hash"] if self.blocks else "0x" + "00" * 32
+        timestamp = int(time.time())
+        block_hash = "0x" + keccak(text=f"{self.chain_id}:{number}:{parent_hash}:{len(txs)}").hex()
+        block = {
+            "number": number,
+            "hash": block_hash,
+            "parentHash": parent_hash,
+            "timestamp": timestamp,
+            "transactions": [],
+        }
+        for index, tx in enumerate(txs):
+            tx.update({"blockNumber": number, "blockHash": block_hash, "transactionIndex": index})
+            block["transactions"].append(tx["hash"])
+            self.receipts[tx["hash"]] = {
+                "transactionHash": tx["hash"],
+                "transactionIndex": _hex(index),
+                "blockNumber": _hex(number),
+                "blockHash": block_hash,
+                "from": tx["from"],
+                "to": tx["to"],
+                "gasUsed": _hex(21000),
+                "cumulativeGasUsed": _hex(21000 * (index + 1)),
+                "effectiveGasPrice": _hex(tx["gasPrice"]),
+                "contractAddress": None,
+                "logs": [],
+                "logsBloom": "0x" + "00" * 256,
+                "status": "0x1",
+                "type": "0x0",
+            }
+        self.blocks.append(block)
+        return block
+
+    def _apply(self, sender: str, to: Optional[str], value: int, nonce: int, gas: int, gas_price: int, tx_hash: str) -> str:
+        with self.lock:
+            if tx_hash in self.transactions or tx_hash in self._queued_hashes:
+                raise RPCError("known transaction")
+            expected = self.nonces.get(sender, 0)
+            if nonce < expected:
+                raise RPCError(f"nonce too low: next nonce {expected}, tx nonce {nonce}")
+            tx = {
+                "hash": tx_hash,
+                "from": sender,
+                "to": to,
+                "value": value,
+                "nonce": nonce,
+                "gas": gas,
+                "gasPrice": gas_price,
+                "input": "0x",
+            }
+            if nonce > expected:
+                # Giống node thật: giữ giao dịch nonce tương lai cho tới khi lấp đủ khoảng trống
+                if nonce in self.queued.setdefault(sender, {}):
+                    raise RPCError("replacement transaction underpriced")
+                self.queued[sender][nonce] = tx
+                self._queued_hashes.add(tx_hash)
+                return tx_hash
+            self._execute(tx)
+            queued = self.queued.get(sender, {})
+            while self.nonces[sender] in queued:
+                next_tx = queued.pop(self.nonces[sender])
+                self._queued_hashes.discard(next_tx["hash"])
+                try:
+                    self._execute(next_tx)
+                except RPCError as e:
+                    logger.warning(f"Dropped queued transaction {next_tx['hash']}: {str(e)}")
+                    break
+            return tx_hash
+
+    def _execute(self, tx: Dict[str, Any]):
+        sender, value, gas, gas_price = tx["from"], tx["value"], tx["gas"], tx["gasPrice"]
+        cost = value + gas * gas_price
+        if self.balances.get(sender, 0) < cost:
+            raise RPCError("insufficient funds for gas * price + value")
+        gas_cost = 21000 * gas_price
+        self.balances[sender] = self.balances.get(sender, 0) - value - gas_cost
+        if tx["to"]:
+            self.balances[tx["to"]] = self.balances.get(tx["to"], 0) + value
+        self.nonces[sender] = tx["nonce"] + 1
+        self.transactions[tx["hash"]] = tx
+        self._mine_block([tx])
+
+    def send_raw_transaction(self, raw_hex: str) -> str:
+        raw = bytes.fromhex(raw_hex[2:] if raw_hex.startswith("0x") else raw_hex)
+        sender = Account.recover_transaction(raw)
+        if raw[0] >= 0xc0:
+            fields = rlp.decode(raw)
+            nonce, gas_price, gas, to, value = (_to_int(fields[0]), _to_int(fields[1]), _to_int(fields[2]), fields[3], _to_int(fields[4]))
+        else:
+            fields = rlp.decode(raw[1:])
+            if raw[0] == 1:
+                nonce, gas_price, gas, to, value = (_to_int(fields[1]), _to_int(fields[2]), _to_int(fields[3]), fields[4], _to_int(fields[5]))
+            else:
+                nonce, gas_price, gas, to, value = (_to_int(fields[1]), _to_int(fields[3]), _to_int(fields[4]), fields[5], _to_int(fields[6]))
+        to_address = to_checksum_address(to) if to else None
+        return self._apply(sender, to_address, value, nonce, gas, gas_price, "0x" + keccak(raw).hex())
+
+    def send_transaction(self, tx: Dict[str, Any]) -> str:
+        sender = to_checksum_address(tx["from"])
+        if sender not in self.accounts:
+            raise RPCError("sender account not recognized")
+        with self.lock:
+            nonce = _to_int(tx["nonce"]) if "nonce" in tx else self.nonces.get(sender, 0)
+            to = to_checksum_address(tx["to"]) if tx.get("to") else None
+            value = _to_int(tx.get("value", 0))
+            gas = _to_int(tx.get("gas", 21000))
+            gas_price = _to_int(tx.get("gasPrice", DEV_CHAIN_GAS_PRICE))
+            tx_hash = "0x" + keccak(text=f"{sender}:{nonce}:{self.chain_id}").hex()
+            return self._apply(sender, to, value, nonce, gas, gas_price, tx_hash)
+
+    # ---- định dạng JSON-RPC ----
+
+    def _format_tx(self, tx: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "hash": tx["hash"],
+            "from": tx["from"],
+            "to": tx["to"],
+            "value": _hex(tx["value"]),
+            "nonce": _hex(tx["nonce"]),
+            "gas": _hex(tx["gas"]),
+            "gasPrice": _hex(tx["gasPrice"]),
+            "input": tx["input"],
+            "blockNumber": _hex(tx["blockNumber"]),
+            "blockHash": tx["blockHash"],
+            "transactionIndex": _hex(tx["transactionIndex"]),
+            "type": "0x0",
+            "chainId": _hex(self.chain_id),
+        }
+
+    def _format_block(self, block: Dict[str, Any], full: bool) -> Dict[str, Any]:
+        txs = [self._format_tx(self.transactions[h]) if full else h for h in block["transactions"]]
+        return {
+            "number": _hex(block["number"]),
+            "hash": block["hash"],
+            "parentHash": block["parentHash"],
+            "timestamp": _hex(block["timestamp"]),
+            "gasLimit": _hex(30_000_000),
+            "gasUsed": _hex(21000 * len(txs)),
+            "miner": "0x" + "00" * 20,
+            "difficulty": "0x0",
+            "extraData": "0x",
+            "transactions": txs,
+        }
+
+    def _resolve_block(self, tag) -> Optional[Dict[str, Any]]:
+        if tag in ("latest", "pending", "safe", "finalized", None):
+            return self.blocks[-1]
+        if tag == "earliest":
+            return self.blocks[0]
+        number = _to_int(tag)
+        return self.blocks[number] if number < len(self.blocks) else None
+
+    def handle(self, method: str, params: List[Any]) -> Any:
+        with self.lock:
+            if method == "eth_chainId":
+                return _hex(self.chain_id)
+            if method == "net_version":
+                return str(self.chain_id)
+            if method == "web3_clientVersion":
+                return "DevChain/v1"
+            if method == "eth_blockNumber":
+                return _hex(len(self.blocks) - 1)
+            if method == "eth_accounts":
+                return list(self.accounts)
+            if method == "eth_gasPrice":
+                return _hex(DEV_CHAIN_GAS_PRICE)
+            if method == "eth_maxPriorityFeePerGas":
+                return _hex(10**9)
+            if method == "eth_estimateGas":
+                return _hex(21000)
+            if method == "eth_getBalance":
+                return _hex(self.balances.get(to_checksum_address(params[0]), 0))
+            if method == "eth_getTransactionCount":
+                return _hex(self.nonces.get(to_checksum_address(params[0]), 0))
+            if method == "eth_getBlockByNumber":
+                block = self._resolve_block(params[0])
+                return self._format_block(block, bool(params[1])) if block else None
+            if method == "eth_getBlockByHash":
+                block = next((b for b in self.blocks if b["hash"] == params[0]), None)
+                return self._format_block(block, bool(params[1])) if block else None
+            if method == "eth_getTransactionByHash":
+                tx = self.transactions.get(params[0])
+                return self._format_tx(tx) if tx else None
+            if method == "eth_getTransactionReceipt":
+                return self.receipts.get(params[0])
+            if method == "eth_sendRawTransaction":
+                return self.send_raw_transaction(params[0])
+            if method == "eth_sendTransaction":
+                return self.send_transaction(params[0])
+        raise RPCError(f"Method {method} not supported", code=-32601)
+
+    def dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        try:
+            response["result"] = self.handle(request.get("method"), request.get("params") or [])
+        except RPCError as e:
+            response["error"] = {"code": e.code, "message": str(e)}
+        except Exception as e:
+            logger.error(f"Dev chain error in {request.get('method')}: {str(e)}")
+            response["error"] = {"code": -32603, "message": str(e)}
+        return response
+
+
+class _DevChainHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"null")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        chain = self.server.chain
+        if isinstance(payload, list):
+            body = [chain.dispatch(item) for item in payload]
+        else:
+            body = chain.dispatch(payload)
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DevChainServer(ThreadingHTTPServer):
+    """HTTP JSON-RPC endpoint cho DevChain; nhiều server có thể dùng chung một chain"""
+
+    daemon_threads = True
+
+    def __init__(self, chain: DevChain, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        super().__init__((host, port), _DevChainHandler)
+        self.chain = chain
+        self.latency = latency
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "DevChainServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="dev-chain", daemon=True)
+        self._thread.start()
+        logger.info(f"Dev chain listening at {self.url}")
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def start_dev_chain(port: int = 0, latency: float = 0.0, chain: DevChain = None) -> DevChainServer:
+    """Khởi động một node giả lập và trả về server (dùng server.url làm BLOCKCHAIN_URL)"""
+    return DevChainServer(chain or DevChain(), port=port, latency=latency).start()
+
+
+_dev_chain_servers: List[DevChainServer] = []
+_dev_chain_lock = threading.Lock()
+
+
+def _node_latency(index: int) -> float:
+    return DEV_CHAIN_NODE_LATENCIES[index] if index < len(DEV_CHAIN_NODE_LATENCIES) else DEV_CHAIN_LATENCY
+
+
+def start_dev_chain_nodes(nodes: int, port: int = 0, chain: DevChain = None) -> List[DevChainServer]:
+    """Nhiều node giả lập trên cùng một chain (port liên tiếp nếu port khác 0)"""
+    chain = chain or DevChain()
+    return [
+        start_dev_chain(port + index if port else 0, _node_latency(index), chain)
+        for index in range(nodes)
+    ]
+
+
+def get_dev_chain_servers() -> List[DevChainServer]:
+    """Các node giả lập dùng chung cho tiến trình khi BLOCKCHAIN_BACKEND=dev"""
+    if not _dev_chain_servers:
+        with _dev_chain_lock:
+            if not _dev_chain_servers:
+                _dev_chain_servers.extend(start_dev_chain_nodes(max(1, DEV_CHAIN_NODES), DEV_CHAIN_PORT))
+    return _dev_chain_servers
+
+
+def get_dev_chain_server() -> DevChainServer:
+    return get_dev_chain_servers()[0]
+
+
+def stop_dev_chain_server():
+    with _dev_chain_lock:
+        for server in _dev_chain_servers:
+            server.stop()
+        _dev_chain_servers.clear()
+
+
+if __name__ == "__main__":
+    servers = start_dev_chain_nodes(max(1, DEV_CHAIN_NODES), DEV_CHAIN_PORT or 7545)
+    logger.info(f"BLOCKCHAIN_URLS={','.join(server.url for server in servers)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
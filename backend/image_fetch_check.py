@@ -0,0 +1,189 @@
+"""Kiểm tra ImageStore.save_remote với một server HTTP cục bộ phục vụ ảnh chậm, quá lớn và sai loại.
+
+    python image_fetch_check.py
+    python image_fetch_check.py --max-bytes 65536 --deadline 1
+
+Ảnh được ghi vào thư mục tạm (không đụng static/profile_images). Thoát với mã 1 nếu có trường hợp sai.
+"""
+from typing import Dict, Any, List, Optional, Tuple, Type
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from image_store import ImageStore, ImageTooLarge, RemoteImageError
+from http_client import close_http_client
+import threading
+import tempfile
+import argparse
+import asyncio
+import logging
+import shutil
+import struct
+import time
+import zlib
+import sys
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def _png_1x1() -> bytes:
+    """PNG 1x1 hợp lệ để thumbnail tạo được"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\0\0\0\0")) + chunk(b"IEND", b"")
+
+
+PNG_BYTES = _png_1x1()
+CHUNK = 4096
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    """Mỗi đường dẫn là một kiểu server xấu; tham số lấy từ server (max_bytes, deadline)"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _head(self, content_type: str, length: Optional[int] = None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if length is not None:
+            self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def _drip(self, total: int, interval: float = 0.0):
+        sent = 0
+        try:
+            while sent < total:
+                size = min(CHUNK, total - sent)
+                self.wfile.write(b"\0" * size)
+                self.wfile.flush()
+                sent += size
+                if interval:
+                    time.sleep(interval)
+        except (BrokenPipeError, ConnectionResetError):
+            # Client đã dừng đọc: đúng điều cần kiểm tra
+            pass
+
+    def do_GET(self):
+        max_bytes, deadline = self.server.max_bytes, self.server.deadline
+        path = self.path.split("?")[0]
+        if path == "/ok.png":
+            self._head("image/png", len(PNG_BYTES))
+            self.wfile.write(PNG_BYTES)
+        elif path == "/page.html":
+            # Đuôi .html nhưng header là ảnh: file lưu phải mang đuôi theo content type
+            self._head("image/png", len(PNG_BYTES))
+            self.wfile.write(PNG_BYTES)
+        elif path == "/not-image":
+            self._head("text/html", 13)
+            self.wfile.write(b"<html></html>")
+        elif path == "/image.svg":
+            self._head("image/svg+xml", 40)
+            self.wfile.write(b"<svg><script>alert(1)</script></svg>    ")
+        elif path == "/declared-huge.png":
+            self._head("image/png", max_bytes * 4)
+            self._drip(max_bytes * 4)
+        elif path == "/chunked-huge.png":
+            # Không có Content-Length: chỉ phát hiện được khi đếm byte lúc đọc
+            self._head("image/png")
+            self._drip(max_bytes * 4)
+        elif path == "/slow-body.png":
+            # Mỗi chunk đến đủ nhanh để không dính read timeout, nhưng tổng thời gian vượt deadline
+            total = CHUNK * 40
+            self._head("image/png", total)
+            self._drip(total, interval=deadline / 10)
+        elif path == "/slow-headers.png":
+            time.sleep(deadline * 3)
+            self._head("image/png", len(PNG_BYTES))
+            self.wfile.write(PNG_BYTES)
+        else:
+            self.send_error(404)
+
+
+def start_image_server(max_bytes: int, deadline: float) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ImageHandler)
+    server.daemon_threads = True
+    server.max_bytes = max_bytes
+    server.deadline = deadline
+    threading.Thread(target=server.serve_forever, name="image-check-server", daemon=True).start()
+    return server
+
+
+# (đường dẫn, lỗi mong đợi hoặc None nếu phải lưu được, đuôi file mong đợi)
+CASES: List[Tuple[str, Optional[Type[Exception]], Optional[str]]] = [
+    ("/ok.png", None, ".png"),
+    ("/page.html", None, ".png"),
+    ("/not-image", RemoteImageError, None),
+    ("/image.svg", RemoteImageError, None),
+    ("/missing.png", RemoteImageError, None),
+    ("/declared-huge.png", ImageTooLarge, None),
+    ("/chunked-huge.png", ImageTooLarge, None),
+    ("/slow-body.png", RemoteImageError, None),
+    ("/slow-headers.png", RemoteImageError, None),
+]
+
+
+async def _check(store: ImageStore, base_url: str, path: str, expected_error: Optional[Type[Exception]],
+                 expected_extension: Optional[str], max_bytes: int, deadline: float) -> Dict[str, Any]:
+    started = time.monotonic()
+    outcome, error = None, None
+    try:
+        stored = await store.save_remote(base_url + path, max_bytes=max_bytes, deadline=deadline)
+        outcome = stored.filename
+    except (ImageTooLarge, RemoteImageError) as e:
+        error = e
+    elapsed = time.monotonic() - started
+
+    if expected_error is None:
+        ok = error is None and outcome.endswith(expected_extension)
+    else:
+        ok = isinstance(error, expected_error)
+    # Không trường hợp nào được chạy quá deadline (thêm chút dư cho việc dọn file tạm)
+    ok = ok and elapsed <= deadline + 0.5
+    return {
+        "path": path,
+        "ok": ok,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "result": outcome if error is None else f"{type(error).__name__}: {error}",
+    }
+
+
+async def run_checks(args) -> int:
+    directory = Path(tempfile.mkdtemp(prefix="image-check-"))
+    server = start_image_server(args.max_bytes, args.deadline)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    store = ImageStore(directory=str(directory))
+    try:
+        results = [
+            await _check(store, base_url, path, error, extension, args.max_bytes, args.deadline)
+            for path, error, extension in CASES
+        ]
+        # File tạm của các lần tải bị hủy phải được xóa
+        leftovers = [path.name for path in directory.iterdir() if path.name.startswith(".upload-")]
+    finally:
+        await close_http_client()
+        server.shutdown()
+        server.server_close()
+        await store.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    for result in results:
+        logger.info(f"{'PASS' if result['ok'] else 'FAIL'} {result['path']:<20} {result['elapsed_ms']:>8} ms  {result['result']}")
+    if leftovers:
+        logger.error(f"Temporary files left behind: {leftovers}")
+    failures = sum(1 for result in results if not result["ok"])
+    logger.info(f"{len(results) - failures}/{len(results)} cases passed")
+    return 1 if failures or leftovers else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Exercise remote profile-image fetching against a local misbehaving server")
+    parser.add_argument("--max-bytes", type=int, default=256 * 1024, help="Byte limit passed to save_remote")
+    parser.add_argument("--deadline", type=float, default=1.0, help="Deadline (s) passed to save_remote")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run_checks(parse_args())))
@@ -0,0 +1,287 @@
+from typing import Optional, Dict, Set, AsyncIterator, NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from fastapi import UploadFile
+from database import async_db_connection
+from http_client import get_http_client
+import mimetypes
+import httpx
+import threading
+import hashlib
+import asyncio
+import logging
+import time
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROFILE_IMAGES_DIR = "static/profile_images"
+PROFILE_IMAGES_URL = "/static/profile_images"
+PROFILE_IMAGE_MAX_BYTES = int(os.getenv("PROFILE_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_CHUNK_SIZE = int(os.getenv("IMAGE_CHUNK_SIZE", str(64 * 1024)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Tổng thời gian tối đa để tải một ảnh từ URL (kết nối + header + toàn bộ nội dung)
+REMOTE_IMAGE_DEADLINE = float(os.getenv("REMOTE_IMAGE_DEADLINE", "15"))
+# Chu kỳ dọn ảnh không còn user nào tham chiếu; file mới hơn IMAGE_GC_GRACE không bị xóa
+# (upload vừa ghi xong nhưng chưa kịp UPDATE users)
+IMAGE_GC_INTERVAL = float(os.getenv("IMAGE_GC_INTERVAL", str(6 * 3600)))
+IMAGE_GC_GRACE = float(os.getenv("IMAGE_GC_GRACE", "3600"))
+
+# Đuôi file được phép cho ảnh tải từ URL (lấy theo content type, không theo đường dẫn URL).
+# Không có .svg: SVG có thể chứa script và được /static phục vụ cùng origin với app
+REMOTE_IMAGE_EXTENSIONS = {".jpg", ".jpe", ".jpeg", ".png", ".gif", ".webp", ".avif", ".bmp", ".ico", ".tif", ".tiff"}
+
+# Biến thể cố định (cạnh vuông, px); "small" là bản trả về mặc định
+THUMBNAIL_SIZES: Dict[str, int] = {"small": 128, "medium": 512}
+DEFAULT_VARIANT = "small"
+
+
+class ImageTooLarge(Exception):
+    """Ảnh vượt quá PROFILE_IMAGE_MAX_BYTES"""
+
+
+class RemoteImageError(Exception):
+    """Không tải được ảnh từ URL (mã lỗi, content type sai, quá thời gian)"""
+
+
+class StoredImage(NamedTuple):
+    digest: str
+    filename: str
+    url: str
+
+
+class ImageStore:
+    """Lưu ảnh đại diện theo SHA-256 nội dung, tạo thumbnail trong thread pool riêng"""
+
+    def __init__(self, directory: str = PROFILE_IMAGES_DIR, workers: int = IMAGE_WORKERS):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending: Set[str] = set()
+        self._gc_task: Optional[asyncio.Task] = None
+        self.stored = 0
+        self.deduplicated = 0
+        self.thumbnails = 0
+        self.thumbnail_errors = 0
+        self.collected = 0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image")
+        return self._executor
+
+    async def save_upload(self, upload: UploadFile) -> StoredImage:
+        async def chunks():
+            while True:
+                chunk = await upload.read(IMAGE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        return await self.save_stream(chunks(), os.path.splitext(upload.filename or "")[1])
+
+    async def save_remote(self, url: str, max_bytes: int = PROFILE_IMAGE_MAX_BYTES,
+                          deadline: float = REMOTE_IMAGE_DEADLINE) -> StoredImage:
+        """Tải ảnh từ URL theo stream qua client dùng chung, dừng ngay khi vượt giới hạn"""
+        try:
+            async with asyncio.timeout(deadline):
+                async with get_http_client().stream("GET", url) as response:
+                    if response.status_code != 200:
+                        raise RemoteImageError("Failed to fetch image from URL")
+                    # Kiểm tra header trước khi đọc byte nào của nội dung
+                    content_type = response.headers.get("content-type", "").split(";")[0].strip().lower()
+                    if not content_type.startswith("image/"):
+                        raise RemoteImageError(f"URL did not return an image (content type '{content_type}')")
+                    extension = mimetypes.guess_extension(content_type)
+                    if extension not in REMOTE_IMAGE_EXTENSIONS:
+                        raise RemoteImageError(f"Unsupported image type '{content_type}'")
+                    content_length = response.headers.get("content-length")
+                    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                        raise ImageTooLarge(f"Image exceeds {max_bytes} bytes")
+
+                    return await self.save_stream(response.aiter_bytes(IMAGE_CHUNK_SIZE), extension, max_bytes)
+        except TimeoutError:
+            raise RemoteImageError(f"Timed out fetching image after {deadline}s")
+        except httpx.HTTPError as e:
+            raise RemoteImageError(f"Failed to fetch image from URL: {str(e)}")
+
+    async def save_stream(self, chunks: AsyncIterator[bytes], extension: str,
+                          max_bytes: int = PROFILE_IMAGE_MAX_BYTES) -> StoredImage:
+        """Ghi từng chunk ra file tạm vừa băm; nội dung đã có thì chỉ dùng lại file cũ"""
+        extension = (extension or ".jpg").lower()
+        digest = hashlib.sha256()
+        size = 0
+        temp_path = self.directory / f".upload-{os.getpid()}-{threading.get_ident()}-{time.monotonic_ns()}"
+        try:
+            with open(temp_path, "wb") as file_object:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise ImageTooLarge(f"Image exceeds {max_bytes} bytes")
+                    digest.update(chunk)
+                    file_object.write(chunk)
+
+            filename = f"{digest.hexdigest()}{extension}"
+            final_path = self.directory / filename
+            if final_path.exists():
+                self.deduplicated += 1
+                # Chạm mtime để GC không xóa file vừa được dùng lại
+                os.utime(final_path)
+            else:
+                os.replace(temp_path, final_path)
+                self.stored += 1
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+
+        self.schedule_thumbnails(digest.hexdigest(), filename)
+        return StoredImage(digest.hexdigest(), filename, f"{PROFILE_IMAGES_URL}/{filename}")
+
+    def schedule_thumbnails(self, digest: str, filename: str):
+        """Tạo thumbnail ở nền; request không chờ"""
+        if Image is None or all(self._variant_path(digest, variant).exists() for variant in THUMBNAIL_SIZES):
+            return
+        with self._lock:
+            if digest in self._pending:
+                return
+            self._pending.add(digest)
+        self.executor.submit(self._make_thumbnails, digest, filename)
+
+    def _make_thumbnails(self, digest: str, filename: str):
+        try:
+            with Image.open(self.directory / filename) as image:
+                # JPEG: để decoder giảm độ phân giải ngay khi đọc
+                image.draft("RGB", (max(THUMBNAIL_SIZES.values()) * 2,) * 2)
+                image = ImageOps.exif_transpose(image).convert("RGB")
+                for variant, size in THUMBNAIL_SIZES.items():
+                    path = self._variant_path(digest, variant)
+                    temp_path = path.with_suffix(".tmp")
+                    ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS).save(temp_path, "JPEG", quality=85, optimize=True)
+                    os.replace(temp_path, path)
+            self.thumbnails += 1
+        except Exception as e:
+            # File không phải ảnh: vẫn phục vụ bản gốc
+            self.thumbnail_errors += 1
+            logger.warning(f"Could not create thumbnails for {filename}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(digest)
+
+    def _variant_path(self, digest: str, variant: str) -> Path:
+        return self.directory / f"{digest}_{variant}.jpg"
+
+    def url_for(self, profile_image: Optional[str], variant: str = DEFAULT_VARIANT) -> Optional[str]:
+        """URL biến thể của ảnh đã lưu nếu đã có; ngược lại trả về nguyên giá trị trong DB"""
+        if not profile_image or not profile_image.startswith(PROFILE_IMAGES_URL + "/") or variant not in THUMBNAIL_SIZES:
+            return profile_image
+        digest = os.path.splitext(os.path.basename(profile_image))[0]
+        if self._variant_path(digest, variant).exists():
+            return f"{PROFILE_IMAGES_URL}/{digest}_{variant}.jpg"
+        return profile_image
+
+    async def collect_garbage(self) -> int:
+        """Xóa ảnh (kèm thumbnail) không còn dòng users.profileImage nào tham chiếu"""
+        async with async_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT DISTINCT profileImage FROM users WHERE profileImage LIKE ?", (PROFILE_IMAGES_URL + "/%",))
+            referenced = {os.path.splitext(os.path.basename(row[0]))[0] for row in cursor.fetchall()}
+        removed = await asyncio.to_thread(self._remove_unreferenced, referenced)
+        if removed:
+            self.collected += removed
+            logger.info(f"Removed {removed} unreferenced profile images")
+        return removed
+
+    def _remove_unreferenced(self, referenced: Set[str]) -> int:
+        cutoff = time.time() - IMAGE_GC_GRACE
+        removed = 0
+        for path in self.directory.iterdir():
+            if not path.is_file():
+                continue
+            stem = path.stem
+            for variant in THUMBNAIL_SIZES:
+                if stem.endswith(f"_{variant}"):
+                    stem = stem[:-len(variant) - 1]
+                    break
+            try:
+                if stem in referenced or path.stat().st_mtime > cutoff:
+                    continue
+                path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
+
+    def start(self):
+        if self._gc_task and not self._gc_task.done():
+            return
+        self._gc_task = asyncio.create_task(self._run_gc(), name="image-gc")
+
+    async def stop(self):
+        if self._gc_task:
+            self._gc_task.cancel()
+            try:
+                await self._gc_task
+            except asyncio.CancelledError:
+                pass
+            self._gc_task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run_gc(self):
+        while True:
+            try:
+                await self.collect_garbage()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Image GC error: {str(e)}")
+            await asyncio.sleep(IMAGE_GC_INTERVAL)
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "thumbnails": self.thumbnails,
+            "thumbnail_errors": self.thumbnail_errors,
+            "thumbnails_pending": pending,
+            "collected": self.collected,
+        }
+
+
+_image_store: Optional[ImageStore] = None
+_image_store_lock = threading.Lock()
+
+
+def get_image_store() -> ImageStore:
+    """ImageStore dùng chung cho toàn tiến trình"""
+    global _image_store
+    if _image_store is None:
+        with _image_store_lock:
+            if _image_store is None:
+                _image_store = ImageStore()
+    return _image_store
+
+
+def start_image_store() -> ImageStore:
+    store = get_image_store()
+    store.start()
+    return store
+
+
+async def stop_image_store():
+    global _image_store
+    if _image_store is not None:
+        await _image_store.stop()
+        _image_store = None
@@ -1,10 +1,26 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, Query
+from fastapi.responses import PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from API.Routes import auth, wallets, transactions
-from database import get_db, create_tables
+from API.Routes import auth, wallets, transactions, dashboard
+from database import db_connection, create_tables, close_pool, get_pool
+from chain_indexer import ChainIndexer
+from receipt_tracker import start_receipt_tracker, stop_receipt_tracker
+from balance_feed import start_balance_feed, stop_balance_feed
+from password_hasher import get_password_hasher, stop_password_hasher
+from tx_signer import get_transaction_signer, stop_transaction_signer
+from treasury import get_treasury, start_treasury, stop_treasury
+from image_store import get_image_store, start_image_store, stop_image_store
+from balance_cache import get_balance_cache
+from principal_cache import get_principal_cache
+from metrics import RequestMetricsMiddleware, snapshot, render_prometheus
+from http_client import close_http_client
+from rpc_router import rpc_router_metrics, stop_rpc_routers
+from blockchain_service import start_blockchain_service, stop_blockchain_service, start_async_blockchain_service, stop_async_blockchain_service
+from contextlib import asynccontextmanager
 import logging
+import os
 import uvicorn
 
 
@@ -18,7 +34,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+INDEXER_ENABLED = os.getenv("INDEXER_ENABLED", "true").lower() == "true"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    create_tables()
+    app.state.blockchain = start_blockchain_service()
+    app.state.async_blockchain = await start_async_blockchain_service()
+
+    app.state.balance_feed = start_balance_feed()
+
+    chain_indexer = None
+    if INDEXER_ENABLED:
+        chain_indexer = ChainIndexer(app.state.blockchain, on_block=app.state.balance_feed.notify_block)
+        chain_indexer.start()
+    app.state.chain_indexer = chain_indexer
+    app.state.receipt_tracker = start_receipt_tracker()
+    app.state.treasury = start_treasury()
+    app.state.image_store = start_image_store()
+    yield
+    await stop_image_store()
+    await close_http_client()
+    await stop_treasury()
+    await stop_receipt_tracker()
+    if chain_indexer:
+        chain_indexer.stop()
+    await stop_balance_feed()
+    await stop_async_blockchain_service()
+    stop_blockchain_service()
+    stop_rpc_routers()
+    stop_password_hasher()
+    stop_transaction_signer()
+    close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.add_middleware(
@@ -27,7 +78,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Content-Disposition"],
 )
+# Ngoài cùng: đo cả thời gian của các middleware khác
+app.add_middleware(RequestMetricsMiddleware)
 
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -36,9 +90,7 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 app.include_router(auth.router, prefix="/api/auth")
 app.include_router(wallets.router, prefix="/api/wallets")
 app.include_router(transactions.router, prefix="/api/transactions")
-
-
-create_tables()
+app.include_router(dashboard.router, prefix="/api/dashboard")
 
 
 @app.get("/")
@@ -49,13 +101,30 @@ async def root():
 async def health_check():
     try:
       
-        db = get_db()
-        db.execute("SELECT 1")
+        with db_connection() as db:
+            db.execute("SELECT 1")
         return {"status": "healthy"}
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
         return {"status": "unhealthy", "error": str(e)}  
 
+@app.get("/metrics")
+async def get_metrics(format: str = Query("prometheus", pattern="^(prometheus|json)$")):
+    """Latency theo route, RPC theo method, SQL theo template và metrics() của các cache/pool"""
+    components = {
+        "balance_cache": get_balance_cache().metrics(),
+        "principal_cache": get_principal_cache().metrics(),
+        "db_pool": get_pool().metrics(),
+        "password_hasher": get_password_hasher().metrics(),
+        "image_store": get_image_store().metrics(),
+        "tx_signer": get_transaction_signer().metrics(),
+        "treasury": get_treasury().metrics(),
+        "rpc_router": rpc_router_metrics(),
+    }
+    if format == "json":
+        return snapshot(components)
+    return PlainTextResponse(render_prometheus(components), media_type="text/plain; version=0.0.4")
+
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, log_level="info")
\ No newline at end of file
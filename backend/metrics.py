@@ -0,0 +1,338 @@
+from typing import Dict, Tuple, List, Any, Optional, Iterable
+from contextlib import contextmanager
+import threading
+import sqlite3
+import logging
+import math
+import time
+import re
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Cận trên của các bucket (giây), giống mặc định của Prometheus client nhưng thêm phía dưới 5ms
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+# Số series tối đa mỗi family; vượt quá thì gom vào nhãn "other" (SQL ghép chuỗi, path lạ, ...)
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "500"))
+SQL_TEMPLATE_MAX_LENGTH = 200
+SQL_TEMPLATE_CACHE_SIZE = 4096
+
+
+class Histogram:
+    """Histogram bucket cố định: đủ để tính p50/p95/p99 gần đúng và xuất dạng Prometheus"""
+
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        index = 0
+        while index < len(LATENCY_BUCKETS) and value > LATENCY_BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Nội suy tuyến tính trong bucket chứa quantile q"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = LATENCY_BUCKETS[index - 1] if index else 0.0
+                upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / bucket_count, self.max)
+            seen += bucket_count
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum_seconds": self.sum,
+            "avg_ms": self.sum / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.quantile(0.50) * 1000,
+            "p95_ms": self.quantile(0.95) * 1000,
+            "p99_ms": self.quantile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+
+class HistogramFamily:
+    """Các histogram cùng tên, phân biệt theo bộ nhãn"""
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._series: Dict[Tuple[str, ...], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: Tuple[str, ...], value: float):
+        with self._lock:
+            histogram = self._series.get(label_values)
+            if histogram is None:
+                if len(self._series) >= METRICS_MAX_SERIES:
+                    label_values = ("other",) * len(self.labels)
+                    histogram = self._series.get(label_values)
+                if histogram is None:
+                    histogram = self._series[label_values] = Histogram()
+            histogram.observe(value)
+
+    def series(self) -> List[Tuple[Tuple[str, ...], Histogram]]:
+        with self._lock:
+            return [(labels, self._copy(histogram)) for labels, histogram in self._series.items()]
+
+    @staticmethod
+    def _copy(histogram: Histogram) -> Histogram:
+        copy = Histogram()
+        copy.counts = list(histogram.counts)
+        copy.count = histogram.count
+        copy.sum = histogram.sum
+        copy.max = histogram.max
+        return copy
+
+    def summary(self) -> List[Dict[str, Any]]:
+        rows = [{**dict(zip(self.labels, labels)), **histogram.summary()} for labels, histogram in self.series()]
+        return sorted(rows, key=lambda row: row["sum_seconds"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+HTTP_REQUEST_DURATION = HistogramFamily(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status"))
+RPC_REQUEST_DURATION = HistogramFamily(
+    "rpc_request_duration_seconds", "Blockchain JSON-RPC latency by method", ("method", "outcome"))
+SQL_STATEMENT_DURATION = HistogramFamily(
+    "sql_statement_duration_seconds", "SQLite time by statement template", ("statement", "phase"))
+
+FAMILIES = [HTTP_REQUEST_DURATION, RPC_REQUEST_DURATION, SQL_STATEMENT_DURATION]
+
+
+@contextmanager
+def rpc_timer(method: str):
+    """Đo một lệnh RPC; lỗi được tính riêng (outcome="error")"""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        if METRICS_ENABLED:
+            RPC_REQUEST_DURATION.observe((method, outcome), time.perf_counter() - started)
+
+
+# --- SQL -----------------------------------------------------------------
+
+_SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SQL_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+# INSERT nhiều dòng: VALUES (?, ...), (?, ...), ... là một template dù có bao nhiêu dòng
+_SQL_ROW_LIST = re.compile(r"\(\?, \.\.\.\)(?:\s*,\s*\(\?, \.\.\.\))+")
+_SQL_WHITESPACE = re.compile(r"\s+")
+_sql_templates: Dict[str, str] = {}
+
+
+def sql_template(sql: str) -> str:
+    """Câu SQL bỏ giá trị literal (kể cả câu ghép chuỗi), gom danh sách '?, ?, ?' và khoảng trắng"""
+    template = _sql_templates.get(sql)
+    if template is None:
+        template = _SQL_STRING.sub("?", sql)
+        template = _SQL_NUMBER.sub("?", template)
+        template = _SQL_PLACEHOLDER_LIST.sub("?, ...", template)
+        template = _SQL_ROW_LIST.sub("(?, ...), ...", template)
+        template = _SQL_WHITESPACE.sub(" ", template).strip()[:SQL_TEMPLATE_MAX_LENGTH]
+        if len(_sql_templates) >= SQL_TEMPLATE_CACHE_SIZE:
+            _sql_templates.clear()
+        _sql_templates[sql] = template
+    return template
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor ghi thời gian execute/fetch theo template của câu lệnh đang chạy"""
+
+    _template = "unknown"
+
+    def _observe(self, phase: str, started: float):
+        SQL_STATEMENT_DURATION.observe((self._template, phase), time.perf_counter() - started)
+
+    def execute(self, sql, parameters=()):
+        if not METRICS_ENABLED:
+            return super().execute(sql, parameters)
+        self._template = sql_template(sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._observe("execute", started)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not METRICS_ENABLED:
+            return super().executemany(sql, seq_of_parameters)
+        self._template = sql_template(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._observe("execute", started)
+
+    def executescript(self, sql_script):
+        if not METRICS_ENABLED:
+            return super().executescript(sql_script)
+        self._template = sql_template(sql_script)
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self._observe("execute", started)
+
+    def fetchone(self):
+        if not METRICS_ENABLED:
+            return super().fetchone()
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._observe("fetch", started)
+
+    def fetchmany(self, size=None):
+        if not METRICS_ENABLED:
+            return super().fetchmany(self.arraysize if size is None else size)
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._observe("fetch", started)
+
+    def fetchall(self):
+        if not METRICS_ENABLED:
+            return super().fetchall()
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._observe("fetch", started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection mà mọi cursor (kể cả conn.execute) đều là TimedCursor; commit cũng được đo"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        if not METRICS_ENABLED or not self.in_transaction:
+            return super().commit()
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            SQL_STATEMENT_DURATION.observe(("COMMIT", "execute"), time.perf_counter() - started)
+
+
+# --- HTTP ----------------------------------------------------------------
+
+class RequestMetricsMiddleware:
+    """ASGI middleware đo latency theo route template (/api/wallets/user/{user_id}), tính cả phần stream"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Router ghi route đã khớp vào scope; không khớp thì gom chung để nhãn không phình ra
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe((scope["method"], route, str(status)), time.perf_counter() - started)
+
+
+# --- Xuất ----------------------------------------------------------------
+
+def snapshot(components: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Dạng JSON: histogram tóm tắt (sắp theo tổng thời gian) + metrics() của các thành phần"""
+    return {
+        "routes": HTTP_REQUEST_DURATION.summary(),
+        "rpc": RPC_REQUEST_DURATION.summary(),
+        "sql": SQL_STATEMENT_DURATION.summary(),
+        "components": components,
+    }
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: Optional[str] = None) -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render_prometheus(components: Dict[str, Dict[str, Any]]) -> str:
+    """Text exposition format của Prometheus"""
+    lines: List[str] = []
+    for family in FAMILIES:
+        lines.append(f"# HELP {family.name} {family.description}")
+        lines.append(f"# TYPE {family.name} histogram")
+        for label_values, histogram in family.series():
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + (math.inf,), histogram.counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                bucket_labels = _labels(family.labels, label_values, f'le="{le}"')
+                lines.append(f"{family.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{family.name}_sum{_labels(family.labels, label_values)} {histogram.sum}")
+            lines.append(f"{family.name}_count{_labels(family.labels, label_values)} {histogram.count}")
+
+    for component, values in components.items():
+        for key, value in values.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            lines.append(f"wallet_{component}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    for family in FAMILIES:
+        family.reset()
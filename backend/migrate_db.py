@@ -0,0 +1,41 @@
+"""Đưa một file wallet.db có sẵn lên schema mới nhất và đổi dữ liệu cũ sang đơn vị số nguyên.
+
+    python migrate_db.py                          # DATABASE_PATH hoặc wallet.db
+    python migrate_db.py --db /data/wallet.db --batch-size 2000 --pause 0.05
+
+Mỗi batch là một transaction ngắn nên có thể chạy khi app đang phục vụ; dừng giữa chừng rồi chạy lại
+sẽ tiếp tục từ chỗ còn thiếu. App cũng tự chạy phần còn lại khi khởi động (create_tables).
+"""
+from migrations import backfill_integer_units, run_migrations, schema_version
+from database import DATABASE_PATH, open_connection
+import argparse
+import logging
+import time
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate wallet.db to the latest schema and convert existing rows in batches")
+    parser.add_argument("--db", default=DATABASE_PATH, help="SQLite database file")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows converted per transaction")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    args = parser.parse_args()
+
+    conn = open_connection(args.db)
+    try:
+        started = time.monotonic()
+        before = schema_version(conn)
+        version = run_migrations(conn)
+        logger.info(f"Schema version {before} -> {version}")
+
+        converted = backfill_integer_units(conn, batch_size=args.batch_size, pause=args.pause)
+        logger.info(f"Converted {converted} transaction rows in {time.monotonic() - started:.1f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+from typing import Callable, List, Tuple
+import sqlite3
+import logging
+import time
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _columns(cursor: sqlite3.Cursor, table: str) -> List[str]:
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [col[1] for col in cursor.fetchall()]
+
+
+def _add_missing_columns(cursor: sqlite3.Cursor, table: str, columns: List[Tuple[str, str]]):
+    existing = _columns(cursor, table)
+    for name, definition in columns:
+        if name not in existing:
+            logger.info(f"Adding {name} column to {table} table")
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def _v1_base_schema(cursor: sqlite3.Cursor):
+    """Bảng gốc; DB cũ (tạo trước khi có migration) được bổ sung các cột còn thiếu"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            private_password TEXT,
+            profileImage TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS wallets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            address TEXT NOT NULL,
+            private_key TEXT NOT NULL,
+            balance REAL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            balance_updated_at REAL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    # ALTER TABLE không cho phép default CURRENT_TIMESTAMP nên created_at cũ để trống
+    _add_missing_columns(cursor, "wallets", [
+        ("label", "TEXT DEFAULT 'My Wallet'"),
+        ("address", "TEXT"),
+        ("private_key", "TEXT"),
+        ("balance", "REAL DEFAULT 0"),
+        ("created_at", "TIMESTAMP"),
+        # Thời điểm (epoch) số dư được đối chiếu với node lần cuối, dùng để tính stale_after
+        ("balance_updated_at", "REAL"),
+    ])
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_wallet TEXT NOT NULL,
+            to_wallet TEXT NOT NULL,
+            amount REAL NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            hash TEXT,
+            block_number INTEGER
+        )
+    """)
+    _add_missing_columns(cursor, "transactions", [
+        ("hash", "TEXT"),
+        ("block_number", "INTEGER"),
+    ])
+
+    # Các block đã được chain_indexer ghi nhận (checkpoint + phát hiện reorg)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chain_blocks (
+            number INTEGER PRIMARY KEY,
+            hash TEXT NOT NULL,
+            parent_hash TEXT NOT NULL,
+            timestamp INTEGER NOT NULL
+        )
+    """)
+
+    # Nonce đã cấp cho từng địa chỉ gửi, dùng chung giữa các worker (nonce_manager)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS account_nonces (
+            address TEXT PRIMARY KEY,
+            next_nonce INTEGER NOT NULL,
+            reserved_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS released_nonces (
+            address TEXT NOT NULL,
+            nonce INTEGER NOT NULL,
+            PRIMARY KEY (address, nonce)
+        )
+    """)
+
+
+def _v2_indexes(cursor: sqlite3.Cursor):
+    """Chỉ mục cho các truy vấn nóng; hash giao dịch trở thành UNIQUE"""
+    # Gộp các dòng trùng hash (indexer và route cùng ghi một giao dịch) trước khi đặt UNIQUE:
+    # giữ dòng cũ nhất, lấy block_number từ dòng nào đã có
+    cursor.execute("""
+        UPDATE transactions
+        SET block_number = (
+            SELECT MAX(t.block_number) FROM transactions t WHERE t.hash = transactions.hash
+        )
+        WHERE block_number IS NULL AND hash IN (
+            SELECT hash FROM transactions WHERE hash IS NOT NULL GROUP BY hash HAVING COUNT(*) > 1
+        )
+    """)
+    cursor.execute("""
+        DELETE FROM transactions
+        WHERE hash IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM transactions WHERE hash IS NOT NULL GROUP BY hash
+        )
+    """)
+    if cursor.rowcount:
+        logger.warning(f"Removed {cursor.rowcount} duplicate transaction rows")
+
+    cursor.execute("DROP INDEX IF EXISTS idx_transactions_from_wallet")
+    cursor.execute("DROP INDEX IF EXISTS idx_transactions_to_wallet")
+    cursor.execute("DROP INDEX IF EXISTS idx_transactions_hash")
+
+    cursor.execute("CREATE UNIQUE INDEX idx_transactions_hash ON transactions (hash)")
+    # Lịch sử theo địa chỉ sắp xếp theo thời gian: đọc thẳng theo thứ tự chỉ mục, không cần sort
+    cursor.execute("CREATE INDEX idx_transactions_from_wallet ON transactions (from_wallet, timestamp)")
+    cursor.execute("CREATE INDEX idx_transactions_to_wallet ON transactions (to_wallet, timestamp)")
+    # receipt_tracker chỉ quét các giao dịch còn pending
+    cursor.execute("CREATE INDEX idx_transactions_pending ON transactions (id) WHERE status = 'pending'")
+
+    # Danh sách ví của user theo created_at; tra theo địa chỉ lấy luôn user_id/số dư từ chỉ mục
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallets_user_id ON wallets (user_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallets_address ON wallets (address, user_id, balance)")
+
+
+def _v3_keyset_history(cursor: sqlite3.Cursor):
+    """Lịch sử giao dịch phân trang theo (block_number, id) thay vì timestamp"""
+    # CURRENT_TIMESTAMP ghi 'YYYY-MM-DD HH:MM:SS', code ghi isoformat(): đưa về một dạng để so sánh chuỗi đúng
+    cursor.execute("""
+        UPDATE transactions SET timestamp = replace(timestamp, ' ', 'T')
+        WHERE timestamp LIKE '____-__-__ %'
+    """)
+
+    cursor.execute("DROP INDEX IF EXISTS idx_transactions_from_wallet")
+    cursor.execute("DROP INDEX IF EXISTS idx_transactions_to_wallet")
+    # rowid (id) nằm cuối mọi chỉ mục nên thứ tự chỉ mục chính là (block_number, id)
+    cursor.execute("CREATE INDEX idx_transactions_from_wallet ON transactions (from_wallet, block_number)")
+    cursor.execute("CREATE INDEX idx_transactions_to_wallet ON transactions (to_wallet, block_number)")
+
+
+# 1 ETH = 10^9 gwei. Số nguyên SQLite là 64 bit (tối đa ~9.2 * 10^18) nên wei chỉ chứa được ~9.2 ETH;
+# lưu gwei thì chứa được ~9.2 tỉ ETH và vẫn cộng/so sánh chính xác bằng số nguyên
+GWEI_PER_ETH = 10**9
+
+
+def to_gwei(amount: float) -> int:
+    return int(round(amount * GWEI_PER_ETH))
+
+
+def _gwei_sql(value: str) -> str:
+    return f"CAST(round({value} * {GWEI_PER_ETH}) AS INTEGER)"
+
+
+def _epoch_sql(value: str, block_number: str) -> str:
+    """Biểu thức SQL đổi timestamp (mọi dạng writer từng ghi) sang epoch giây.
+
+    Số giữ nguyên; chuỗi có múi giờ để SQLite tự quy về UTC, 'YYYY-MM-DD HH:MM:SS' là CURRENT_TIMESTAMP (UTC);
+    còn lại là giờ địa phương của datetime.now().isoformat() nên thêm 'utc'. Không đọc được thì lấy giờ của block, cuối cùng là 0.
+    """
+    return f"""COALESCE(
+        CASE
+            WHEN typeof({value}) IN ('integer', 'real') THEN CAST({value} AS INTEGER)
+            WHEN {value} GLOB '*[+-][0-9][0-9]:[0-9][0-9]' OR {value} GLOB '*Z' THEN CAST(strftime('%s', {value}) AS INTEGER)
+            WHEN {value} LIKE '____-__-__ __:__:__' THEN CAST(strftime('%s', {value}) AS INTEGER)
+            ELSE CAST(strftime('%s', {value}, 'utc') AS INTEGER)
+        END,
+        (SELECT b.timestamp FROM chain_blocks b WHERE b.number = {block_number}),
+        0
+    )"""
+
+
+def _v4_integer_units(cursor: sqlite3.Cursor):
+    """Cột số nguyên: số tiền theo gwei, thời gian theo epoch giây; chỉ mục theo block_number.
+
+    Cột REAL/chuỗi cũ vẫn là thứ các writer ghi và API trả về; trigger suy ra cột số nguyên cho mọi dòng
+    mới hoặc bị sửa. Dòng có sẵn được đổi theo batch bởi backfill_integer_units (migrate_db.py),
+    không làm trong migration để không giữ khóa ghi suốt lúc đổi cả bảng.
+    """
+    _add_missing_columns(cursor, "transactions", [
+        ("amount_gwei", "INTEGER"),
+        ("timestamp_epoch", "INTEGER"),
+    ])
+    _add_missing_columns(cursor, "wallets", [
+        ("balance_gwei", "INTEGER"),
+    ])
+
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_units_insert AFTER INSERT ON transactions
+        BEGIN
+            UPDATE transactions SET
+                amount_gwei = {_gwei_sql("NEW.amount")},
+                timestamp_epoch = {_epoch_sql("NEW.timestamp", "NEW.block_number")}
+            WHERE id = NEW.id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_units_update AFTER UPDATE OF amount, timestamp ON transactions
+        BEGIN
+            UPDATE transactions SET
+                amount_gwei = {_gwei_sql("NEW.amount")},
+                timestamp_epoch = {_epoch_sql("NEW.timestamp", "NEW.block_number")}
+            WHERE id = NEW.id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_wallets_units_insert AFTER INSERT ON wallets
+        BEGIN
+            UPDATE wallets SET balance_gwei = {_gwei_sql("NEW.balance")} WHERE id = NEW.id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_wallets_units_update AFTER UPDATE OF balance ON wallets
+        BEGIN
+            UPDATE wallets SET balance_gwei = {_gwei_sql("NEW.balance")} WHERE id = NEW.id;
+        END
+    """)
+    # Bảng ví nhỏ: đổi luôn trong migration
+    cursor.execute(f"UPDATE wallets SET balance_gwei = {_gwei_sql('balance')} WHERE balance_gwei IS NULL")
+
+    # Lọc theo khoảng thời gian / số tiền của một địa chỉ và quét theo block (reorg, thống kê)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_from_epoch ON transactions (from_wallet, timestamp_epoch)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_to_epoch ON transactions (to_wallet, timestamp_epoch)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_block_number ON transactions (block_number)")
+    # Các dòng chưa đổi: backfill đọc thẳng từ chỉ mục này, đổi xong thì chỉ mục rỗng
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_unconverted ON transactions (id)
+        WHERE amount_gwei IS NULL OR timestamp_epoch IS NULL
+    """)
+
+
+SECONDS_PER_DAY = 86400
+# Giao dịch được tính vào thống kê: đã xác nhận (writer cũ ghi 'success') và đã có cột số nguyên
+_COUNTED = "{row}.status IN ('completed', 'success') AND {row}.amount_gwei IS NOT NULL AND {row}.timestamp_epoch IS NOT NULL"
+
+
+def _daily_stats_sql(row: str, sign: int) -> str:
+    """Các câu lệnh cộng (sign=1) hoặc trừ (sign=-1) một giao dịch vào wallet_daily_stats của hai đầu.
+
+    Dòng của ngày chưa có được tạo với số dư cuối ngày trước đó; số dư chạy của mọi ngày từ ngày giao dịch
+    trở đi được cộng dồn, nên giao dịch ghi muộn (indexer bắt kịp) vẫn đúng. Không dùng INSERT OR IGNORE:
+    trigger chạy từ nhánh DO UPDATE của upsert sẽ bị ON CONFLICT ABORT của câu lệnh ngoài ghi đè.
+    """
+    day = f"({row}.timestamp_epoch / {SECONDS_PER_DAY})"
+    statements = []
+    for address, prefix, balance_sign in ((f"{row}.to_wallet", "in", 1), (f"{row}.from_wallet", "out", -1)):
+        statements.append(f"""
+            INSERT INTO wallet_daily_stats (address, day, inflow_gwei, outflow_gwei, tx_in, tx_out, balance_gwei)
+            SELECT {address}, {day}, 0, 0, 0, 0, COALESCE((
+                SELECT balance_gwei FROM wallet_daily_stats
+                WHERE address = {address} AND day < {day} ORDER BY day DESC LIMIT 1
+            ), 0)
+            WHERE NOT EXISTS (SELECT 1 FROM wallet_daily_stats WHERE address = {address} AND day = {day})""")
+        statements.append(f"""
+            UPDATE wallet_daily_stats SET
+                {prefix}flow_gwei = {prefix}flow_gwei + {sign} * {row}.amount_gwei,
+                tx_{prefix} = tx_{prefix} + {sign}
+            WHERE address = {address} AND day = {day}""")
+        statements.append(f"""
+            UPDATE wallet_daily_stats SET balance_gwei = balance_gwei + {sign * balance_sign} * {row}.amount_gwei
+            WHERE address = {address} AND day >= {day}""")
+    return ";".join(statements) + ";"
+
+
+def _v5_wallet_daily_stats(cursor: sqlite3.Cursor):
+    """Thống kê theo ngày (UTC) cho từng địa chỉ, cập nhật dần bằng trigger trên transactions.
+
+    Số dư chạy là tổng tiền vào trừ tiền ra của các giao dịch đã ghi nhận (không gồm phí gas).
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS wallet_daily_stats (
+            address TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            inflow_gwei INTEGER NOT NULL,
+            outflow_gwei INTEGER NOT NULL,
+            tx_in INTEGER NOT NULL,
+            tx_out INTEGER NOT NULL,
+            balance_gwei INTEGER NOT NULL,
+            PRIMARY KEY (address, day)
+        ) WITHOUT ROWID
+    """)
+
+    # Dòng mới chưa có cột số nguyên: trigger đơn vị của v4 điền vào bằng UPDATE, trigger update bên dưới sẽ cộng
+    watched = "amount_gwei, timestamp_epoch, status, from_wallet, to_wallet"
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_stats_insert AFTER INSERT ON transactions
+        WHEN {_COUNTED.format(row="NEW")}
+        BEGIN {_daily_stats_sql("NEW", 1)} END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_stats_update_old AFTER UPDATE OF {watched} ON transactions
+        WHEN {_COUNTED.format(row="OLD")}
+        BEGIN {_daily_stats_sql("OLD", -1)} END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_stats_update_new AFTER UPDATE OF {watched} ON transactions
+        WHEN {_COUNTED.format(row="NEW")}
+        BEGIN {_daily_stats_sql("NEW", 1)} END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_stats_delete AFTER DELETE ON transactions
+        WHEN {_COUNTED.format(row="OLD")}
+        BEGIN {_daily_stats_sql("OLD", -1)} END
+    """)
+
+    # Dựng từ các dòng đã đổi đơn vị; dòng backfill sau này đi qua trigger update
+    cursor.execute("DELETE FROM wallet_daily_stats")
+    cursor.execute(f"""
+        INSERT INTO wallet_daily_stats (address, day, inflow_gwei, outflow_gwei, tx_in, tx_out, balance_gwei)
+        SELECT address, day, inflow, outflow, tx_in, tx_out,
+               SUM(inflow - outflow) OVER (PARTITION BY address ORDER BY day)
+        FROM (
+            SELECT address, day, SUM(inflow) AS inflow, SUM(outflow) AS outflow,
+                   SUM(tx_in) AS tx_in, SUM(tx_out) AS tx_out
+            FROM (
+                SELECT to_wallet AS address, timestamp_epoch / {SECONDS_PER_DAY} AS day,
+                       amount_gwei AS inflow, 0 AS outflow, 1 AS tx_in, 0 AS tx_out
+                FROM transactions WHERE {_COUNTED.format(row="transactions")}
+                UNION ALL
+                SELECT from_wallet, timestamp_epoch / {SECONDS_PER_DAY}, 0, amount_gwei, 0, 1
+                FROM transactions WHERE {_COUNTED.format(row="transactions")}
+            )
+            GROUP BY address, day
+        )
+    """)
+    logger.info(f"Built {cursor.rowcount} daily wallet stats rows")
+
+
+def _v6_pending_since(cursor: sqlite3.Cursor):
+    """Thời điểm giao dịch (lại) thành pending; giao dịch bị reorg được tính hạn chờ từ lúc bị gỡ khỏi block"""
+    _add_missing_columns(cursor, "transactions", [("pending_since", "INTEGER")])
+
+
+# (version, mô tả, hàm); chỉ thêm vào cuối, không sửa migration đã phát hành
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "base schema", _v1_base_schema),
+    (2, "lookup indexes and unique transaction hash", _v2_indexes),
+    (3, "keyset indexes for transaction history", _v3_keyset_history),
+    (4, "integer gwei amounts and epoch timestamps", _v4_integer_units),
+    (5, "incremental daily wallet stats", _v5_wallet_daily_stats),
+    (6, "pending_since for transactions returned to pending", _v6_pending_since),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """Chạy các migration có version lớn hơn PRAGMA user_version; trả về version hiện tại.
+
+    Mỗi migration chạy trong một transaction (BEGIN IMMEDIATE) cùng với việc tăng user_version,
+    nên nhiều worker khởi động cùng lúc cũng chỉ có một worker áp dụng.
+    """
+    cursor = conn.cursor()
+    try:
+        for version, description, migrate in MIGRATIONS:
+            if schema_version(conn) >= version:
+                continue
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # Worker khác có thể vừa áp dụng xong trong lúc chờ khóa
+                if schema_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                migrate(cursor)
+                cursor.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            logger.info(f"Applied migration {version}: {description}")
+        return schema_version(conn)
+    finally:
+        cursor.close()
+
+
+def backfill_integer_units(conn: sqlite3.Connection, batch_size: int = 5000, pause: float = 0.0) -> int:
+    """Đổi các dòng transactions cũ sang amount_gwei/timestamp_epoch, mỗi batch một transaction ngắn.
+
+    Chạy được khi app đang phục vụ (dòng mới đã có trigger lo); chạy lại nhiều lần không sao.
+    Trả về số dòng đã đổi.
+    """
+    converted = 0
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute(
+                    f"""UPDATE transactions SET
+                        amount_gwei = {_gwei_sql("amount")},
+                        timestamp_epoch = {_epoch_sql("timestamp", "transactions.block_number")}
+                    WHERE id IN (
+                        SELECT id FROM transactions INDEXED BY idx_transactions_unconverted
+                        WHERE amount_gwei IS NULL OR timestamp_epoch IS NULL
+                        ORDER BY id LIMIT ?
+                    )""",
+                    (batch_size,)
+                )
+                count = cursor.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            converted += count
+            if count < batch_size:
+                break
+            logger.info(f"Converted {converted} transaction rows to integer units")
+            if pause:
+                time.sleep(pause)
+        return converted
+    finally:
+        cursor.close()
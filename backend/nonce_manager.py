@@ -0,0 +1,202 @@
+from typing import Optional, Dict, Set, List
+from sqlite3 import Connection
+from contextlib import contextmanager
+from database import open_connection
+import threading
+import asyncio
+import logging
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Sau bao lâu thì đối chiếu lại với số giao dịch pending trên node
+NONCE_SYNC_INTERVAL = float(os.getenv("NONCE_SYNC_INTERVAL", "30"))
+# Không cấp nonce nào trong khoảng này mà node vẫn thấp hơn => giao dịch đã bị rơi, lấp lại khoảng trống
+NONCE_GAP_TIMEOUT = float(os.getenv("NONCE_GAP_TIMEOUT", "60"))
+
+# Lỗi cho thấy nonce cục bộ đã lệch với node (không phải lỗi của riêng giao dịch)
+NONCE_ERRORS = ("nonce too low", "nonce too high", "already known", "known transaction", "replacement transaction underpriced")
+
+
+def is_nonce_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(marker in message for marker in NONCE_ERRORS)
+
+
+class NonceManager:
+    """Cấp nonce cho từng địa chỉ gửi mà không cần hỏi node mỗi lần gửi.
+
+    Bảng account_nonces là nguồn chuẩn (BEGIN IMMEDIATE nên an toàn giữa nhiều worker);
+    trong tiến trình chỉ giữ thời điểm đồng bộ gần nhất để biết khi nào cần hỏi lại node.
+    """
+
+    def __init__(self, sync_interval: float = NONCE_SYNC_INTERVAL, gap_timeout: float = NONCE_GAP_TIMEOUT):
+        self.sync_interval = sync_interval
+        self.gap_timeout = gap_timeout
+        self._lock = threading.Lock()
+        self._synced_at: Dict[str, float] = {}
+        self._stale: Set[str] = set()
+        self._conn: Optional[Connection] = None
+        self._conn_lock = threading.Lock()
+
+    @contextmanager
+    def _connection(self):
+        """Kết nối riêng, không mượn từ pool.
+
+        Route gửi giao dịch đang giữ một kết nối pool (get_db) khi xin nonce; nếu nonce cũng mượn từ pool
+        thì khi số request đồng thời bằng kích thước pool, các request chờ lẫn nhau tới timeout.
+        """
+        with self._conn_lock:
+            if self._conn is None:
+                self._conn = open_connection()
+            yield self._conn
+
+    def needs_sync(self, address: str) -> bool:
+        """Có cần gửi kèm get_transaction_count(address, "pending") cho lần cấp tới không"""
+        with self._lock:
+            if address in self._stale:
+                return True
+            synced_at = self._synced_at.get(address)
+        return synced_at is None or time.monotonic() - synced_at > self.sync_interval
+
+    def reserve(self, address: str, chain_nonce: Optional[int] = None) -> int:
+        return self.reserve_many(address, 1, chain_nonce)[0]
+
+    async def reserve_async(self, address: str, chain_nonce: Optional[int] = None) -> int:
+        return await asyncio.to_thread(self.reserve, address, chain_nonce)
+
+    def reserve_many(self, address: str, count: int, chain_nonce: Optional[int] = None) -> List[int]:
+        """Cấp `count` nonce tăng dần trong một transaction (lô giao dịch gửi liền nhau)"""
+        with self._connection() as conn:
+            return self._reserve(conn, address, chain_nonce, count)
+
+    async def reserve_many_async(self, address: str, count: int, chain_nonce: Optional[int] = None) -> List[int]:
+        return await asyncio.to_thread(self.reserve_many, address, count, chain_nonce)
+
+    def release(self, address: str, nonce: int):
+        """Trả lại nonce của giao dịch không tới được node để lần cấp sau dùng lại"""
+        with self._connection() as conn:
+            self._release(conn, address, nonce)
+
+    async def release_async(self, address: str, nonce: int):
+        await asyncio.to_thread(self.release, address, nonce)
+
+    def handle_send_error(self, address: str, nonce: int, error: Exception) -> bool:
+        """Xử lý lỗi gửi; trả về True nếu là lỗi nonce (nên thử lại sau khi đồng bộ)"""
+        if is_nonce_error(error):
+            self.mark_stale(address)
+            return True
+        self.release(address, nonce)
+        return False
+
+    async def handle_send_error_async(self, address: str, nonce: int, error: Exception) -> bool:
+        if is_nonce_error(error):
+            self.mark_stale(address)
+            return True
+        await self.release_async(address, nonce)
+        return False
+
+    def mark_stale(self, address: str):
+        """Lần cấp tới sẽ lấy số pending của node làm chuẩn"""
+        with self._lock:
+            self._stale.add(address)
+
+    def _reserve(self, conn: Connection, address: str, chain_nonce: Optional[int], count: int = 1) -> List[int]:
+        now = time.time()
+        with self._lock:
+            force = address in self._stale and chain_nonce is not None
+
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("SELECT next_nonce, reserved_at FROM account_nonces WHERE address = ?", (address,))
+            row = cursor.fetchone()
+
+            if row is None:
+                if chain_nonce is None:
+                    raise ValueError(f"No nonce state for {address}; chain nonce required")
+                next_nonce = chain_nonce
+            elif chain_nonce is None:
+                next_nonce = row[0]
+            elif force or chain_nonce > row[0]:
+                # Node là chuẩn: sau lỗi nonce, hoặc có giao dịch gửi từ nơi khác
+                next_nonce = chain_nonce
+            elif chain_nonce < row[0] and now - row[1] > self.gap_timeout:
+                logger.warning(f"Nonce gap for {address}: node at {chain_nonce}, local at {row[0]}; resetting")
+                next_nonce = chain_nonce
+            else:
+                next_nonce = row[0]
+
+            if chain_nonce is not None:
+                cursor.execute(
+                    "DELETE FROM released_nonces WHERE address = ? AND (nonce < ? OR nonce >= ?)",
+                    (address, chain_nonce, next_nonce)
+                )
+
+            # Ưu tiên lấp nonce đã trả lại để không để hở chuỗi nonce
+            cursor.execute(
+                "SELECT nonce FROM released_nonces WHERE address = ? AND nonce < ? ORDER BY nonce LIMIT ?",
+                (address, next_nonce, count)
+            )
+            nonces = [row[0] for row in cursor.fetchall()]
+            if nonces:
+                cursor.execute(
+                    "DELETE FROM released_nonces WHERE address = ? AND nonce BETWEEN ? AND ?",
+                    (address, nonces[0], nonces[-1])
+                )
+            while len(nonces) < count:
+                nonces.append(next_nonce)
+                next_nonce += 1
+
+            cursor.execute(
+                """INSERT INTO account_nonces (address, next_nonce, reserved_at) VALUES (?, ?, ?)
+                ON CONFLICT(address) DO UPDATE SET next_nonce = excluded.next_nonce, reserved_at = excluded.reserved_at""",
+                (address, next_nonce, now)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+        if chain_nonce is not None:
+            with self._lock:
+                self._synced_at[address] = time.monotonic()
+                self._stale.discard(address)
+        return nonces
+
+    def _release(self, conn: Connection, address: str, nonce: int):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT next_nonce FROM account_nonces WHERE address = ?", (address,))
+            row = cursor.fetchone()
+            if row and nonce == row[0] - 1:
+                # Nonce cuối cùng: chỉ cần lùi bộ đếm
+                cursor.execute("UPDATE account_nonces SET next_nonce = ? WHERE address = ?", (nonce, address))
+            elif row and nonce < row[0]:
+                cursor.execute("INSERT OR IGNORE INTO released_nonces (address, nonce) VALUES (?, ?)", (address, nonce))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error releasing nonce {nonce} for {address}: {str(e)}")
+        finally:
+            cursor.close()
+
+
+_nonce_manager: Optional[NonceManager] = None
+_nonce_lock = threading.Lock()
+
+
+def get_nonce_manager() -> NonceManager:
+    """NonceManager dùng chung cho toàn tiến trình"""
+    global _nonce_manager
+    if _nonce_manager is None:
+        with _nonce_lock:
+            if _nonce_manager is None:
+                _nonce_manager = NonceManager()
+    return _nonce_manager
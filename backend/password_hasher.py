@@ -0,0 +1,145 @@
+from typing import Optional, Dict, Union, Callable, Any
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import asyncio
+import logging
+import bcrypt
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Số yêu cầu tối đa đang chạy + đang chờ; vượt quá thì từ chối ngay thay vì để hàng đợi dài ra
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+
+class PasswordHasherBusy(Exception):
+    """Hàng đợi bcrypt đã đầy"""
+
+
+class PasswordHasher:
+    """Chạy bcrypt trong thread pool riêng để không chặn event loop.
+
+    bcrypt nhả GIL trong lúc băm nên thread pool đủ để chạy song song trên nhiều core.
+    """
+
+    def __init__(self, rounds: int = BCRYPT_ROUNDS, workers: int = PASSWORD_HASH_WORKERS,
+                 max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self.max_pending_seen = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def hash(self, password: str) -> bytes:
+        return await self._submit(self.hash_sync, password)
+
+    async def verify(self, password: str, hashed: Union[str, bytes]) -> bool:
+        return await self._submit(self.verify_sync, password, hashed)
+
+    def hash_sync(self, password: str) -> bytes:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=self.rounds))
+
+    def verify_sync(self, password: str, hashed: Union[str, bytes]) -> bool:
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        return bcrypt.checkpw(password.encode('utf-8'), hashed)
+
+    def needs_rehash(self, hashed: Union[str, bytes]) -> bool:
+        """Hash được tạo với cost thấp hơn cấu hình hiện tại"""
+        if isinstance(hashed, bytes):
+            hashed = hashed.decode('utf-8', errors='ignore')
+        try:
+            return int(hashed.split("$")[2]) < self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "max_pending_seen": self.max_pending_seen,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                "avg_wait_ms": self._wait_total / self.completed * 1000 if self.completed else 0.0,
+                "avg_run_ms": self._run_total / self.completed * 1000 if self.completed else 0.0,
+            }
+
+    async def _submit(self, fn: Callable[..., Any], *args) -> Any:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordHasherBusy(f"Password hashing queue is full ({self.max_pending} pending)")
+            self._pending += 1
+            self.max_pending_seen = max(self.max_pending_seen, self._pending)
+        submitted = time.monotonic()
+
+        def run():
+            started = time.monotonic()
+            with self._lock:
+                self._running += 1
+            try:
+                return fn(*args)
+            finally:
+                finished = time.monotonic()
+                with self._lock:
+                    self._running -= 1
+                    self.completed += 1
+                    self._wait_total += started - submitted
+                    self._run_total += finished - started
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, run)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+
+_password_hasher: Optional[PasswordHasher] = None
+_password_hasher_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """PasswordHasher dùng chung cho toàn tiến trình"""
+    global _password_hasher
+    if _password_hasher is None:
+        with _password_hasher_lock:
+            if _password_hasher is None:
+                _password_hasher = PasswordHasher()
+    return _password_hasher
+
+
+def stop_password_hasher():
+    global _password_hasher
+    if _password_hasher is not None:
+        _password_hasher.shutdown()
+        _password_hasher = None
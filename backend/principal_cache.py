@@ -0,0 +1,122 @@
+from typing import Optional, Dict, Any, Set, Tuple
+from collections import OrderedDict
+import threading
+import logging
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+
+class PrincipalCache:
+    """Cache người dùng đã xác thực theo token (claims + UserInDB), LRU + TTL trong tiến trình.
+
+    Mục không sống quá thời điểm exp của token. Khi dòng users thay đổi thì invalidate_user()
+    xóa mọi token của user đó; version giống BalanceCache để kết quả đọc DB trước lúc
+    invalidate không được ghi lại vào cache.
+    """
+
+    def __init__(self, max_entries: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # token -> (claims, user, hết hạn theo time.time())
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], Any, float]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._invalidated: "OrderedDict[int, int]" = OrderedDict()
+        self._version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def version(self) -> int:
+        """Lấy trước khi đọc bảng users, truyền lại cho set()"""
+        with self._lock:
+            return self._version
+
+    def get(self, token: str) -> Optional[Tuple[Dict[str, Any], Any]]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or time.time() >= entry[2]:
+                if entry is not None:
+                    self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def set(self, token: str, claims: Dict[str, Any], user: Any, version: int = None):
+        expires_at = time.time() + self.ttl
+        if claims.get("exp") is not None:
+            expires_at = min(expires_at, float(claims["exp"]))
+        with self._lock:
+            if version is not None and self._invalidated.get(user.id, 0) > version:
+                return
+            self._entries[token] = (claims, user, expires_at)
+            self._entries.move_to_end(token)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            self._version += 1
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+            self._invalidated[user_id] = self._version
+            self._invalidated.move_to_end(user_id)
+            self.invalidations += 1
+            while len(self._invalidated) > self.max_entries:
+                self._invalidated.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[1].id)
+        if tokens:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[1].id]
+
+
+_principal_cache: Optional[PrincipalCache] = None
+_principal_cache_lock = threading.Lock()
+
+
+def get_principal_cache() -> PrincipalCache:
+    """PrincipalCache dùng chung cho toàn tiến trình"""
+    global _principal_cache
+    if _principal_cache is None:
+        with _principal_cache_lock:
+            if _principal_cache is None:
+                _principal_cache = PrincipalCache()
+    return _principal_cache
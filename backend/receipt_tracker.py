@@ -0,0 +1,233 @@
+from typing import Optional, Dict, Any, List, Set
+from web3.exceptions import TransactionNotFound
+from blockchain_service import AsyncBlockchainService, get_async_blockchain_service
+from database import async_db_connection
+from balance_feed import get_balance_feed
+import asyncio
+import logging
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TRACKER_POLL_INTERVAL = float(os.getenv("TRACKER_POLL_INTERVAL", "1"))
+TRACKER_BATCH_SIZE = int(os.getenv("TRACKER_BATCH_SIZE", "100"))
+# Giao dịch pending quá lâu mà node không còn biết tới thì đánh dấu failed
+TRACKER_PENDING_TIMEOUT = float(os.getenv("TRACKER_PENDING_TIMEOUT", "600"))
+
+
+def _prefixed(tx_hash: str) -> str:
+    return tx_hash if tx_hash.startswith("0x") else "0x" + tx_hash
+
+
+class ReceiptTracker:
+    """Theo dõi giao dịch pending trong bảng transactions và cập nhật trạng thái khi có receipt"""
+
+    def __init__(self, async_blockchain: AsyncBlockchainService = None,
+                 poll_interval: float = TRACKER_POLL_INTERVAL, batch_size: int = TRACKER_BATCH_SIZE):
+        self.async_blockchain = async_blockchain or get_async_blockchain_service()
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._waiters: Dict[str, Set[asyncio.Queue]] = {}
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="receipt-tracker")
+        logger.info(f"Receipt tracker started (poll interval {self.poll_interval}s)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info("Receipt tracker stopped")
+
+    def track(self, tx_hash: str = None):
+        """Báo có giao dịch mới gửi để tracker kiểm tra ngay, không chờ hết chu kỳ"""
+        if self._loop is None or self._wake is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def subscribe(self, tx_hash: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        self._waiters.setdefault(tx_hash, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, tx_hash: str, queue: asyncio.Queue):
+        waiters = self._waiters.get(tx_hash)
+        if waiters:
+            waiters.discard(queue)
+            if not waiters:
+                del self._waiters[tx_hash]
+
+    async def wait_for(self, tx_hash: str, timeout: float = None) -> Optional[Dict[str, Any]]:
+        """Chờ tới khi giao dịch được xác nhận/thất bại; trả về None nếu hết thời gian"""
+        queue = self.subscribe(tx_hash)
+        try:
+            # Giao dịch có thể đã xong trước khi đăng ký
+            current = await get_transaction_status(tx_hash)
+            if current and current["status"] != "pending":
+                return current
+            self.track(tx_hash)
+            # Chỉ bắt timeout của việc chờ: TimeoutError khi pool hết kết nối phải được báo lên
+            try:
+                return await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        finally:
+            self.unsubscribe(tx_hash, queue)
+
+    async def _run(self):
+        while True:
+            try:
+                _, remaining = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Receipt tracker error: {str(e)}")
+                remaining = 0
+            # Còn nhiều hơn một batch thì chạy tiếp ngay
+            if remaining > self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def run_once(self) -> tuple:
+        """Kiểm tra receipt cho một batch giao dịch pending; trả về (số đã xử lý, số còn pending)"""
+        async with async_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM transactions WHERE status = 'pending' AND hash IS NOT NULL")
+            remaining = cursor.fetchone()[0]
+            if not remaining:
+                return 0, 0
+            cursor.execute(
+                """SELECT id, hash, from_wallet, to_wallet, COALESCE(pending_since, timestamp_epoch) AS pending_since
+                FROM transactions
+                WHERE status = 'pending' AND hash IS NOT NULL
+                ORDER BY id LIMIT ?""",
+                (self.batch_size,)
+            )
+            pending = [dict(row) for row in cursor.fetchall()]
+
+        # Không dùng batch: receipt chưa có sẽ làm hỏng cả batch
+        receipts = await asyncio.gather(
+            *[self._get_receipt(row["hash"]) for row in pending],
+            return_exceptions=True
+        )
+
+        updates = []
+        now = time.time()
+        for row, receipt in zip(pending, receipts):
+            if isinstance(receipt, Exception):
+                logger.warning(f"Could not fetch receipt for {row['hash']}: {str(receipt)}")
+                continue
+            if receipt is None:
+                if self._expired(row["pending_since"], now):
+                    updates.append((row, "failed", None))
+                continue
+            status = "completed" if receipt.status == 1 else "failed"
+            updates.append((row, status, receipt.blockNumber))
+
+        if not updates:
+            return 0, remaining
+
+        touched: List[str] = []
+        async with async_db_connection() as conn:
+            conn.executemany(
+                "UPDATE transactions SET status = ?, block_number = COALESCE(?, block_number) WHERE id = ?",
+                [(status, block_number, row["id"]) for row, status, block_number in updates]
+            )
+            conn.commit()
+
+            for row, _, _ in updates:
+                for address in (row["from_wallet"], row["to_wallet"]):
+                    if address not in touched:
+                        touched.append(address)
+
+        # Số dư hai bên chỉ thay đổi sau khi giao dịch vào block; BalanceFeed ghi DB và đẩy delta cho client
+        await get_balance_feed().refresh(touched)
+
+        for row, status, block_number in updates:
+            logger.info(f"Transaction {row['hash']} {status} (block {block_number})")
+            self._notify(row["hash"], {
+                "id": row["id"],
+                "hash": row["hash"],
+                "status": status,
+                "block_number": block_number
+            })
+
+        return len(updates), remaining - len(updates)
+
+    async def _get_receipt(self, tx_hash: str):
+        try:
+            return await self.async_blockchain.w3.eth.get_transaction_receipt(_prefixed(tx_hash))
+        except TransactionNotFound:
+            return None
+
+    def _expired(self, submitted: Optional[int], now: float) -> bool:
+        if submitted is None:
+            return False
+        return now - submitted > TRACKER_PENDING_TIMEOUT
+
+    def _notify(self, tx_hash: str, result: Dict[str, Any]):
+        for queue in list(self._waiters.get(tx_hash, ())):
+            if queue.empty():
+                queue.put_nowait(result)
+
+
+async def get_transaction_status(tx_hash: str) -> Optional[Dict[str, Any]]:
+    """Trạng thái giao dịch theo hash đọc từ DB (không gọi RPC)"""
+    tx_hash = tx_hash[2:] if tx_hash.startswith("0x") else tx_hash
+    async with async_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, hash, status, block_number FROM transactions WHERE hash = ?",
+            (tx_hash,)
+        )
+        row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+_receipt_tracker: Optional[ReceiptTracker] = None
+
+
+def get_receipt_tracker() -> ReceiptTracker:
+    """Tracker dùng chung cho toàn bộ app"""
+    global _receipt_tracker
+    if _receipt_tracker is None:
+        _receipt_tracker = ReceiptTracker()
+    return _receipt_tracker
+
+
+def start_receipt_tracker() -> ReceiptTracker:
+    tracker = get_receipt_tracker()
+    tracker.start()
+    return tracker
+
+
+async def stop_receipt_tracker():
+    global _receipt_tracker
+    if _receipt_tracker is not None:
+        await _receipt_tracker.stop()
+        _receipt_tracker = None
@@ -1,7 +1,9 @@
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from sqlite3 import Connection
 from Models.transaction import TransactionCreate, Transaction
-from blockchain_service import BlockchainService
+from blockchain_service import BlockchainService, get_blockchain_service
+from receipt_tracker import get_receipt_tracker
+from migrations import to_gwei
 import logging
 from datetime import datetime
 
@@ -10,53 +12,10 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class TransactionRepository:
-    def __init__(self, db: Connection):
+    def __init__(self, db: Connection, blockchain: BlockchainService = None):
         self.db = db
        
-        self.blockchain = BlockchainService()
-        self._ensure_table_exists()
-        
-    def _ensure_table_exists(self):
-       
-        try:
-            cursor = self.db.cursor()
-            
-           
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transactions'")
-            if not cursor.fetchone():
-                logger.info("Creating transactions table")
-                cursor.execute('''
-                CREATE TABLE transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    from_wallet TEXT NOT NULL,
-                    to_wallet TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    type TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    hash TEXT,
-                    block_number INTEGER
-                )
-                ''')
-                self.db.commit()
-                logger.info("Created transactions table")
-            else:
-             
-                cursor.execute("PRAGMA table_info(transactions)")
-                columns = [col[1] for col in cursor.fetchall()]
-                
-                if "hash" not in columns:
-                    logger.info("Adding hash column to transactions table")
-                    cursor.execute("ALTER TABLE transactions ADD COLUMN hash TEXT")
-                    self.db.commit()
-                
-                if "block_number" not in columns:
-                    logger.info("Adding block_number column to transactions table")
-                    cursor.execute("ALTER TABLE transactions ADD COLUMN block_number INTEGER")
-                    self.db.commit()
-        except Exception as e:
-            logger.error(f"Error ensuring tables exist: {str(e)}")
-            raise
+        self.blockchain = blockchain or get_blockchain_service()
 
     def create_transaction(self, transaction: TransactionCreate) -> Optional[Transaction]:
       
@@ -64,12 +23,13 @@ class TransactionRepository:
         try:
             cursor.execute(
                 """INSERT INTO transactions 
-                (from_wallet, to_wallet, amount, type, status) 
-                VALUES (?, ?, ?, ?, ?)""",
+                (from_wallet, to_wallet, amount, timestamp, type, status) 
+                VALUES (?, ?, ?, ?, ?, ?)""",
                 (
                     transaction.from_wallet,
                     transaction.to_wallet,
                     transaction.amount,
+                    datetime.now().isoformat(),
                     transaction.type,
                     transaction.status
                 )
@@ -92,25 +52,29 @@ class TransactionRepository:
             
           
             cursor = self.db.cursor()
+            # ChainIndexer có thể đã ghi giao dịch này từ block (hash là UNIQUE)
             cursor.execute(
                 """INSERT INTO transactions 
                 (from_wallet, to_wallet, amount, timestamp, type, status, hash, block_number) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(hash) DO UPDATE SET block_number = COALESCE(transactions.block_number, excluded.block_number)
+                RETURNING id""",
                 (
                     from_wallet,
                     to_wallet,
                     amount,
                     datetime.now().isoformat(),
                     "transfer",
-                    "completed",
+                    result.get("status"),
                     result.get("hash"),
                     result.get("block_number")
                 )
             )
+            transaction_id = cursor.fetchone()[0]
             self.db.commit()
             
-        
-            transaction_id = cursor.lastrowid
+            if result.get("status") == "pending":
+                get_receipt_tracker().track(result.get("hash"))
             
        
             result["id"] = transaction_id
@@ -143,64 +107,138 @@ class TransactionRepository:
             )
         return None
 
-    def get_transactions_by_address(self, address: str, limit: int = 50) -> List[Dict[str, Any]]:
-     
+    def get_transactions_by_address(self, address: str, limit: int = 50, **filters) -> List[Dict[str, Any]]:
+        """Lấy lịch sử giao dịch từ chỉ mục cục bộ (do ChainIndexer ghi), không gọi RPC"""
         try:
-   
-            blockchain_txs = self.blockchain.get_transaction_history(address, limit)
-            
-       
-            for tx in blockchain_txs:
-         
-                cursor = self.db.cursor()
-                cursor.execute("SELECT id FROM transactions WHERE hash = ?", (tx["hash"],))
-                
-                if not cursor.fetchone():
-             
-                    cursor.execute(
-                        """INSERT INTO transactions 
-                        (from_wallet, to_wallet, amount, timestamp, type, status, hash, block_number) 
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                        (
-                            tx["from_wallet"],
-                            tx["to_wallet"],
-                            tx["amount"],
-                            tx["timestamp"],
-                            tx["type"],
-                            tx["status"],
-                            tx["hash"],
-                            tx["block_number"]
-                        )
-                    )
-                    self.db.commit()
-            
-           
-            cursor = self.db.cursor()
-            cursor.execute(
-                """SELECT id, from_wallet, to_wallet, amount, timestamp, type, status, hash, block_number 
-                FROM transactions 
-                WHERE from_wallet = ? OR to_wallet = ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?""",
-                (address, address, limit)
-            )
-            
-            transactions = []
-            for tx_data in cursor.fetchall():
-                transaction = {
-                    "id": tx_data[0],
-                    "from_wallet": tx_data[1],
-                    "to_wallet": tx_data[2],
-                    "amount": tx_data[3],
-                    "timestamp": tx_data[4],
-                    "type": tx_data[5],
-                    "status": tx_data[6],
-                    "hash": tx_data[7] if len(tx_data) > 7 else None,
-                    "block_number": tx_data[8] if len(tx_data) > 8 else None
-                }
-                transactions.append(transaction)
-            
+            transactions, _ = self.get_transaction_page(address, limit=limit, **filters)
             return transactions
         except Exception as e:
             logger.error(f"Error getting transactions by address: {str(e)}")
-            return []
\ No newline at end of file
+            return []
+
+    def get_transaction_page(self, address: str, limit: int = 50, cursor: Optional[str] = None,
+                             direction: str = "all", status: Optional[str] = None,
+                             min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                             since: Optional[int] = None, until: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Một trang lịch sử, mới nhất trước; trả về (giao dịch, cursor trang sau hoặc None).
+
+        Thứ tự là (block_number, id) giảm dần, giao dịch chưa vào block (block_number NULL) đứng đầu.
+        Cursor là khóa của dòng cuối trang nên trang sâu tốn như trang đầu (không dùng OFFSET).
+        Lọc theo cột số nguyên: số tiền so theo gwei, since/until là epoch giây.
+        """
+        after = decode_cursor(cursor) if cursor else None
+
+        filters, params = [], []
+        if status:
+            filters.append("status = ?")
+            params.append(status)
+        if min_amount is not None:
+            filters.append("amount_gwei >= ?")
+            params.append(to_gwei(min_amount))
+        if max_amount is not None:
+            filters.append("amount_gwei <= ?")
+            params.append(to_gwei(max_amount))
+        if since is not None:
+            filters.append("timestamp_epoch >= ?")
+            params.append(since)
+        if until is not None:
+            filters.append("timestamp_epoch < ?")
+            params.append(until)
+
+        transactions = []
+        # Pha 1: giao dịch pending/chưa có block, theo id
+        if after is None or after[0] is None:
+            keyset = ["block_number IS NULL"]
+            keyset_params = []
+            if after is not None:
+                keyset.append("id < ?")
+                keyset_params.append(after[1])
+            transactions += self._history_query(address, direction, keyset + filters, keyset_params + params,
+                                                "id DESC", limit + 1)
+        # Pha 2: giao dịch đã vào block, theo (block_number, id)
+        if len(transactions) <= limit:
+            keyset = ["block_number IS NOT NULL"]
+            keyset_params = []
+            if after is not None and after[0] is not None:
+                keyset.append("(block_number, id) < (?, ?)")
+                keyset_params += [after[0], after[1]]
+            transactions += self._history_query(address, direction, keyset + filters, keyset_params + params,
+                                                "block_number DESC, id DESC", limit + 1 - len(transactions))
+
+        next_cursor = None
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            last = transactions[-1]
+            next_cursor = encode_cursor(last["block_number"], last["id"])
+        return transactions, next_cursor
+
+    def _history_query(self, address: str, direction: str, conditions: List[str], params: List[Any],
+                       order_by: str, limit: int) -> List[Dict[str, Any]]:
+        # Mỗi chiều đi theo chỉ mục (from_wallet|to_wallet, block_number) riêng rồi trộn lại;
+        # OR giữa hai cột sẽ buộc SQLite sắp xếp toàn bộ lịch sử của ví
+        where = "".join(f" AND {condition}" for condition in conditions)
+        branches, branch_params = [], []
+        if direction in ("all", "out"):
+            branches.append(f"SELECT * FROM (SELECT {HISTORY_COLUMNS} FROM transactions WHERE from_wallet = ?{where} ORDER BY {order_by} LIMIT ?)")
+            branch_params += [address, *params, limit]
+        if direction in ("all", "in"):
+            # Chuyển cho chính mình đã có ở nhánh "out"
+            self_transfer = " AND from_wallet != ?" if direction == "all" else ""
+            branches.append(f"SELECT * FROM (SELECT {HISTORY_COLUMNS} FROM transactions WHERE to_wallet = ?{self_transfer}{where} ORDER BY {order_by} LIMIT ?)")
+            branch_params += [address] + ([address] if self_transfer else []) + [*params, limit]
+
+        cursor = self.db.cursor()
+        cursor.execute(
+            f"{' UNION ALL '.join(branches)} ORDER BY {order_by} LIMIT ?",
+            (*branch_params, limit)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    def get_recent_transactions(self, addresses: List[str], limit: int = 20) -> List[Dict[str, Any]]:
+        """Các giao dịch mới nhất (theo timestamp_epoch) của nhiều ví trong một truy vấn.
+
+        Mỗi ví một nhánh đi theo chỉ mục (from_wallet|to_wallet, timestamp_epoch) và chỉ đọc `limit` dòng;
+        chuyển giữa các ví trong danh sách chỉ lấy ở nhánh gửi. Thêm cột direction: out, in hoặc internal.
+        """
+        if not addresses:
+            return []
+        addresses = list(dict.fromkeys(addresses))
+        placeholders = ", ".join("?" * len(addresses))
+        columns = f"{HISTORY_COLUMNS}, CASE WHEN to_wallet IN ({placeholders}) THEN 'internal' ELSE 'out' END AS direction"
+        order_by = "timestamp_epoch DESC, id DESC"
+
+        cursor = self.db.cursor()
+        if len(addresses) <= RECENT_BRANCH_MAX:
+            branches, params = [], []
+            for address in addresses:
+                branches.append(f"SELECT * FROM (SELECT {columns} FROM transactions WHERE from_wallet = ? ORDER BY {order_by} LIMIT ?)")
+                params += [*addresses, address, limit]
+                branches.append(f"SELECT * FROM (SELECT {HISTORY_COLUMNS}, 'in' AS direction FROM transactions WHERE to_wallet = ? AND from_wallet NOT IN ({placeholders}) ORDER BY {order_by} LIMIT ?)")
+                params += [address, *addresses, limit]
+            cursor.execute(f"{' UNION ALL '.join(branches)} ORDER BY {order_by} LIMIT ?", (*params, limit))
+        else:
+            # SQLite giới hạn số nhánh UNION; ví rất nhiều thì để SQLite sắp xếp
+            cursor.execute(
+                f"""SELECT * FROM (
+                    SELECT {columns} FROM transactions WHERE from_wallet IN ({placeholders})
+                    UNION ALL
+                    SELECT {HISTORY_COLUMNS}, 'in' FROM transactions WHERE to_wallet IN ({placeholders}) AND from_wallet NOT IN ({placeholders})
+                ) ORDER BY {order_by} LIMIT ?""",
+                (*addresses, *addresses, *addresses, *addresses, limit)
+            )
+        return [dict(row) for row in cursor.fetchall()]
+
+
+HISTORY_COLUMNS = "id, from_wallet, to_wallet, amount, timestamp, type, status, hash, block_number, amount_gwei, timestamp_epoch"
+# Số ví tối đa còn dùng mỗi ví hai nhánh UNION ALL (SQLite giới hạn 500 nhánh)
+RECENT_BRANCH_MAX = 100
+
+
+def encode_cursor(block_number: Optional[int], transaction_id: int) -> str:
+    return f"{'pending' if block_number is None else block_number}:{transaction_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[int], int]:
+    """'<block_number>:<id>' hoặc 'pending:<id>'; ValueError nếu sai định dạng"""
+    block, _, transaction_id = cursor.partition(":")
+    return (None if block == "pending" else int(block)), int(transaction_id)
@@ -1,72 +1,81 @@
 from typing import Optional, Dict
 from sqlite3 import Connection
 from Models.user import UserCreate, UserInDB, UserResponse
-from passlib.context import CryptContext
 from datetime import datetime
 import logging
-import bcrypt
+import asyncio
 import sqlite3
+from database import async_db_connection
+from password_hasher import PasswordHasherBusy, get_password_hasher
+from principal_cache import get_principal_cache
 
 # Cấu hình logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 class UserRepository:
 
     @staticmethod
-    def register_user(name: str, email: str, password: str, private_password: str = None, profile_image_path: str = None):
+    async def register_user(name: str, email: str, password: str, private_password: str = None, profile_image_path: str = None):
         try:
             logger.info(f"Attempting to register user: {email}")
             
-            conn = sqlite3.connect('wallet.db')
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-            hashed_private_password = bcrypt.hashpw(private_password.encode('utf-8'), bcrypt.gensalt()) if private_password else None
+            # bcrypt chạy trong pool riêng, hai hash được băm song song
+            hasher = get_password_hasher()
+            if private_password:
+                hashed_password, hashed_private_password = await asyncio.gather(
+                    hasher.hash(password), hasher.hash(private_password)
+                )
+            else:
+                hashed_password, hashed_private_password = await hasher.hash(password), None
             
-            try:
-                # Lỗ hổng SQL Injection - sử dụng f-string thay vì tham số hóa
-                cursor.execute(f"SELECT id FROM users WHERE email = '{email}'")
-                if cursor.fetchone():
-                    return False, "Email already registered"
-                
-                # Lỗ hổng SQL Injection - sử dụng f-string thay vì tham số hóa
-                query = f"""
-                    INSERT INTO users (name, email, password, private_password, profileImage, created_at)
-                    VALUES ('{name}', '{email}', '{hashed_password.decode()}', '{hashed_private_password.decode() if hashed_private_password else ""}', '{profile_image_path if profile_image_path else ""}', datetime('now'))
-                """
-                cursor.execute(query)
-                
-                conn.commit()
-                
-                # Lỗ hổng SQL Injection - sử dụng f-string thay vì tham số hóa
-                cursor.execute(f"""
-                    SELECT id, name, email, profileImage, created_at
-                    FROM users
-                    WHERE email = '{email}'
-                """)
-                user = cursor.fetchone()
-                
-                if user:
-                    user_data = dict(user)
-                    return True, user_data
-                return False, "Failed to retrieve user data"
-                    
-            except sqlite3.Error as e:
-                logger.error(f"Database error during registration: {str(e)}")
-                return False, str(e)
-            finally:
-                cursor.close()
-                conn.close()
+            async with async_db_connection() as conn:
+                return UserRepository._insert_registered_user(conn, name, email, hashed_password, hashed_private_password, profile_image_path)
                 
+        except PasswordHasherBusy:
+            raise
         except Exception as e:
             logger.error(f"Unexpected error during registration: {str(e)}")
             return False, str(e)
 
+    @staticmethod
+    def _insert_registered_user(conn: Connection, name: str, email: str, hashed_password: bytes, hashed_private_password: Optional[bytes], profile_image_path: Optional[str]):
+        cursor = conn.cursor()
+        try:
+            # Lỗ hổng SQL Injection - sử dụng f-string thay vì tham số hóa
+            cursor.execute(f"SELECT id FROM users WHERE email = '{email}'")
+            if cursor.fetchone():
+                return False, "Email already registered"
+            
+            # Lỗ hổng SQL Injection - sử dụng f-string thay vì tham số hóa
+            query = f"""
+                INSERT INTO users (name, email, password, private_password, profileImage, created_at)
+                VALUES ('{name}', '{email}', '{hashed_password.decode()}', '{hashed_private_password.decode() if hashed_private_password else ""}', '{profile_image_path if profile_image_path else ""}', datetime('now'))
+            """
+            cursor.execute(query)
+            
+            conn.commit()
+            
+            # Lỗ hổng SQL Injection - sử dụng f-string thay vì tham số hóa
+            cursor.execute(f"""
+                SELECT id, name, email, profileImage, created_at
+                FROM users
+                WHERE email = '{email}'
+            """)
+            user = cursor.fetchone()
+            
+            if user:
+                user_data = dict(user)
+                return True, user_data
+            return False, "Failed to retrieve user data"
+                
+        except sqlite3.Error as e:
+            logger.error(f"Database error during registration: {str(e)}")
+            return False, str(e)
+        finally:
+            cursor.close()
+
     @staticmethod
     def create_user(db: Connection, name: str, email: str, password: str, private_password: str = None, profile_image: str = None) -> Optional[Dict]:
         """Create a new user"""
@@ -83,8 +92,9 @@ class UserRepository:
                 return None
                 
             # Hash mật khẩu
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-            hashed_private_password = bcrypt.hashpw(private_password.encode('utf-8'), bcrypt.gensalt()) if private_password else None
+            hasher = get_password_hasher()
+            hashed_password = hasher.hash_sync(password)
+            hashed_private_password = hasher.hash_sync(private_password) if private_password else None
             
             safe_private_password = hashed_private_password.decode() if hashed_private_password else ""
             safe_profile_image = profile_image if profile_image else ""
@@ -150,7 +160,7 @@ class UserRepository:
         )
         user_data = cursor.fetchone()
         
-        if user_data and pwd_context.verify(password, user_data[3]):  
+        if user_data and await get_password_hasher().verify(password, user_data[3]):  
             return UserInDB(
                 id=user_data[0],
                 name=user_data[1],
@@ -188,14 +198,16 @@ class UserRepository:
         cursor = conn.cursor()
         try:
        
-            hashed_password = pwd_context.hash(user.password)
-            hashed_private_password = pwd_context.hash(user.private_password) if user.private_password else None
+            hasher = get_password_hasher()
+            hashed_password = hasher.hash_sync(user.password).decode('utf-8')
+            hashed_private_password = hasher.hash_sync(user.private_password).decode('utf-8') if user.private_password else None
             
             cursor.execute(
                 "UPDATE users SET name = ?, email = ?, password = ?, private_password = ?, profileImage = ? WHERE id = ?",
                 (user.name, user.email, hashed_password, hashed_private_password, user.profile_image, user_id)
             )
             conn.commit()
+            get_principal_cache().invalidate_user(user_id)
             
             return UserRepository.get_user_by_id(conn, user_id)
         except Exception as e:
@@ -210,6 +222,7 @@ class UserRepository:
         try:
             cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
             conn.commit()
+            get_principal_cache().invalidate_user(user_id)
             return True
         except Exception as e:
             print(f"Error deleting user: {e}")
@@ -1,4 +1,4 @@
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from sqlite3 import Connection
 from Models.wallet import Wallet
 from decimal import Decimal
@@ -12,107 +12,29 @@ import logging
 import time
 import threading
 from contextlib import contextmanager
-from blockchain_service import BlockchainService
+from database import async_db_connection
+from blockchain_service import BlockchainService, AsyncBlockchainService, get_blockchain_service, get_async_blockchain_service
+from receipt_tracker import get_receipt_tracker
+from treasury import TreasuryError, get_treasury
+from balance_cache import BalanceCache, get_balance_cache
 from eth_account.account import Account
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Số dư đã lưu được coi là còn mới trong khoảng này (giây) kể từ lần đối chiếu với node
+WALLET_BALANCE_MAX_AGE = float(os.getenv("WALLET_BALANCE_MAX_AGE", "30"))
+
+# Địa chỉ đang được làm mới ở nền, tránh nhiều request cùng làm mới một ví
+_refreshing_addresses = set()
+
 class WalletRepository:
-    def __init__(self, db: Connection):
+    def __init__(self, db: Connection, blockchain: BlockchainService = None, async_blockchain: AsyncBlockchainService = None):
         self.db = db
         
-        self.blockchain = BlockchainService()
-        self._ensure_table_exists()
-    
-    def _ensure_table_exists(self):
-        """Đảm bảo bảng wallets tồn tại với cấu trúc đúng"""
-        try:
-            cursor = self.db.cursor()
-            
-        
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='wallets'")
-            if not cursor.fetchone():
-                logger.info("Creating wallets table")
-                cursor.execute('''
-                CREATE TABLE wallets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    label TEXT NOT NULL,
-                    address TEXT NOT NULL,
-                    private_key TEXT NOT NULL,
-                    balance REAL DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-                ''')
-                self.db.commit()
-            
-      
-            cursor.execute("PRAGMA table_info(wallets)")
-            columns = cursor.fetchall()
-            column_names = [col[1] for col in columns]
-            
-            logger.info(f"Wallet table columns: {column_names}")
-            
-       
-            required_columns = ['id', 'user_id', 'label', 'address', 'private_key', 'balance', 'created_at']
-            missing_columns = [col for col in required_columns if col not in column_names]
-            
-            if missing_columns:
-                logger.warning(f"Missing columns in wallets table: {missing_columns}")
-        
-                for col in missing_columns:
-                    if col == 'balance':
-                        cursor.execute("ALTER TABLE wallets ADD COLUMN balance REAL DEFAULT 0")
-                    elif col == 'created_at':
-                        cursor.execute("ALTER TABLE wallets ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-                    elif col == 'label':
-                        cursor.execute("ALTER TABLE wallets ADD COLUMN label TEXT DEFAULT 'My Wallet'")
-                    elif col == 'private_key':
-                        cursor.execute("ALTER TABLE wallets ADD COLUMN private_key TEXT")
-                    elif col == 'address':
-                        cursor.execute("ALTER TABLE wallets ADD COLUMN address TEXT")
-                self.db.commit()
-                logger.info("Added missing columns to wallets table")
-            
-     
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='transactions'")
-            if not cursor.fetchone():
-                logger.info("Creating transactions table")
-                cursor.execute('''
-                CREATE TABLE transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    from_wallet TEXT NOT NULL,
-                    to_wallet TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    type TEXT NOT NULL,
-                    status TEXT NOT NULL,
-                    hash TEXT,
-                    block_number INTEGER
-                )
-                ''')
-                self.db.commit()
-                logger.info("Created transactions table")
-            else:
-                cursor.execute("PRAGMA table_info(transactions)")
-                columns = [col[1] for col in cursor.fetchall()]
-                
-                if "hash" not in columns:
-                    logger.info("Adding hash column to transactions table")
-                    cursor.execute("ALTER TABLE transactions ADD COLUMN hash TEXT")
-                    self.db.commit()
-                
-                if "block_number" not in columns:
-                    logger.info("Adding block_number column to transactions table")
-                    cursor.execute("ALTER TABLE transactions ADD COLUMN block_number INTEGER")
-                    self.db.commit()
-                
-        except Exception as e:
-            logger.error(f"Error ensuring wallet table: {str(e)}")
-            raise
-
+        self.blockchain = blockchain or get_blockchain_service()
+        self.async_blockchain = async_blockchain or get_async_blockchain_service()
+        self.balance_cache: BalanceCache = get_balance_cache()
 
     def create_wallet(self, wallet_data: Dict[str, Any]) -> int:
         try:
@@ -179,16 +101,8 @@ class WalletRepository:
             }
             
    
-            blockchain_balance = self.blockchain.get_balance(wallet["address"])
-            
-
-            if abs(float(blockchain_balance) - float(wallet["balance"])) > 0.0001:
-                cursor.execute(
-                    "UPDATE wallets SET balance = ? WHERE id = ?",
-                    (blockchain_balance, wallet_id)
-                )
-                self.db.commit()
-                wallet["balance"] = blockchain_balance
+            blockchain_balance = self._cached_balance(wallet["address"])
+            self._store_balance(wallet, blockchain_balance)
             
             logger.info(f"Found wallet: {wallet}")
             return wallet
@@ -196,12 +110,12 @@ class WalletRepository:
             logger.error(f"Error getting wallet by ID: {str(e)}")
             return None
     
-    def get_wallets_by_user_id(self, user_id: int) -> List[Dict[str, Any]]:
-     
+    def get_wallets_by_user_id(self, user_id: int, refresh: bool = True) -> List[Dict[str, Any]]:
+        """Danh sách ví với số dư đã lưu; refresh=True làm mới các ví đã quá stale_after trong một batch"""
         try:
             cursor = self.db.cursor()
             cursor.execute("""
-                SELECT id, user_id, label, address, private_key, balance, created_at
+                SELECT id, user_id, label, address, private_key, balance, created_at, balance_updated_at
                 FROM wallets
                 WHERE user_id = ?
                 ORDER BY created_at DESC
@@ -216,29 +130,69 @@ class WalletRepository:
                     "address": row[3],
                     "private_key": row[4],
                     "balance": float(row[5]),
-                    "created_at": row[6]
+                    "created_at": row[6],
+                    "stale_after": self._stale_after(row[7])
                 }
-                
-       
-                blockchain_balance = self.blockchain.get_balance(wallet["address"])
-                
-           
-                if abs(blockchain_balance - wallet["balance"]) > 0.0001:
-                    cursor.execute(
-                        "UPDATE wallets SET balance = ? WHERE id = ?",
-                        (blockchain_balance, wallet["id"])
-                    )
-                    self.db.commit()
-                    wallet["balance"] = blockchain_balance
-                
                 wallets.append(wallet)
             
+            if refresh:
+                stale = self.stale_wallets(wallets)
+                if stale:
+                    # Ví còn trong cache không cần hỏi node; các ví còn lại gộp vào một batch RPC
+                    balances = self._cached_balances([wallet["address"] for wallet in stale])
+                    self._write_balances(balances)
+                    self._apply_to_wallets(stale, balances)
+            
             return wallets
             
         except Exception as e:
             logger.error(f"Error getting wallets by user_id: {str(e)}")
             raise
     
+    async def refresh_wallets_async(self, wallets: List[Dict[str, Any]]) -> Dict[str, float]:
+        """Làm mới số dư cho các ví (một batch RPC, một executemany) và cập nhật luôn các dict"""
+        if not wallets:
+            return {}
+        addresses = [wallet["address"] for wallet in wallets]
+        balances, missing = self.balance_cache.get_many(addresses)
+        if missing:
+            version = self.balance_cache.version()
+            fetched = await self.async_blockchain.get_balances(missing)
+            self.balance_cache.set_many(fetched, version)
+            balances.update(fetched)
+        self._write_balances(balances)
+        self._apply_to_wallets(wallets, balances)
+        return balances
+    
+    @staticmethod
+    def stale_wallets(wallets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        now = datetime.now()
+        return [wallet for wallet in wallets if datetime.fromisoformat(wallet["stale_after"]) <= now]
+    
+    @staticmethod
+    def _stale_after(balance_updated_at: Optional[float]) -> str:
+        if balance_updated_at is None:
+            return datetime.fromtimestamp(0).isoformat()
+        return datetime.fromtimestamp(balance_updated_at + WALLET_BALANCE_MAX_AGE).isoformat()
+    
+    def _apply_to_wallets(self, wallets: List[Dict[str, Any]], balances: Dict[str, float]):
+        stale_after = self._stale_after(time.time())
+        for wallet in wallets:
+            if wallet["address"] in balances:
+                wallet["balance"] = float(balances[wallet["address"]])
+                wallet["stale_after"] = stale_after
+    
+    def _write_balances(self, balances: Dict[str, float]):
+        """Ghi số dư vừa đối chiếu với node trong một transaction"""
+        if not balances:
+            return
+        now = time.time()
+        self.db.executemany(
+            "UPDATE wallets SET balance = ?, balance_updated_at = ? WHERE address = ?",
+            [(balance, now, address) for address, balance in balances.items()]
+        )
+        self.db.commit()
+    
     def get_wallet_by_address(self, address: str) -> Optional[Dict[str, Any]]:
       
         try:
@@ -267,16 +221,27 @@ class WalletRepository:
             }
             
   
-            blockchain_balance = self.blockchain.get_balance(address)
+            blockchain_balance = self._cached_balance(address)
+            self._store_balance(wallet, blockchain_balance)
             
-
-            if abs(float(blockchain_balance) - float(wallet["balance"])) > 0.0001:
-                cursor.execute(
-                    "UPDATE wallets SET balance = ? WHERE id = ?",
-                    (blockchain_balance, wallet["id"])
-                )
-                self.db.commit()
-                wallet["balance"] = blockchain_balance
+            logger.info(f"Found wallet: {wallet}")
+            return wallet
+        except Exception as e:
+            logger.error(f"Error getting wallet by address: {str(e)}")
+            return None
+    
+    async def get_wallet_by_address_async(self, address: str) -> Optional[Dict[str, Any]]:
+        """Như get_wallet_by_address nhưng không chặn event loop khi gọi node"""
+        try:
+            logger.info(f"Getting wallet by address: {address}")
+            
+            wallet = self.get_wallet_by_address_no_blockchain(address)
+            if not wallet:
+                logger.warning(f"Wallet not found with address: {address}")
+                return None
+            
+            blockchain_balance = await self._cached_balance_async(address)
+            self._store_balance(wallet, blockchain_balance)
             
             logger.info(f"Found wallet: {wallet}")
             return wallet
@@ -284,6 +249,43 @@ class WalletRepository:
             logger.error(f"Error getting wallet by address: {str(e)}")
             return None
     
+    def _cached_balance(self, address: str) -> float:
+        """Số dư qua BalanceCache; chỉ gọi node khi hết hạn hoặc đã bị invalidate"""
+        balance = self.balance_cache.get(address)
+        if balance is None:
+            version = self.balance_cache.version()
+            balance = self.blockchain.get_balance(address)
+            self.balance_cache.set(address, balance, version)
+        return balance
+    
+    async def _cached_balance_async(self, address: str) -> float:
+        balance = self.balance_cache.get(address)
+        if balance is None:
+            version = self.balance_cache.version()
+            balance = await self.async_blockchain.get_balance(address)
+            self.balance_cache.set(address, balance, version)
+        return balance
+    
+    def _cached_balances(self, addresses: List[str]) -> Dict[str, float]:
+        balances, missing = self.balance_cache.get_many(addresses)
+        if missing:
+            version = self.balance_cache.version()
+            fetched = self.blockchain.get_balances(missing)
+            self.balance_cache.set_many(fetched, version)
+            balances.update(fetched)
+        return balances
+    
+    def _store_balance(self, wallet: Dict[str, Any], blockchain_balance: float):
+        """Ghi số dư mới vào DB nếu khác số dư đang lưu"""
+        if abs(float(blockchain_balance) - float(wallet["balance"])) > 0.0001:
+            cursor = self.db.cursor()
+            cursor.execute(
+                "UPDATE wallets SET balance = ?, balance_updated_at = ? WHERE id = ?",
+                (blockchain_balance, time.time(), wallet["id"])
+            )
+            self.db.commit()
+            wallet["balance"] = blockchain_balance
+    
     def get_wallet_by_address_no_blockchain(self, address: str) -> Optional[Dict[str, Any]]:
        
         try:
@@ -398,6 +400,8 @@ class WalletRepository:
                 error_msg = result.get("error", "Unknown error")
                 return False, error_msg
             
+            self.balance_cache.invalidate(from_address, to_address)
+            
   
             transaction = {
                 "from_wallet": from_address,
@@ -405,7 +409,7 @@ class WalletRepository:
                 "amount": amount,
                 "timestamp": datetime.now().isoformat(),
                 "type": "transfer",
-                "status": "success",
+                "status": "pending" if result.get("status") == "pending" else "success",
                 "hash": result.get("hash"),
                 "block_number": result.get("block_number")
             }
@@ -413,12 +417,84 @@ class WalletRepository:
 
             self.save_transaction_history(transaction)
 
-            self.update_wallet_balances([from_address, to_address])
+            # Giao dịch pending: ReceiptTracker cập nhật số dư khi có receipt
+            if transaction["status"] == "pending":
+                get_receipt_tracker().track(transaction["hash"])
+            else:
+                self.update_wallet_balances([from_address, to_address])
+            
+            return True, result
+        except Exception as e:
+            return False, str(e)
+
+    async def transfer_async(self, from_address: str, to_address: str, amount: float, private_key: str) -> tuple:
+        try:
+            logger.info(f"Transferring {amount} ETH from {from_address} to {to_address}")
+
+            private_key = private_key.strip()
+            if not private_key.startswith("0x"):
+                private_key = "0x" + private_key
+
+            blockchain_balance = await self.async_blockchain.get_balance(from_address)
+            if blockchain_balance < amount:
+                return False, f"Insufficient balance: {blockchain_balance} < {amount}"
+
+            result = await self.async_blockchain.send_transaction(
+                from_address,
+                to_address,
+                amount,
+                private_key
+            )
+            
+            if isinstance(result, dict) and result.get("status") == "failed":
+                error_msg = result.get("error", "Unknown error")
+                return False, error_msg
+            
+            self.balance_cache.invalidate(from_address, to_address)
+            
+            transaction = {
+                "from_wallet": from_address,
+                "to_wallet": to_address,
+                "amount": amount,
+                "timestamp": datetime.now().isoformat(),
+                "type": "transfer",
+                "status": "pending" if result.get("status") == "pending" else "success",
+                "hash": result.get("hash"),
+                "block_number": result.get("block_number")
+            }
+            
+            self.save_transaction_history(transaction)
+
+            if transaction["status"] == "pending":
+                get_receipt_tracker().track(transaction["hash"])
+            else:
+                await self.update_wallet_balances_async([from_address, to_address])
             
             return True, result
         except Exception as e:
             return False, str(e)
 
+    async def transfer_batch_async(self, from_address: str, transfers: List[Tuple[str, float]], private_key: str) -> tuple:
+        """Chuyển tiền từ một ví tới nhiều ví: gửi cả lô rồi ghi lịch sử bằng một câu INSERT"""
+        try:
+            logger.info(f"Batch transfer of {len(transfers)} payouts from {from_address}")
+            
+            result = await self.async_blockchain.send_batch(from_address, transfers, private_key.strip())
+            if result.get("status") == "failed":
+                return False, result.get("error", "Unknown error")
+            
+            submitted = result["transactions"]
+            self.balance_cache.invalidate(from_address, *[tx["to_wallet"] for tx in submitted])
+            self.save_transactions_history(submitted)
+            
+            tracker = get_receipt_tracker()
+            for tx in submitted:
+                tracker.track(tx["hash"])
+            
+            return True, result
+        except Exception as e:
+            return False, str(e)
+    
     def deposit_from_ganache(self, to_address: str, amount: float) -> tuple:
     
         try:
@@ -463,21 +539,26 @@ class WalletRepository:
                 "value": amount_wei,
                 "gas": gas_estimate,
                 "gasPrice": gas_price,
-                "nonce": w3.eth.get_transaction_count(sender_account),
-                "chainId": w3.eth.chain_id
+                "nonce": self.blockchain.reserve_nonce(sender_account),
+                "chainId": self.blockchain.chain_id
             }
 
             try:
-                tx_hash = w3.eth.send_transaction(tx)
+                try:
+                    tx_hash = w3.eth.send_transaction(tx)
+                except Exception as send_error:
+                    self.blockchain.nonces.handle_send_error(sender_account, tx["nonce"], send_error)
+                    raise
                 tx_hash_hex = tx_hash.hex()
                 
 
                 receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=60)
+                self.balance_cache.invalidate(sender_account, to_address)
                 
                 if receipt.status != 1:
                     return False, "Giao dịch thất bại"
 
-                new_balance = self.blockchain.get_balance(to_address)
+                new_balance = self._cached_balance(to_address)
                 cursor.execute("UPDATE wallets SET balance = ? WHERE address = ?", (new_balance, to_address))
                 self.db.commit()
                 
@@ -506,48 +587,119 @@ class WalletRepository:
         except Exception as e:
             return False, str(e)
 
-    def update_wallet_balances(self, addresses: List[str]) -> dict:
+    async def deposit_from_ganache_async(self, to_address: str, amount: float) -> tuple:
+        """Nạp tiền qua Treasury: giao dịch được ghi pending, ReceiptTracker xác nhận khi có receipt"""
+        try:
+            logger.info(f"Nạp {amount} ETH vào {to_address}")
+
+            if not self.async_blockchain.is_valid_eth_address(to_address):
+                return False, "Invalid Ethereum wallet address format"
+   
+            cursor = self.db.cursor()
+            cursor.execute("SELECT * FROM wallets WHERE address = ?", (to_address,))
+            if not cursor.fetchone():
+                return False, f"Ví đích không tồn tại trong hệ thống"
 
-        results = {}
-        
-        for address in addresses:
             try:
+                result = await get_treasury().deposit(to_address, amount)
+            except TreasuryError as e:
+                return False, str(e)
 
-                if not self.blockchain.is_valid_eth_address(address):
-                    logger.warning(f"Skipping invalid address: {address}")
-                    results[address] = {"success": False, "error": "Invalid address"}
-                    continue
-                    
+            self.balance_cache.invalidate(result["from"], to_address)
+            self.save_transaction_history(result)
+            get_receipt_tracker().track(result["hash"])
 
-                wallet = self.get_wallet_by_address_no_blockchain(address) if hasattr(self, 'get_wallet_by_address_no_blockchain') else None
-                
-                if not wallet:
-      
-                    logger.info(f"Wallet {address} not found in database, skipping balance update")
-                    results[address] = {"success": False, "error": "Wallet not in database"}
-                    continue
-                
+            return True, {
+                "hash": result["hash"],
+                "from": result["from"],
+                "amount": amount,
+                "status": result["status"]
+            }
+        except Exception as e:
+            return False, str(e)
 
-                balance = self.blockchain.get_balance(address)
-                
+    def update_wallet_balances(self, addresses: List[str]) -> dict:
 
-                if abs(float(balance) - float(wallet.get("balance", 0))) > 0.0001:
-  
-                    cursor = self.db.cursor()
-                    cursor.execute(
-                        "UPDATE wallets SET balance = ? WHERE address = ?",
-                        (balance, address)
-                    )
-                    self.db.commit()
-                    
+        results, known_addresses, stored_balances = self._prepare_balance_update(addresses)
+        if not known_addresses:
+            return results
+        
+        # Một batch RPC cho tất cả ví cần cập nhật (luôn đọc mới từ node rồi ghi lại vào cache)
+        version = self.balance_cache.version()
+        balances = self.blockchain.get_balances(known_addresses)
+        self.balance_cache.set_many(balances, version)
+        return self._apply_balance_update(results, known_addresses, stored_balances, balances)
+    
+    async def update_wallet_balances_async(self, addresses: List[str]) -> dict:
+
+        results, known_addresses, stored_balances = self._prepare_balance_update(addresses)
+        if not known_addresses:
+            return results
+        
+        version = self.balance_cache.version()
+        balances = await self.async_blockchain.get_balances(known_addresses)
+        self.balance_cache.set_many(balances, version)
+        return self._apply_balance_update(results, known_addresses, stored_balances, balances)
+    
+    def _prepare_balance_update(self, addresses: List[str]) -> tuple:
+        """Lọc địa chỉ hợp lệ có trong DB; trả về (results, known_addresses, stored_balances)"""
+        results = {}
+        
+        valid_addresses = []
+        for address in addresses:
+            if not self.blockchain.is_valid_eth_address(address):
+                logger.warning(f"Skipping invalid address: {address}")
+                results[address] = {"success": False, "error": "Invalid address"}
+            elif address not in valid_addresses:
+                valid_addresses.append(address)
+        
+        if not valid_addresses:
+            return results, [], {}
+        
+        try:
+            cursor = self.db.cursor()
+            placeholders = ", ".join("?" for _ in valid_addresses)
+            cursor.execute(
+                f"SELECT address, balance FROM wallets WHERE address IN ({placeholders})",
+                tuple(valid_addresses)
+            )
+            stored_balances = {row[0]: row[1] for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"Error loading wallet balances: {str(e)}")
+            for address in valid_addresses:
+                results[address] = {"success": False, "error": str(e)}
+            return results, [], {}
+        
+        known_addresses = []
+        for address in valid_addresses:
+            if address not in stored_balances:
+                logger.info(f"Wallet {address} not found in database, skipping balance update")
+                results[address] = {"success": False, "error": "Wallet not in database"}
+            else:
+                known_addresses.append(address)
+        
+        return results, known_addresses, stored_balances
+    
+    def _apply_balance_update(self, results: dict, known_addresses: List[str], stored_balances: Dict[str, float], balances: Dict[str, float]) -> dict:
+        try:
+            for address in known_addresses:
+                balance = balances[address]
+                updated = abs(float(balance) - float(stored_balances[address] or 0)) > 0.0001
+                if updated:
                     logger.info(f"Updated balance for wallet {address}: {balance}")
-                    results[address] = {"success": True, "balance": balance, "updated": True}
                 else:
                     logger.info(f"Balance unchanged for wallet {address}: {balance}")
-                    results[address] = {"success": True, "balance": balance, "updated": False}
-                    
-            except Exception as e:
-                logger.error(f"Error updating balance for wallet {address}: {str(e)}")
+                results[address] = {
+                    "success": True,
+                    "balance": balance,
+                    "previous": float(stored_balances[address] or 0),
+                    "updated": updated
+                }
+            
+            self._write_balances({address: balances[address] for address in known_addresses})
+        except Exception as e:
+            logger.error(f"Error updating wallet balances: {str(e)}")
+            for address in known_addresses:
                 results[address] = {"success": False, "error": str(e)}
         
         return results
@@ -576,27 +728,23 @@ class WalletRepository:
             
 
             cursor = self.db.cursor()
-            cursor.execute("PRAGMA table_info(transactions)")
-            columns = [col[1] for col in cursor.fetchall()]
-            
-            if "hash" in columns and "block_number" in columns:
-                cursor.execute(
-                    """INSERT INTO transactions 
-                    (from_wallet, to_wallet, amount, timestamp, type, status, hash, block_number) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (from_wallet, to_wallet, amount, timestamp, tx_type, status, tx_hash, block_number)
-                )
-            else:
-                cursor.execute(
-                    """INSERT INTO transactions 
-                    (from_wallet, to_wallet, amount, timestamp, type, status) 
-                    VALUES (?, ?, ?, ?, ?, ?)""",
-                    (from_wallet, to_wallet, amount, timestamp, tx_type, status)
-                )
-            
+
+            # ChainIndexer có thể đã ghi giao dịch này từ block (hash là UNIQUE); khi đó chỉ bổ sung
+            # loại/trạng thái và không hạ trạng thái đã xác nhận của indexer/tracker về pending
+            cursor.execute(
+                """INSERT INTO transactions 
+                (from_wallet, to_wallet, amount, timestamp, type, status, hash, block_number) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(hash) DO UPDATE SET
+                    type = excluded.type,
+                    status = CASE WHEN excluded.status = 'pending' THEN transactions.status ELSE excluded.status END,
+                    block_number = COALESCE(transactions.block_number, excluded.block_number)
+                RETURNING id""",
+                (from_wallet, to_wallet, amount, timestamp, tx_type, status, tx_hash, block_number)
+            )
+            transaction_id = cursor.fetchone()[0]
             self.db.commit()
 
-            transaction_id = cursor.lastrowid
             logger.info(f"Transaction created with ID: {transaction_id}")
             
             return transaction_id
@@ -604,6 +752,40 @@ class WalletRepository:
             logger.error(f"Error creating transaction: {str(e)}")
             return None
 
+    def save_transactions_history(self, transactions: List[Dict[str, Any]]) -> List[int]:
+        """Ghi nhiều giao dịch bằng một câu INSERT nhiều dòng (cùng quy tắc upsert với save_transaction_history)"""
+        if not transactions:
+            return []
+        try:
+            rows = [
+                (
+                    tx["from_wallet"], tx["to_wallet"], tx["amount"],
+                    tx.get("timestamp", datetime.now().isoformat()), tx.get("type", "transfer"),
+                    tx.get("status", "pending"), tx.get("hash"), tx.get("block_number")
+                )
+                for tx in transactions
+            ]
+            cursor = self.db.cursor()
+            cursor.execute(
+                f"""INSERT INTO transactions 
+                (from_wallet, to_wallet, amount, timestamp, type, status, hash, block_number) 
+                VALUES {", ".join(["(?, ?, ?, ?, ?, ?, ?, ?)"] * len(rows))}
+                ON CONFLICT(hash) DO UPDATE SET
+                    type = excluded.type,
+                    status = CASE WHEN excluded.status = 'pending' THEN transactions.status ELSE excluded.status END,
+                    block_number = COALESCE(transactions.block_number, excluded.block_number)
+                RETURNING id""",
+                [value for row in rows for value in row]
+            )
+            transaction_ids = [row[0] for row in cursor.fetchall()]
+            self.db.commit()
+            
+            logger.info(f"Saved {len(transaction_ids)} transactions in one insert")
+            return transaction_ids
+        except Exception as e:
+            logger.error(f"Error creating transactions: {str(e)}")
+            return []
+
     @staticmethod
     def get_transactions_by_wallet(conn: Connection, wallet_address: str) -> List[Dict]:
         """Lấy tất cả giao dịch liên quan đến một địa chỉ ví"""
@@ -655,3 +837,19 @@ class WalletRepository:
         except Exception as e:
             logger.error(f"Error deriving address from private key: {str(e)}")
             raise
+
+
+async def refresh_wallets_in_background(wallets: List[Dict[str, Any]]):
+    """Làm mới số dư các ví stale sau khi đã trả response (dùng với BackgroundTasks)"""
+    wallets = [wallet for wallet in wallets if wallet["address"] not in _refreshing_addresses]
+    if not wallets:
+        return
+    addresses = {wallet["address"] for wallet in wallets}
+    _refreshing_addresses.update(addresses)
+    try:
+        async with async_db_connection() as conn:
+            await WalletRepository(conn).refresh_wallets_async(wallets)
+    except Exception as e:
+        logger.error(f"Error refreshing wallet balances: {str(e)}")
+    finally:
+        _refreshing_addresses.difference_update(addresses)
@@ -0,0 +1,117 @@
+from typing import Optional, List, Dict, Any
+from sqlite3 import Connection
+from datetime import datetime, timezone
+from migrations import GWEI_PER_ETH, SECONDS_PER_DAY
+import logging
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _eth(gwei: Optional[int]) -> float:
+    return (gwei or 0) / GWEI_PER_ETH
+
+
+def _date(day: int) -> str:
+    return datetime.fromtimestamp(day * SECONDS_PER_DAY, tz=timezone.utc).date().isoformat()
+
+
+class WalletStatsRepository:
+    """Đọc thống kê từ wallet_daily_stats (trigger trên transactions giữ cho bảng luôn cập nhật)"""
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def get_wallet(self, wallet_id: int) -> Optional[Dict[str, Any]]:
+        """Chỉ thông tin cần để kiểm tra quyền; không gọi node"""
+        cursor = self.db.cursor()
+        cursor.execute("SELECT id, user_id, address, label, balance FROM wallets WHERE id = ?", (wallet_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def get_stats(self, address: str, days: int) -> Dict[str, Any]:
+        """Tổng toàn thời gian và tổng của `days` ngày gần nhất (tính cả hôm nay, theo UTC)"""
+        first_day = int(datetime.now(timezone.utc).timestamp()) // SECONDS_PER_DAY - days + 1
+        cursor = self.db.cursor()
+        cursor.execute(
+            """SELECT
+                SUM(inflow_gwei), SUM(outflow_gwei), SUM(tx_in), SUM(tx_out), MIN(day), MAX(day),
+                SUM(inflow_gwei) FILTER (WHERE day >= ?), SUM(outflow_gwei) FILTER (WHERE day >= ?),
+                SUM(tx_in) FILTER (WHERE day >= ?), SUM(tx_out) FILTER (WHERE day >= ?)
+            FROM wallet_daily_stats WHERE address = ?""",
+            (first_day, first_day, first_day, first_day, address)
+        )
+        row = cursor.fetchone()
+        cursor.execute(
+            "SELECT balance_gwei FROM wallet_daily_stats WHERE address = ? ORDER BY day DESC LIMIT 1",
+            (address,)
+        )
+        latest = cursor.fetchone()
+
+        return {
+            "address": address,
+            "total": {
+                "inflow": _eth(row[0]),
+                "outflow": _eth(row[1]),
+                "net": _eth((row[0] or 0) - (row[1] or 0)),
+                "tx_in": row[2] or 0,
+                "tx_out": row[3] or 0,
+            },
+            "period": {
+                "days": days,
+                "since": _date(first_day),
+                "inflow": _eth(row[6]),
+                "outflow": _eth(row[7]),
+                "net": _eth((row[6] or 0) - (row[7] or 0)),
+                "tx_in": row[8] or 0,
+                "tx_out": row[9] or 0,
+            },
+            "first_activity": _date(row[4]) if row[4] is not None else None,
+            "last_activity": _date(row[5]) if row[5] is not None else None,
+            "net_balance": _eth(latest[0]) if latest else 0.0,
+        }
+
+    def get_balance_history(self, address: str, since_day: Optional[int] = None,
+                            until_day: Optional[int] = None, limit: int = 365) -> List[Dict[str, Any]]:
+        """Mỗi ngày có giao dịch một điểm: số dư cuối ngày và dòng tiền trong ngày, cũ nhất trước.
+
+        Điểm đầu tiên là số dư mang sang từ trước since nếu có, để biểu đồ không bắt đầu từ 0.
+        """
+        conditions, params = ["address = ?"], [address]
+        if since_day is not None:
+            conditions.append("day >= ?")
+            params.append(since_day)
+        if until_day is not None:
+            conditions.append("day <= ?")
+            params.append(until_day)
+
+        cursor = self.db.cursor()
+        # Lấy `limit` ngày gần nhất trong khoảng rồi đảo lại cho đúng thứ tự thời gian
+        cursor.execute(
+            f"""SELECT day, inflow_gwei, outflow_gwei, tx_in, tx_out, balance_gwei FROM wallet_daily_stats
+            WHERE {' AND '.join(conditions)} ORDER BY day DESC LIMIT ?""",
+            (*params, limit)
+        )
+        rows = cursor.fetchall()[::-1]
+
+        history = []
+        if since_day is not None and len(rows) < limit and (not rows or rows[0][0] > since_day):
+            cursor.execute(
+                "SELECT balance_gwei FROM wallet_daily_stats WHERE address = ? AND day < ? ORDER BY day DESC LIMIT 1",
+                (address, since_day)
+            )
+            opening = cursor.fetchone()
+            if opening:
+                history.append({"date": _date(since_day), "balance": _eth(opening[0]),
+                                "inflow": 0.0, "outflow": 0.0, "tx_in": 0, "tx_out": 0})
+        for day, inflow, outflow, tx_in, tx_out, balance in rows:
+            history.append({
+                "date": _date(day),
+                "balance": _eth(balance),
+                "inflow": _eth(inflow),
+                "outflow": _eth(outflow),
+                "tx_in": tx_in,
+                "tx_out": tx_out,
+            })
+        return history
@@ -0,0 +1,437 @@
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable, Iterable
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import contextlib
+import threading
+import itertools
+import hashlib
+import inspect
+import asyncio
+import logging
+import aiohttp
+import requests
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Hệ số EWMA cho latency/tỉ lệ lỗi của từng endpoint
+RPC_EWMA_ALPHA = float(os.getenv("RPC_EWMA_ALPHA", "0.2"))
+# Lỗi liên tiếp thì tạm loại endpoint trong RPC_COOLDOWN giây, hết hạn thì cho thử lại
+RPC_FAILURE_THRESHOLD = int(os.getenv("RPC_FAILURE_THRESHOLD", "3"))
+RPC_COOLDOWN = float(os.getenv("RPC_COOLDOWN", "10"))
+# Gửi thêm bản sao của lệnh đọc sang node thứ hai khi node đầu chưa trả lời sau
+# ~ latency + 3 độ lệch của nó (kẹp trong [MIN, MAX]); RPC_HEDGE_DELAY > 0 thì dùng cố định
+RPC_HEDGE = os.getenv("RPC_HEDGE", "true").lower() == "true"
+RPC_HEDGE_DELAY = float(os.getenv("RPC_HEDGE_DELAY", "0"))
+RPC_HEDGE_MIN_DELAY = float(os.getenv("RPC_HEDGE_MIN_DELAY", "0.02"))
+RPC_HEDGE_MAX_DELAY = float(os.getenv("RPC_HEDGE_MAX_DELAY", "1"))
+# Mỗi lệnh đọc nạp RPC_HEDGE_BUDGET token, mỗi lần hedge tốn 1: hedge tối đa ~10% lệnh đọc,
+# để khi mọi node cùng chậm thì không nhân đôi tải
+RPC_HEDGE_BUDGET = float(os.getenv("RPC_HEDGE_BUDGET", "0.1"))
+RPC_HEDGE_WORKERS = int(os.getenv("RPC_HEDGE_WORKERS", "16"))
+# Cứ mỗi RPC_PROBE_EVERY lệnh đọc thì gửi một lệnh tới endpoint lâu chưa dùng nhất để cập nhật latency
+RPC_PROBE_EVERY = int(os.getenv("RPC_PROBE_EVERY", "50"))
+
+# Lệnh ghi: gửi tới node đã ghim cho địa chỉ gửi, không hedge
+RPC_WRITE_METHODS = {"eth_sendRawTransaction", "eth_sendTransaction"}
+# Filter là trạng thái riêng của từng node: luôn dùng node chính
+RPC_STICKY_METHODS = {
+    "eth_newFilter", "eth_newBlockFilter", "eth_newPendingTransactionFilter",
+    "eth_getFilterChanges", "eth_getFilterLogs", "eth_uninstallFilter",
+}
+
+_pinned_sender: ContextVar[Optional[str]] = ContextVar("rpc_pinned_sender", default=None)
+
+
+@contextmanager
+def pin_sender(address: Optional[str]):
+    """Mọi lệnh RPC trong khối đi tới cùng một node theo địa chỉ gửi (nonce pending, gửi giao dịch)"""
+    token = _pinned_sender.set(address.lower() if address else None)
+    try:
+        yield
+    finally:
+        _pinned_sender.reset(token)
+
+
+def pinned_to(argument: str):
+    """Decorator: ghim node theo tham số `argument` (địa chỉ gửi) của hàm, sync hoặc async"""
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def sender(args, kwargs):
+            return signature.bind(*args, **kwargs).arguments.get(argument)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with pin_sender(sender(args, kwargs)):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with pin_sender(sender(args, kwargs)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _is_connect_error(error: Exception) -> bool:
+    """Lỗi xảy ra trước khi request tới được node: gửi lại lệnh ghi sang node khác là an toàn"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError):
+        return "NewConnectionError" in repr(error) or "Connection refused" in str(error)
+    return isinstance(error, aiohttp.ClientConnectorError)
+
+
+class RpcEndpoint:
+    __slots__ = ("url", "latency", "deviation", "error_rate", "consecutive_failures", "down_until",
+                 "requests", "errors", "in_flight", "last_used")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latency = 0.0
+        self.deviation = 0.0
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.last_used = 0.0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.down_until
+
+    @property
+    def score(self) -> float:
+        # Latency kỳ vọng, phạt theo tỉ lệ lỗi và số request đang chờ ở node đó
+        return (self.latency or 0.001) * (1 + 10 * self.error_rate) * (1 + 0.1 * self.in_flight)
+
+
+class RpcRouter:
+    """Chọn node cho từng lệnh RPC trong nhiều BLOCKCHAIN_URLS.
+
+    Đọc: node có điểm (latency EWMA, tỉ lệ lỗi) tốt nhất trong các node khỏe, lỗi thì chuyển sang node kế tiếp,
+    chậm quá ngưỡng thì hedge sang node thứ hai và lấy kết quả về trước. Ghi (và mọi lệnh trong pin_sender)
+    đi tới một node cố định theo địa chỉ gửi (rendezvous hashing: mọi worker chọn giống nhau, node hỏng thì
+    chỉ các địa chỉ của node đó chuyển đi), để nonce pending và giao dịch gửi luôn cùng một mempool.
+    """
+
+    def __init__(self, urls: List[str], hedge: bool = RPC_HEDGE, hedge_workers: int = RPC_HEDGE_WORKERS):
+        if not urls:
+            raise ValueError("RpcRouter needs at least one RPC URL")
+        self.endpoints = [RpcEndpoint(url) for url in urls]
+        self.hedge = hedge and len(urls) > 1
+        self.hedge_workers = hedge_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._reads = itertools.count(1)
+        self._hedge_tokens = 0.0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.probes = 0
+
+    @property
+    def urls(self) -> List[str]:
+        return [endpoint.url for endpoint in self.endpoints]
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.hedge_workers, thread_name_prefix="rpc-hedge")
+            return self._executor
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    # --- chọn node ---
+
+    def _ranked(self) -> List[RpcEndpoint]:
+        now = time.monotonic()
+        healthy = sorted((e for e in self.endpoints if e.healthy(now)), key=lambda e: e.score)
+        # Tất cả đều đang bị loại: vẫn thử, node sắp hết cooldown trước
+        down = sorted((e for e in self.endpoints if not e.healthy(now)), key=lambda e: e.down_until)
+        return healthy + down
+
+    def _pinned(self, sender: str) -> List[RpcEndpoint]:
+        now = time.monotonic()
+
+        def weight(endpoint: RpcEndpoint) -> bytes:
+            return hashlib.blake2b(f"{sender}|{endpoint.url}".encode(), digest_size=8).digest()
+        ordered = sorted(self.endpoints, key=weight, reverse=True)
+        return [e for e in ordered if e.healthy(now)] + [e for e in ordered if not e.healthy(now)]
+
+    def plan(self, methods: Iterable[str]) -> Tuple[List[RpcEndpoint], bool, bool]:
+        """(thứ tự node sẽ thử, là lệnh ghi, được hedge)"""
+        methods = set(methods)
+        write = bool(methods & RPC_WRITE_METHODS)
+        sender = _pinned_sender.get()
+        if sender is not None:
+            return self._pinned(sender), write, False
+        if write:
+            return self._pinned(""), True, False
+        if methods & RPC_STICKY_METHODS:
+            now = time.monotonic()
+            return [e for e in self.endpoints if e.healthy(now)] or list(self.endpoints), False, False
+
+        candidates = self._ranked()
+        with self._lock:
+            count = next(self._reads)
+            self._hedge_tokens = min(10.0, self._hedge_tokens + RPC_HEDGE_BUDGET)
+            probe = RPC_PROBE_EVERY and count % RPC_PROBE_EVERY == 0 and len(candidates) > 1
+            if probe:
+                self.probes += 1
+        if probe:
+            # Node lâu chưa được chọn (vd. từng chậm) lên đầu một lần để đo lại
+            now = time.monotonic()
+            stale = min((e for e in candidates if e.healthy(now)), key=lambda e: e.last_used, default=None)
+            if stale is not None:
+                candidates = [stale] + [e for e in candidates if e is not stale]
+        return candidates, False, self.hedge
+
+    def hedge_delay(self, endpoint: RpcEndpoint) -> float:
+        if RPC_HEDGE_DELAY > 0:
+            return RPC_HEDGE_DELAY
+        return min(RPC_HEDGE_MAX_DELAY, max(RPC_HEDGE_MIN_DELAY, endpoint.latency + 3 * endpoint.deviation))
+
+    def _take_hedge_token(self) -> bool:
+        with self._lock:
+            if self._hedge_tokens < 1:
+                return False
+            self._hedge_tokens -= 1
+            self.hedged += 1
+            return True
+
+    # --- thống kê ---
+
+    def _begin(self, endpoint: RpcEndpoint) -> float:
+        with self._lock:
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+            endpoint.last_used = time.monotonic()
+        return time.perf_counter()
+
+    def _finish(self, endpoint: RpcEndpoint, started: float, ok: Optional[bool]):
+        """ok=None: request bị hủy (thua hedge); thời gian chờ vẫn là cận dưới của latency"""
+        elapsed = time.perf_counter() - started
+        alpha = RPC_EWMA_ALPHA
+        with self._lock:
+            endpoint.in_flight -= 1
+            if ok is None:
+                if elapsed > endpoint.latency:
+                    endpoint.latency += alpha * (elapsed - endpoint.latency)
+                return
+            if endpoint.latency == 0.0:
+                endpoint.latency = elapsed
+            else:
+                endpoint.deviation += alpha * (abs(elapsed - endpoint.latency) - endpoint.deviation)
+                endpoint.latency += alpha * (elapsed - endpoint.latency)
+            endpoint.error_rate += alpha * ((0.0 if ok else 1.0) - endpoint.error_rate)
+            if ok:
+                endpoint.consecutive_failures = 0
+                endpoint.down_until = 0.0
+                return
+            endpoint.errors += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= RPC_FAILURE_THRESHOLD:
+                if endpoint.healthy(time.monotonic()):
+                    logger.warning(f"RPC endpoint {endpoint.url} marked down after {endpoint.consecutive_failures} failures")
+                endpoint.down_until = time.monotonic() + RPC_COOLDOWN
+
+    # --- sync ---
+
+    def _attempt(self, endpoint: RpcEndpoint, post: Callable[[str], Any]) -> Any:
+        started = self._begin(endpoint)
+        try:
+            result = post(endpoint.url)
+        except Exception:
+            self._finish(endpoint, started, False)
+            raise
+        self._finish(endpoint, started, True)
+        return result
+
+    def call(self, methods: Iterable[str], post: Callable[[str], Any]) -> Any:
+        """Gửi request (post nhận URL của node) theo kế hoạch của plan()"""
+        candidates, write, hedge = self.plan(methods)
+        if hedge and len(candidates) > 1:
+            return self._call_hedged(candidates, post)
+        return self._call_failover(candidates, post, write)
+
+    def _call_failover(self, candidates: List[RpcEndpoint], post: Callable[[str], Any], write: bool) -> Any:
+        error = None
+        for index, endpoint in enumerate(candidates):
+            try:
+                return self._attempt(endpoint, post)
+            except Exception as e:
+                error = e
+                # Lệnh ghi chỉ chuyển node khi chắc chắn chưa gửi đi được
+                if write and not _is_connect_error(e):
+                    raise
+                if index + 1 < len(candidates):
+                    self.failovers += 1
+                    logger.warning(f"RPC request to {endpoint.url} failed, trying {candidates[index + 1].url}: {str(e)}")
+        raise error
+
+    def _call_hedged(self, candidates: List[RpcEndpoint], post: Callable[[str], Any]) -> Any:
+        primary, backup = candidates[0], candidates[1]
+        executor = self.executor
+        futures = {executor.submit(self._attempt, primary, post): primary}
+        done, _ = wait(futures, timeout=self.hedge_delay(primary))
+        if not done and self._take_hedge_token():
+            futures[executor.submit(self._attempt, backup, post)] = backup
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if futures[future] is backup:
+                        self.hedge_wins += 1
+                    return future.result()
+        # Các node đã thử đều lỗi: thử lần lượt các node còn lại
+        tried = set(futures.values())
+        remaining = [e for e in candidates if e not in tried]
+        if remaining:
+            self.failovers += 1
+            return self._call_failover(remaining, post, False)
+        raise next(iter(futures)).exception()
+
+    # --- async ---
+
+    async def _attempt_async(self, endpoint: RpcEndpoint, post: Callable[[str], Awaitable[Any]]) -> Any:
+        started = self._begin(endpoint)
+        try:
+            result = await post(endpoint.url)
+        except asyncio.CancelledError:
+            self._finish(endpoint, started, None)
+            raise
+        except Exception:
+            self._finish(endpoint, started, False)
+            raise
+        self._finish(endpoint, started, True)
+        return result
+
+    async def call_async(self, methods: Iterable[str], post: Callable[[str], Awaitable[Any]]) -> Any:
+        candidates, write, hedge = self.plan(methods)
+        if hedge and len(candidates) > 1:
+            return await self._call_hedged_async(candidates, post)
+        return await self._call_failover_async(candidates, post, write)
+
+    async def _call_failover_async(self, candidates: List[RpcEndpoint], post: Callable[[str], Awaitable[Any]],
+                                   write: bool) -> Any:
+        error = None
+        for index, endpoint in enumerate(candidates):
+            try:
+                return await self._attempt_async(endpoint, post)
+            except Exception as e:
+                error = e
+                if write and not _is_connect_error(e):
+                    raise
+                if index + 1 < len(candidates):
+                    self.failovers += 1
+                    logger.warning(f"RPC request to {endpoint.url} failed, trying {candidates[index + 1].url}: {str(e)}")
+        raise error
+
+    async def _call_hedged_async(self, candidates: List[RpcEndpoint], post: Callable[[str], Awaitable[Any]]) -> Any:
+        primary, backup = candidates[0], candidates[1]
+        tasks = {asyncio.ensure_future(self._attempt_async(primary, post)): primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary))
+            if not done and self._take_hedge_token():
+                tasks[asyncio.ensure_future(self._attempt_async(backup, post))] = backup
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] is backup:
+                            self.hedge_wins += 1
+                        return task.result()
+        finally:
+            # Bản còn lại không cần nữa (hoặc request bị hủy): hủy để giải phóng kết nối
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    with contextlib.suppress(asyncio.CancelledError, Exception):
+                        await task
+        tried = set(tasks.values())
+        remaining = [e for e in candidates if e not in tried]
+        if remaining:
+            self.failovers += 1
+            return await self._call_failover_async(remaining, post, False)
+        raise next(iter(tasks)).exception()
+
+    def metrics(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "probes": self.probes,
+                "healthy_endpoints": sum(1 for endpoint in self.endpoints if endpoint.healthy(now)),
+                "endpoints": {
+                    endpoint.url: {
+                        "healthy": endpoint.healthy(now),
+                        "latency_ms": endpoint.latency * 1000,
+                        "deviation_ms": endpoint.deviation * 1000,
+                        "error_rate": endpoint.error_rate,
+                        "requests": endpoint.requests,
+                        "errors": endpoint.errors,
+                        "in_flight": endpoint.in_flight,
+                    }
+                    for endpoint in self.endpoints
+                },
+            }
+
+
+_routers: Dict[Tuple[str, ...], RpcRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def get_rpc_router(urls: List[str]) -> RpcRouter:
+    """Router dùng chung theo danh sách URL: service sync và async cùng chia sẻ thống kê các node"""
+    key = tuple(urls)
+    with _routers_lock:
+        if key not in _routers:
+            _routers[key] = RpcRouter(list(urls))
+            logger.info(f"RPC router over {len(urls)} endpoints: {', '.join(urls)}")
+        return _routers[key]
+
+
+def get_rpc_routers() -> List[RpcRouter]:
+    with _routers_lock:
+        return list(_routers.values())
+
+
+def stop_rpc_routers():
+    with _routers_lock:
+        for router in _routers.values():
+            router.close()
+        _routers.clear()
+
+
+def rpc_router_metrics() -> Dict[str, Any]:
+    """Gộp metrics() của mọi router cho /metrics; rỗng khi chỉ cấu hình một node"""
+    merged: Dict[str, Any] = {"routers": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0, "probes": 0,
+                              "healthy_endpoints": 0, "endpoints": {}}
+    for router in get_rpc_routers():
+        values = router.metrics()
+        merged["routers"] += 1
+        for key in ("hedged", "hedge_wins", "failovers", "probes", "healthy_endpoints"):
+            merged[key] += values[key]
+        merged["endpoints"].update(values["endpoints"])
+    return merged
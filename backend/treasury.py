@@ -0,0 +1,276 @@
+from typing import Optional, Dict, Any, List
+from blockchain_service import AsyncBlockchainService, get_async_blockchain_service, transaction_result
+from rpc_router import pin_sender
+import asyncio
+import logging
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Danh sách tài khoản cấp tiền (phân tách bằng dấu phẩy); để trống thì dùng eth_accounts của node
+TREASURY_ACCOUNTS = [a.strip() for a in os.getenv("TREASURY_ACCOUNTS", "").split(",") if a.strip()]
+TREASURY_QUEUE_SIZE = int(os.getenv("TREASURY_QUEUE_SIZE", "1000"))
+# Số lệnh gửi đồng thời trên mỗi tài khoản cấp tiền
+TREASURY_SENDS_PER_ACCOUNT = int(os.getenv("TREASURY_SENDS_PER_ACCOUNT", "2"))
+# Chu kỳ đối chiếu số dư trong bộ nhớ với node (phí gas thực tế, tiền nạp vào tài khoản cấp tiền)
+TREASURY_REFRESH_INTERVAL = float(os.getenv("TREASURY_REFRESH_INTERVAL", "60"))
+TREASURY_GAS_LIMIT = 21000
+
+
+class TreasuryError(Exception):
+    """Không cấp được tiền (không có tài khoản đủ số dư, node lỗi)"""
+
+
+class TreasuryBusy(TreasuryError):
+    """Hàng đợi nạp tiền đã đầy"""
+
+
+class FundingAccount:
+    __slots__ = ("address", "balance_wei", "reserved_wei", "in_flight", "sent")
+
+    def __init__(self, address: str, balance_wei: int):
+        self.address = address
+        self.balance_wei = balance_wei
+        # Tiền + gas của các giao dịch đã nhận việc nhưng node chưa trừ vào số dư
+        self.reserved_wei = 0
+        self.in_flight = 0
+        self.sent = 0
+
+    @property
+    def available_wei(self) -> int:
+        return self.balance_wei - self.reserved_wei
+
+
+class Treasury:
+    """Cấp tiền nạp từ các tài khoản của node, chia đều theo vòng tròn.
+
+    Số dư của các tài khoản được giữ trong bộ nhớ (trừ dần khi gửi, đối chiếu lại với node theo chu kỳ)
+    nên mỗi lần nạp không phải quét số dư toàn bộ eth_accounts. Yêu cầu nạp đi qua một hàng đợi; số worker
+    tỉ lệ với số tài khoản. Nonce vẫn cấp qua NonceManager để nhiều worker uvicorn dùng chung tài khoản
+    không đụng nhau. Xác nhận giao dịch là việc của ReceiptTracker.
+    """
+
+    def __init__(self, async_blockchain: AsyncBlockchainService = None, accounts: List[str] = None,
+                 queue_size: int = TREASURY_QUEUE_SIZE, sends_per_account: int = TREASURY_SENDS_PER_ACCOUNT):
+        self.async_blockchain = async_blockchain or get_async_blockchain_service()
+        self.configured_accounts = accounts if accounts is not None else TREASURY_ACCOUNTS
+        self.queue_size = queue_size
+        self.sends_per_account = sends_per_account
+        self.accounts: List[FundingAccount] = []
+        self._next = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._load_lock: Optional[asyncio.Lock] = None
+        self._gas_price: Optional[int] = None
+        self._refreshed_at = 0.0
+        self.deposits = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._load_lock = asyncio.Lock()
+        self._refresh_task = asyncio.create_task(self._run_refresh(), name="treasury-refresh")
+        logger.info("Treasury started")
+
+    async def stop(self):
+        tasks = self._workers + ([self._refresh_task] if self._refresh_task else [])
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        # Yêu cầu còn trong hàng đợi: báo lỗi thay vì để route chờ mãi
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, _, future = self._queue.get_nowait()
+                if not future.done():
+                    future.set_exception(TreasuryError("Treasury is shutting down"))
+        self._workers = []
+        self._refresh_task = None
+        self._queue = None
+        logger.info("Treasury stopped")
+
+    async def deposit(self, to_address: str, amount: float) -> Dict[str, Any]:
+        """Xếp yêu cầu nạp vào hàng đợi; trả về kết quả giao dịch (pending) khi đã gửi lên node"""
+        if self._queue is None:
+            raise TreasuryError("Treasury is not running")
+        await self._ensure_accounts()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((to_address, amount, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise TreasuryBusy(f"Deposit queue is full ({self.queue_size} pending)")
+        return await future
+
+    async def _ensure_accounts(self):
+        if self.accounts:
+            return
+        async with self._load_lock:
+            if self.accounts:
+                return
+            addresses = self.configured_accounts or await self.async_blockchain.w3.eth.accounts
+            if not addresses:
+                raise TreasuryError("No funding accounts available on the node")
+            await self._refresh(addresses)
+            self._workers = [
+                asyncio.create_task(self._run_worker(), name=f"treasury-worker-{index}")
+                for index in range(len(self.accounts) * self.sends_per_account)
+            ]
+            logger.info(f"Treasury loaded {len(self.accounts)} funding accounts, {len(self._workers)} workers")
+
+    async def _refresh(self, addresses: List[str] = None):
+        """Đọc lại gas price và số dư của các tài khoản trong một batch RPC"""
+        addresses = addresses or [account.address for account in self.accounts]
+        results = await self.async_blockchain.rpc_batch(
+            [lambda eth: eth.gas_price] + [lambda eth, a=address: eth.get_balance(a) for address in addresses]
+        )
+        self._gas_price = results[0]
+        balances = dict(zip(addresses, results[1:]))
+        known = {account.address: account for account in self.accounts}
+        for address, balance_wei in balances.items():
+            if address in known:
+                known[address].balance_wei = balance_wei
+            else:
+                self.accounts.append(FundingAccount(address, balance_wei))
+        self._refreshed_at = time.monotonic()
+
+    async def _run_refresh(self):
+        while True:
+            await asyncio.sleep(TREASURY_REFRESH_INTERVAL)
+            if not self.accounts:
+                continue
+            # Chỉ đối chiếu khi không có giao dịch nào đang bay, để không đếm trùng phần đã giữ chỗ
+            if any(account.in_flight for account in self.accounts):
+                continue
+            try:
+                await self._refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Treasury refresh failed: {str(e)}")
+
+    def _pick_account(self, needed_wei: int) -> Optional[FundingAccount]:
+        """Vòng tròn bắt đầu từ tài khoản kế tiếp; bỏ qua tài khoản không đủ số dư khả dụng"""
+        for offset in range(len(self.accounts)):
+            account = self.accounts[(self._next + offset) % len(self.accounts)]
+            if account.available_wei >= needed_wei:
+                self._next = (self._next + offset + 1) % len(self.accounts)
+                return account
+        return None
+
+    async def _run_worker(self):
+        while True:
+            to_address, amount, future = await self._queue.get()
+            try:
+                if future.done():
+                    continue
+                result = await self._send(to_address, amount)
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.set_exception(TreasuryError("Treasury is shutting down"))
+                raise
+            except Exception as e:
+                self.failures += 1
+                if not future.done():
+                    future.set_exception(e if isinstance(e, TreasuryError) else TreasuryError(str(e)))
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, to_address: str, amount: float) -> Dict[str, Any]:
+        w3 = self.async_blockchain.w3
+        amount_wei = w3.to_wei(amount, "ether")
+        needed_wei = amount_wei + TREASURY_GAS_LIMIT * self._gas_price
+
+        account = self._pick_account(needed_wei)
+        if account is None:
+            raise TreasuryError("No funding account has enough balance")
+        account.reserved_wei += needed_wei
+        account.in_flight += 1
+        try:
+            # Nonce pending và lệnh gửi đi tới cùng một node
+            with pin_sender(account.address):
+                tx_hash = await self._submit(w3, account, to_address, amount_wei)
+            # Node đã nhận: số dư thật sẽ giảm, chuyển phần giữ chỗ thành số dư đã trừ
+            account.balance_wei -= needed_wei
+            account.sent += 1
+            self.deposits += 1
+        finally:
+            account.reserved_wei -= needed_wei
+            account.in_flight -= 1
+
+        result = transaction_result(tx_hash, account.address, to_address, amount)
+        result["type"] = "deposit"
+        result["from"] = account.address
+        return result
+
+    async def _submit(self, w3, account: FundingAccount, to_address: str, amount_wei: int):
+        """Xin nonce rồi để node ký và gửi; lệch nonce thì đồng bộ lại và thử thêm một lần"""
+        for attempt in range(2):
+            nonce = await self.async_blockchain.reserve_nonce(account.address)
+            tx = {
+                "from": account.address,
+                "to": to_address,
+                "value": amount_wei,
+                "gas": TREASURY_GAS_LIMIT,
+                "gasPrice": self._gas_price,
+                "nonce": nonce,
+                "chainId": await self.async_blockchain.get_chain_id()
+            }
+            try:
+                tx_hash = await w3.eth.send_transaction(tx)
+                break
+            except Exception as e:
+                retry = await self.async_blockchain.nonces.handle_send_error_async(account.address, nonce, e)
+                if not (retry and attempt == 0):
+                    raise TreasuryError(f"Transaction error: {str(e)}")
+                logger.warning(f"Nonce {nonce} rejected for funding account {account.address}, resyncing")
+        return tx_hash
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "accounts": len(self.accounts),
+            "workers": len(self._workers),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": sum(account.in_flight for account in self.accounts),
+            "deposits": self.deposits,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "available_eth": sum(account.available_wei for account in self.accounts) / 10**18,
+            "refreshed_seconds_ago": time.monotonic() - self._refreshed_at if self._refreshed_at else None,
+        }
+
+
+_treasury: Optional[Treasury] = None
+
+
+def get_treasury() -> Treasury:
+    """Treasury dùng chung cho toàn app"""
+    global _treasury
+    if _treasury is None:
+        _treasury = Treasury()
+    return _treasury
+
+
+def start_treasury() -> Treasury:
+    treasury = get_treasury()
+    treasury.start()
+    return treasury
+
+
+async def stop_treasury():
+    global _treasury
+    if _treasury is not None:
+        await _treasury.stop()
+        _treasury = None
@@ -0,0 +1,109 @@
+from typing import Optional, Dict, List, Tuple, Any
+from concurrent.futures import ProcessPoolExecutor
+from eth_account import Account
+import multiprocessing
+import threading
+import asyncio
+import logging
+import time
+import os
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TX_SIGNING_WORKERS = int(os.getenv("TX_SIGNING_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Lô nhỏ hơn ngưỡng này ký ngay trong tiến trình: chi phí gửi qua process pool lớn hơn phần tiết kiệm được
+TX_SIGNING_INLINE_MAX = int(os.getenv("TX_SIGNING_INLINE_MAX", "8"))
+
+
+def sign_transactions(private_key: str, transactions: List[Dict[str, Any]]) -> List[Tuple[bytes, str]]:
+    """Ký các giao dịch; trả về (raw transaction, hash) theo đúng thứ tự. Chạy được trong process con."""
+    signed = []
+    for tx in transactions:
+        result = Account.sign_transaction(tx, private_key)
+        signed.append((bytes(result.raw_transaction), bytes(result.hash).hex()))
+    return signed
+
+
+class TransactionSigner:
+    """Ký lô giao dịch song song trong process pool (ECDSA thuần Python giữ GIL nên thread không giúp được)"""
+
+    def __init__(self, workers: int = TX_SIGNING_WORKERS, inline_max: int = TX_SIGNING_INLINE_MAX):
+        self.workers = workers
+        self.inline_max = inline_max
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.signed = 0
+        self.batches = 0
+        self.inline_batches = 0
+        self._sign_total = 0.0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: không fork tiến trình đang có thread của uvicorn/sqlite/aiohttp
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    async def sign(self, private_key: str, transactions: List[Dict[str, Any]]) -> List[Tuple[bytes, str]]:
+        started = time.monotonic()
+        if len(transactions) <= self.inline_max or self.workers <= 1:
+            signed = await asyncio.to_thread(sign_transactions, private_key, transactions)
+            inline = True
+        else:
+            # Chia đều cho các worker, giữ thứ tự nonce khi ghép lại
+            size = -(-len(transactions) // self.workers)
+            chunks = [transactions[i:i + size] for i in range(0, len(transactions), size)]
+            loop = asyncio.get_running_loop()
+            results = await asyncio.gather(*[
+                loop.run_in_executor(self.executor, sign_transactions, private_key, chunk) for chunk in chunks
+            ])
+            signed = [item for chunk in results for item in chunk]
+            inline = False
+        with self._lock:
+            self.signed += len(signed)
+            self.batches += 1
+            self.inline_batches += inline
+            self._sign_total += time.monotonic() - started
+        return signed
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "signed": self.signed,
+                "batches": self.batches,
+                "inline_batches": self.inline_batches,
+                "avg_batch_ms": self._sign_total / self.batches * 1000 if self.batches else 0.0,
+            }
+
+
+_signer: Optional[TransactionSigner] = None
+_signer_lock = threading.Lock()
+
+
+def get_transaction_signer() -> TransactionSigner:
+    """TransactionSigner dùng chung cho toàn tiến trình"""
+    global _signer
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                _signer = TransactionSigner()
+    return _signer
+
+
+def stop_transaction_signer():
+    global _signer
+    if _signer is not None:
+        _signer.shutdown()
+        _signer = None
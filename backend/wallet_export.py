@@ -0,0 +1,165 @@
+from typing import Optional, Dict, Any, Iterator, List, Tuple, Callable
+from database import open_connection
+import json
+import csv
+import io
+import logging
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Số dòng đọc từ cursor mỗi lần (cũng là kích thước row group của Parquet/record batch của Arrow)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+EXPORT_COLUMNS = [
+    "wallet_address", "wallet_label", "id", "hash", "block_number", "timestamp",
+    "direction", "from_wallet", "to_wallet", "amount", "type", "status"
+]
+
+
+def _iter_batches(address: str, label: str, batch_size: int) -> Iterator[List[Tuple]]:
+    """Đọc lịch sử giao dịch của ví theo từng batch bằng cursor phía server.
+
+    Dùng kết nối riêng thay vì pool: một bản xuất dài không giữ chỗ của các request khác.
+    """
+    conn = open_connection()
+    try:
+        cursor = conn.cursor()
+        # Hai nhánh đi theo hai chỉ mục (from_wallet|to_wallet, block_number); chuyển cho chính mình chỉ lấy một lần
+        cursor.execute(
+            """SELECT id, hash, block_number, timestamp, 'out', from_wallet, to_wallet, amount, type, status
+            FROM transactions WHERE from_wallet = ?
+            UNION ALL
+            SELECT id, hash, block_number, timestamp, 'in', from_wallet, to_wallet, amount, type, status
+            FROM transactions WHERE to_wallet = ? AND from_wallet != ?""",
+            (address, address, address)
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [(address, label, *row) for row in rows]
+    finally:
+        conn.close()
+
+
+class _ChunkSink(io.RawIOBase):
+    """File-like cho pyarrow: gom bytes đã ghi để generator trả ra rồi xóa"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _stream_csv(batches: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _stream_ndjson(batches: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    for batch in batches:
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in batch).encode("utf-8")
+
+
+def _arrow_schema():
+    return pa.schema([
+        ("wallet_address", pa.string()),
+        ("wallet_label", pa.string()),
+        ("id", pa.int64()),
+        ("hash", pa.string()),
+        ("block_number", pa.int64()),
+        ("timestamp", pa.string()),
+        ("direction", pa.string()),
+        ("from_wallet", pa.string()),
+        ("to_wallet", pa.string()),
+        ("amount", pa.float64()),
+        ("type", pa.string()),
+        ("status", pa.string()),
+    ])
+
+
+def _record_batch(schema, batch: List[Tuple]):
+    columns = list(zip(*batch))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+def _stream_columnar(batches: Iterator[List[Tuple]], open_writer: Callable) -> Iterator[bytes]:
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    writer = open_writer(sink, schema)
+    try:
+        for batch in batches:
+            writer.write_batch(_record_batch(schema, batch))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def _stream_parquet(batches: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    # Mỗi batch là một row group; footer được ghi khi đóng writer
+    return _stream_columnar(batches, lambda sink, schema: pq.ParquetWriter(sink, schema))
+
+
+def _stream_arrow(batches: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    return _stream_columnar(batches, lambda sink, schema: pa_ipc.new_stream(sink, schema))
+
+
+# format -> (media type, phần mở rộng, writer, cần pyarrow)
+EXPORT_FORMATS: Dict[str, Tuple[str, str, Callable, bool]] = {
+    "csv": ("text/csv", "csv", _stream_csv, False),
+    "ndjson": ("application/x-ndjson", "ndjson", _stream_ndjson, False),
+    "parquet": ("application/vnd.apache.parquet", "parquet", _stream_parquet, True),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows", _stream_arrow, True),
+}
+# Tên cũ mà form export của frontend từng dùng
+EXPORT_FORMATS["json"] = EXPORT_FORMATS["ndjson"]
+
+
+def available_formats() -> List[str]:
+    return [name for name, spec in EXPORT_FORMATS.items() if pa is not None or not spec[3]]
+
+
+def export_wallet(wallet: Dict[str, Any], export_format: str,
+                  batch_size: int = EXPORT_BATCH_SIZE) -> Optional[Tuple[Iterator[bytes], str, str]]:
+    """Trả về (generator bytes, media type, tên file) hoặc None nếu định dạng không hỗ trợ"""
+    if export_format not in available_formats():
+        return None
+    media_type, extension, write, _ = EXPORT_FORMATS[export_format]
+    filename = f"wallet_{wallet['address']}.{extension}"
+    return write(_iter_batches(wallet["address"], wallet["label"], batch_size)), media_type, filename
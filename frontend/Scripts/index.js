@@ -114,8 +114,11 @@ document.addEventListener('DOMContentLoaded', async () => {
     })();
     
     try {
-        // Load data in parallel
-        await Promise.all([loadWallets(), loadTransactions()]);
+        // User, ví và giao dịch gần nhất trong một request
+        await loadDashboard();
+        
+        // Nhận thay đổi số dư từ server thay vì tải lại danh sách ví
+        subscribeWalletUpdates();
         
         // Update UI
         updateUserInfo();
@@ -218,6 +221,59 @@ function setupTabListeners() {
     });
 }
 
+// Tải toàn bộ dữ liệu trang chính (user, ví, giao dịch gần nhất) qua /api/dashboard
+function loadDashboard() {
+    const accessToken = localStorage.getItem('access_token') || localStorage.getItem('token');
+    if (!accessToken) {
+        return Promise.reject(new Error('Thiếu thông tin người dùng'));
+    }
+
+    const walletList = document.getElementById('walletList');
+    if (walletList) {
+        walletList.innerHTML = '<tr><td colspan="5" class="text-center">Đang tải danh sách ví...</td></tr>';
+    }
+
+    return fetch(`${baseUrl}/api/dashboard`, {
+        method: 'GET',
+        headers: {
+            'Authorization': `Bearer ${accessToken}`,
+            'Accept': 'application/json'
+        },
+        mode: 'cors'
+    })
+    .then(response => {
+        if (response.status === 401) {
+            localStorage.removeItem('access_token');
+            localStorage.removeItem('token');
+            localStorage.removeItem('user_info');
+            localStorage.removeItem('user');
+            window.location.href = 'login.html';
+            return null;
+        }
+        if (!response.ok) {
+            throw new Error(`Lỗi kết nối: ${response.status} ${response.statusText}`);
+        }
+        return response.json();
+    })
+    .then(data => {
+        if (!data) return null;
+        if (data.status !== 'success') {
+            throw new Error(data.message || 'Không thể tải dữ liệu');
+        }
+
+        // Cập nhật thông tin user đã lưu (tên, ảnh có thể đã đổi ở thiết bị khác)
+        const userInfo = JSON.parse(localStorage.getItem('user_info') || '{}');
+        localStorage.setItem('user_info', JSON.stringify({ ...userInfo, ...data.user }));
+
+        cachedWallets = { status: data.status, wallets: data.wallets };
+        cachedTransactions = data.transactions;
+
+        renderWallets(cachedWallets);
+        renderTransactions(cachedTransactions);
+        return data;
+    });
+}
+
 // Tải danh sách ví - với bộ nhớ đệm
 let cachedWallets = null;
 function loadWallets() {
@@ -646,8 +702,9 @@ function renderTransactions(transactions) {
         
         // Ngày
         const dateTd = document.createElement('td');
-        dateTd.textContent = tx.created_at ? 
-            new Date(tx.created_at).toLocaleDateString() : 
+        const txDate = tx.created_at || tx.timestamp;
+        dateTd.textContent = txDate ? 
+            new Date(txDate).toLocaleDateString() : 
             'N/A';
         
         // Từ
@@ -1187,7 +1244,12 @@ document.addEventListener('DOMContentLoaded', function() {
                 
                 if (result.status === 'success') {
                     // Thông báo thành công
-                    alert(`Transfer completed successfully!\nTransaction hash: ${result.transaction_hash}`);
+                    if (result.transaction_status === 'pending') {
+                        alert(`Transfer submitted, waiting for confirmation.\nTransaction hash: ${result.transaction_hash}`);
+                        watchTransaction(result.transaction_hash);
+                    } else {
+                        alert(`Transfer completed successfully!\nTransaction hash: ${result.transaction_hash}`);
+                    }
                     
                     // Đóng modal
                     const modal = document.getElementById('transferModal');
@@ -1331,22 +1393,35 @@ document.getElementById('exportForm')?.addEventListener('submit', async function
     const token = localStorage.getItem('access_token');
     
     try {
-        const response = await fetch(`${baseUrl}/api/wallets/export?wallet_address=${walletAddress}&format=${format}`, {
+        const response = await fetch(`${baseUrl}/api/wallets/export?wallet_address=${encodeURIComponent(walletAddress)}&format=${encodeURIComponent(format)}`, {
             method: 'GET',
             headers: {
                 'Authorization': `Bearer ${token}`
             }
         });
         
-        const result = await response.json();
-        console.log('Export result:', result);
-        
-        if (result.status === 'success') {
-            alert(`Data exported successfully to ${result.file}`);
-            bootstrap.Modal.getInstance(document.getElementById('exportModal')).hide();
-        } else {
-            alert('Export failed: ' + result.message);
+        if (!response.ok) {
+            const result = await response.json().catch(() => ({}));
+            alert('Export failed: ' + (result.detail || response.statusText));
+            return;
         }
+        
+        // Server trả về file dạng stream; tên file lấy từ Content-Disposition
+        const disposition = response.headers.get('Content-Disposition') || '';
+        const match = disposition.match(/filename="?([^"]+)"?/);
+        const filename = match ? match[1] : `wallet_${walletAddress}.${format}`;
+        
+        const blob = await response.blob();
+        const url = URL.createObjectURL(blob);
+        const link = document.createElement('a');
+        link.href = url;
+        link.download = filename;
+        document.body.appendChild(link);
+        link.click();
+        link.remove();
+        URL.revokeObjectURL(url);
+        
+        bootstrap.Modal.getInstance(document.getElementById('exportModal')).hide();
     } catch (error) {
         console.error('Error:', error);
         alert('Error: ' + error.message);
@@ -1731,11 +1806,7 @@ function initializePage() {
         }
     }
     
-    // Tải danh sách ví
-    loadWallets().then(() => {
-        // Cập nhật các dropdown
-        updateWalletDropdowns();
-    });
+    // Ví và giao dịch ban đầu do loadDashboard() tải (handler DOMContentLoaded phía trên)
     
     // Thiết lập sự kiện cho nút đăng xuất
     const logoutBtn = document.getElementById('logoutBtn');
@@ -1779,3 +1850,48 @@ function getUserInfo() {
 function getAccessToken() {
     return localStorage.getItem('access_token');
 }
+
+// Chờ server đẩy trạng thái cuối cùng của giao dịch rồi làm mới lịch sử giao dịch (số dư ví đến qua subscribeWalletUpdates)
+function watchTransaction(txHash) {
+    const socket = new WebSocket(`${baseUrl.replace(/^http/, 'ws')}/api/transactions/ws/${txHash}`);
+    socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.status !== 'success' || data.transaction.status === 'pending') return;
+        if (data.transaction.status === 'failed') {
+            alert(`Transaction failed: ${txHash}`);
+        }
+        loadTransactions();
+        socket.close();
+    };
+}
+
+// Server đẩy số dư mới mỗi khi có block chạm tới ví của user
+let walletUpdatesSocket = null;
+function subscribeWalletUpdates(retryDelay = 1000) {
+    const accessToken = localStorage.getItem('access_token') || localStorage.getItem('token');
+    if (!accessToken || walletUpdatesSocket) return;
+    
+    walletUpdatesSocket = new WebSocket(`${baseUrl.replace(/^http/, 'ws')}/api/wallets/ws?token=${encodeURIComponent(accessToken)}`);
+    walletUpdatesSocket.onopen = () => { retryDelay = 1000; };
+    walletUpdatesSocket.onmessage = (event) => {
+        const update = JSON.parse(event.data);
+        if (update.type !== 'balance' || !cachedWallets) return;
+        
+        const walletArray = cachedWallets.wallets || cachedWallets;
+        const wallet = walletArray.find(w => w.address === update.address);
+        if (!wallet) {
+            // Ví mới chưa có trong danh sách
+            loadWallets();
+            return;
+        }
+        wallet.balance = update.balance;
+        renderWallets(cachedWallets);
+    };
+    walletUpdatesSocket.onclose = (event) => {
+        walletUpdatesSocket = null;
+        // 1008: token không hợp lệ, không thử lại
+        if (event.code !== 1008) {
+            setTimeout(() => subscribeWalletUpdates(Math.min(retryDelay * 2, 30000)), retryDelay);
+        }
+    };
+}